@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Rate limits and overload shedding for the signaling server
+Everything here runs on the event loop, so it is plain arithmetic on
+monotonic timestamps: no timers and no tasks per connection.
+"""
+
+import time
+
+# Key of the bucket every message of a connection draws from, before its
+# type is even known, and of the bucket shared by unknown message types
+ANY_TYPE = "*"
+OTHER_TYPE = "other"
+
+# Messages per second and burst size, per connection and message type.
+# Renames and resyncs cost a roster update or snapshot each, so they are
+# held to a trickle; ICE candidates arrive in bursts at the start of a call.
+DEFAULT_LIMITS = {
+    ANY_TYPE: (100.0, 200.0),
+    "register": (1.0, 5.0),
+    "update_name": (1.0, 3.0),
+    "resync": (1.0, 3.0),
+    "offer": (5.0, 10.0),
+    "answer": (5.0, 10.0),
+    "ice_candidate": (50.0, 100.0),
+    "ice_candidates": (20.0, 40.0),
+    "hangup": (5.0, 10.0),
+    "call_metrics": (1.0, 5.0),
+    OTHER_TYPE: (5.0, 10.0),
+}
+
+def parse_limit(value):
+    """Parse "rate/burst" (or just "rate", with a burst of the same size)"""
+    rate, _, burst = value.partition("/")
+    return float(rate), float(burst or rate)
+
+class TokenBucket:
+    """Allows `rate` events per second on average, and bursts of up to `burst`"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, now=None):
+        """Spend a token, returning False if none is left"""
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class ConnectionLimits:
+    """The token buckets of one connection, created on first use
+
+    A connection sending a type it never sent before gets a full bucket for
+    it; unknown types share one bucket, so a client can't grow this without
+    bound.
+    """
+
+    __slots__ = ("limits", "buckets", "rejected")
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.buckets = {}  # {message type: TokenBucket}
+        self.rejected = 0
+
+    def allow(self, msg_type, now):
+        """Spend a token for a message of a type, returning False if over its limit"""
+        if msg_type not in self.limits:
+            msg_type = OTHER_TYPE
+        bucket = self.buckets.get(msg_type)
+        if bucket is None:
+            rate, burst = self.limits[msg_type]
+            bucket = self.buckets[msg_type] = TokenBucket(rate, burst, now)
+        if bucket.take(now):
+            return True
+        self.rejected += 1
+        return False
+
+class Overload:
+    """Tracks whether the event loop is falling behind
+
+    While it is, the server sheds presence work and keeps in-call signaling
+    (offers, answers, ICE candidates, hangups) flowing.
+
+    Fed with event loop lag samples: it turns on once lag reaches
+    `threshold` seconds, and off again once lag is back under half of it, so
+    it doesn't flap around the threshold. A threshold of 0 never turns on.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.active = False
+
+    def update(self, lag):
+        """Feed a lag sample, returning True if the state changed"""
+        if not self.threshold:
+            return False
+        if not self.active and lag >= self.threshold:
+            self.active = True
+            return True
+        if self.active and lag < self.threshold / 2:
+            self.active = False
+            return True
+        return False
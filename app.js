@@ -1,6 +1,10 @@
 // Generate a random user ID
 const userId = 'user-' + Math.random().toString(36).substr(2, 9);
 
+// Room to join, from the page URL (e.g. https://host:8443/?room=floor-2).
+// Only peers in the same room are listed.
+const roomName = new URLSearchParams(window.location.search).get('room') || '';
+
 // DOM Elements
 const deviceNameElement = document.getElementById('device-name');
 const editNameBtn = document.getElementById('edit-name-btn');
@@ -17,6 +21,7 @@ const hangupButton = document.getElementById('hangup');
 const toggleMuteButton = document.getElementById('toggle-mute');
 const muteStatusElement = document.getElementById('mute-status');
 const remoteAudioElement = document.getElementById('remote-audio');
+const joinConferenceButton = document.getElementById('join-conference');
 
 // Web Audio API for ringtone
 let audioContext = null;
@@ -114,8 +119,8 @@ function displayLanIp() {
     if (isLocalhost) {
         // If accessing via localhost, show both options
         lanIpElement.innerHTML = `
-            <div class="font-mono">${window.location.protocol}//${lanIp}:${window.location.port}</div>
-            <div class="text-sm text-gray-400 mt-2">Share with others: <span class="font-mono">${window.location.protocol}//${getLocalIP()}:${window.location.port}</span></div>
+            <div class="font-mono">${window.location.protocol}//${lanIp}:${window.location.port}${window.location.search}</div>
+            <div class="text-sm text-gray-400 mt-2">Share with others: <span class="font-mono">${window.location.protocol}//${getLocalIP()}:${window.location.port}${window.location.search}</span></div>
         `;
     } else {
         // If accessing via IP, show IP address
@@ -283,40 +288,159 @@ Please check your browser console for more details.`);
 }
 
 // Solution 3: WebSocket connection with HTTPS/WSS support
-// Use the same hostname as the web page but with port 8765 for WebSocket
+// The unified server (start_server.py --unified) takes WebSocket connections
+// at /ws on the page's own origin; otherwise the signaling server listens on
+// port 8765 of the same host. Try the first and fall back to the second.
 const isHttps = window.location.protocol === 'https:';
 const wsProtocol = isHttps ? 'wss://' : 'ws://';
 const wsHost = window.location.hostname;
 const wsPort = '8765';
-const wsUrl = `${wsProtocol}${wsHost}:${wsPort}`;
+const wsUrls = [
+    `${wsProtocol}${window.location.host}/ws`,
+    `${wsProtocol}${wsHost}:${wsPort}`
+];
+let wsUrlIndex = 0;
+let wsUrlConfirmed = false;
+
+// Signaling protocol version announced at registration. Version 2 lets the
+// server forward offers, answers and candidates without re-encoding them.
+// Outgoing signaling messages must keep `type` and `target_id` as their first
+// two fields so the server can route them from that header alone.
+const PROTOCOL_VERSION = 2;
+
+// Turn a forwarding envelope back into a plain message with sender fields.
+// A batch envelope, holding several ICE messages the server coalesced,
+// becomes one ice_candidates message.
+function unwrapMessage(message) {
+    if (message.v !== 2) {
+        return message;
+    }
+    if (message.batch) {
+        const batch = {
+            type: 'ice_candidates',
+            candidates: [],
+            done: false,
+            sender_id: message.sender_id,
+            sender_name: message.sender_name
+        };
+        message.batch.forEach(payload => {
+            if (payload.type === 'ice_candidate') {
+                batch.candidates.push(payload.candidate);
+            } else {
+                batch.candidates.push(...(payload.candidates || []));
+                batch.done = batch.done || Boolean(payload.done);
+            }
+        });
+        return batch;
+    }
+    return Object.assign({}, message.payload, {
+        type: message.type,
+        sender_id: message.sender_id,
+        sender_name: message.sender_name
+    });
+}
 
 let socket = null;
 let reconnectAttempts = 0;
 const maxReconnectAttempts = 5;
 
+// Reconnect delays double from RECONNECT_BASE_DELAY up to RECONNECT_MAX_DELAY,
+// with jitter so clients turned away together don't all come back together
+const RECONNECT_BASE_DELAY = 2000;
+const RECONNECT_MAX_DELAY = 60000;
+
+function reconnectDelay() {
+    const ceiling = Math.min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** reconnectAttempts);
+    return ceiling / 2 + Math.random() * ceiling / 2;
+}
+
+// Lets a reconnect within the server's grace period pick up the same session,
+// including messages that were sent to us while we were away
+let resumeToken = null;
+
+// Signaling messages sent while the socket is down, flushed after reconnecting.
+// Only the latest MAX_PENDING_MESSAGES are kept.
+let pendingMessages = [];
+const MAX_PENDING_MESSAGES = 50;
+
+// Messages that only mean something during their call, dropped from
+// pendingMessages when it ends
+const CALL_SIGNALING_TYPES = new Set(['offer', 'answer', 'ice_candidate', 'ice_candidates']);
+
+// Send a signaling message, or hold it until the socket reconnects
+function sendMessage(message) {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify(message));
+    } else {
+        pendingMessages.push(message);
+        if (pendingMessages.length > MAX_PENDING_MESSAGES) {
+            pendingMessages.shift();
+        }
+    }
+}
+
 function connectWebSocket() {
     try {
-        socket = new WebSocket(wsUrl);
+        // The token in the URL gets a resumption past a busy server's handshake check
+        const query = resumeToken ? `?resume=${encodeURIComponent(resumeToken)}` : '';
+        socket = new WebSocket(wsUrls[wsUrlIndex] + query);
+        let opened = false;
         
         // WebSocket event handlers
         socket.onopen = function(event) {
-            reconnectAttempts = 0; // Reset reconnect attempts on successful connection
+            opened = true;
+            wsUrlConfirmed = true; // Stick with the address that worked
+            resyncRequested = false;
             
             // Register with the signaling server
             const registerMessage = {
                 type: 'register',
                 user_id: userId,
-                name: deviceName
+                name: deviceName,
+                protocol: PROTOCOL_VERSION
             };
+            if (roomName) {
+                registerMessage.room = roomName;
+            }
+            if (resumeToken) {
+                registerMessage.resume_token = resumeToken;
+            }
             socket.send(JSON.stringify(registerMessage));
+
+            const queued = pendingMessages;
+            pendingMessages = [];
+            queued.forEach(sendMessage);
         };
 
         socket.onmessage = async function(event) {
-            const message = JSON.parse(event.data);
+            let message;
+            try {
+                message = unwrapMessage(JSON.parse(event.data));
+            } catch (error) {
+                return;
+            }
             
             switch(message.type) {
+                case 'session':
+                    // A resumed session keeps its roster; otherwise a snapshot follows
+                    resumeToken = message.resume_token;
+                    reconnectAttempts = 0; // Registered, so the server has room for us again
+                    break;
+                case 'ice_config':
+                    // Sent on every new registration, also when the server
+                    // keeps no sessions to resume (and sends no 'session')
+                    reconnectAttempts = 0;
+                    iceConfig = {
+                        iceServers: message.ice_servers,
+                        iceCandidatePoolSize: message.ice_candidate_pool_size
+                    };
+                    break;
                 case 'client_list':
-                    updatePeersList(message.clients);
+                case 'peer_joined':
+                case 'peer_left':
+                case 'peers_left':
+                case 'peer_renamed':
+                    updatePeersList(message);
                     break;
                 case 'offer':
                     handleOffer(message);
@@ -327,6 +451,9 @@ function connectWebSocket() {
                 case 'ice_candidate':
                     handleIceCandidate(message);
                     break;
+                case 'ice_candidates':
+                    handleIceCandidates(message);
+                    break;
                 case 'hangup':
                     handleHangup(message);
                     break;
@@ -339,11 +466,30 @@ function connectWebSocket() {
 
         socket.onclose = function(event) {
             // No visual indication of connection status since we removed the status elements
-            
-            // Attempt to reconnect if not max attempts reached
-            if (reconnectAttempts < maxReconnectAttempts) {
+
+            // Another connection registered our user ID, so this one is stale
+            if (event.code === 4001) {
+                return;
+            }
+
+            // Never connected: try the next signaling address straight away
+            if (!wsUrlConfirmed && wsUrlIndex < wsUrls.length - 1) {
+                wsUrlIndex++;
+                connectWebSocket();
+                return;
+            }
+
+            if (!wsUrlConfirmed) {
+                wsUrlIndex = 0;
+            }
+            // A busy server refuses the handshake (503, which the browser
+            // only reports as a failed connection) or the registration (1013).
+            // Both mean try again later, for as long as it takes; other
+            // drops get maxReconnectAttempts tries.
+            const retryLater = event.code === 1013 || !opened;
+            if (retryLater || reconnectAttempts < maxReconnectAttempts) {
+                setTimeout(connectWebSocket, reconnectDelay());
                 reconnectAttempts++;
-                setTimeout(connectWebSocket, 2000 * reconnectAttempts); // Exponential backoff
             }
         };
     } catch (error) {
@@ -354,39 +500,115 @@ function connectWebSocket() {
 // Initial connection
 connectWebSocket();
 
-// Enhanced ICE servers configuration with multiple options
-const iceServers = [
-    { urls: 'stun:stun.l.google.com:19302' },
-    { urls: 'stun:stun1.l.google.com:19302' },
-    { urls: 'stun:stun.stunprotocol.org:3478' },
-    { urls: 'stun:stun.voiparound.com' },
-    { urls: 'stun:stun.voipbuster.com' }
-];
+// ICE configuration, replaced by the one the server sends on registration.
+// On a LAN host candidates are all a call needs, so by default there are no
+// ICE servers to wait on.
+let iceConfig = {
+    iceServers: [],
+    iceCandidatePoolSize: 0
+};
+
+// Call setup tracing. The caller picks an ID for the call that rides on its
+// offer, answer, ICE and hangup messages. Each side times its setup phases
+// from pressing Call (caller) or accepting (callee) and reports them to the
+// server once audio arrives, or when the call ends before that.
+let callTrace = null;
+
+function newCallId() {
+    return Math.random().toString(36).substr(2, 10);
+}
+
+function startCallTrace(role, callId) {
+    callTrace = { id: callId, role: role, start: performance.now(), phases: {}, reported: false };
+}
+
+// Record the time a phase was first reached
+function markCallPhase(phase) {
+    if (callTrace && !(phase in callTrace.phases)) {
+        callTrace.phases[phase] = Math.round(performance.now() - callTrace.start);
+    }
+}
+
+function reportCallTrace(completed) {
+    if (!callTrace || callTrace.reported) {
+        return;
+    }
+    callTrace.reported = true;
+    sendMessage({
+        type: 'call_metrics',
+        call_id: callTrace.id,
+        role: callTrace.role,
+        completed: completed,
+        phases: callTrace.phases
+    });
+}
+
+// Fields stamped on every signaling message of the current call
+function callStamp() {
+    return callTrace ? { call_id: callTrace.id } : {};
+}
+
+// Local ICE candidates gathered within this many milliseconds of each other
+// go out in one ice_candidates message
+const ICE_BATCH_DELAY = 50;
+let outgoingCandidates = [];
+let iceBatchTimer = null;
+
+function queueIceCandidate(candidate) {
+    outgoingCandidates.push(candidate);
+    if (iceBatchTimer === null) {
+        iceBatchTimer = setTimeout(() => flushIceCandidates(false), ICE_BATCH_DELAY);
+    }
+}
+
+function flushIceCandidates(done) {
+    clearTimeout(iceBatchTimer);
+    iceBatchTimer = null;
+    if (!currentPeerId || (outgoingCandidates.length === 0 && !done)) {
+        return;
+    }
+    const message = {
+        type: 'ice_candidates',
+        target_id: currentPeerId,
+        ...callStamp(),
+        candidates: outgoingCandidates
+    };
+    if (done) {
+        message.done = true;
+    }
+    outgoingCandidates = [];
+    sendMessage(message);
+}
 
 // Create RTCPeerConnection with better configuration
 function createPeerConnection() {
     try {
-        // Enhanced configuration for better compatibility
-        const config = {
-            iceServers: iceServers,
-            iceCandidatePoolSize: 10
-        };
-        
-        peerConnection = new RTCPeerConnection(config);
+        peerConnection = new RTCPeerConnection(iceConfig);
         
         // Handle ICE candidates
         peerConnection.onicecandidate = event => {
             if (event.candidate) {
-                socket.send(JSON.stringify({
-                    type: 'ice_candidate',
-                    target_id: currentPeerId,
-                    candidate: event.candidate
-                }));
+                markCallPhase('first_candidate');
+                queueIceCandidate(event.candidate);
+            } else {
+                // Gathering finished: send the rest with end-of-candidates
+                flushIceCandidates(true);
             }
         };
         
         // Handle incoming tracks with better audio handling
         peerConnection.ontrack = event => {
+            // The track unmutes when its first packets arrive
+            const firstAudio = () => {
+                markCallPhase('first_audio');
+                reportCallTrace(true);
+            };
+            if (event.track.muted) {
+                event.track.addEventListener('unmute', firstAudio, { once: true });
+            } else {
+                firstAudio();
+            }
+
             // Set the remote stream to the audio element
             remoteAudioElement.srcObject = event.streams[0];
             
@@ -411,6 +633,10 @@ function createPeerConnection() {
         
         // Handle ICE connection state changes
         peerConnection.oniceconnectionstatechange = () => {
+            if (peerConnection.iceConnectionState === 'connected' ||
+                peerConnection.iceConnectionState === 'completed') {
+                markCallPhase('ice_connected');
+            }
             if (peerConnection.iceConnectionState === 'disconnected' || 
                 peerConnection.iceConnectionState === 'failed') {
                 endCall();
@@ -496,6 +722,10 @@ function stopRingtone() {
 
 // Start a call with a peer
 async function startCall(peerId) {
+    if (conferenceSocket) {
+        return;
+    }
+    startCallTrace('caller', newCallId());
     try {
         // Check if media devices are available
         if (!checkMediaDevices()) {
@@ -521,6 +751,7 @@ async function startCall(peerId) {
         };
         
         localStream = await getMediaStream(constraints);
+        markCallPhase('get_user_media');
         
         // Create peer connection
         createPeerConnection();
@@ -540,13 +771,15 @@ async function startCall(peerId) {
         const offer = await peerConnection.createOffer(offerOptions);
         
         await peerConnection.setLocalDescription(offer);
+        markCallPhase('create_offer');
         
         // Send offer to peer via signaling server
-        socket.send(JSON.stringify({
+        sendMessage({
             type: 'offer',
             target_id: peerId,
+            ...callStamp(),
             offer: offer
-        }));
+        });
         
         // Show call controls
         callControlsElement.classList.remove('hidden');
@@ -565,10 +798,19 @@ async function handleOffer(message) {
         // Check if media devices are available
         if (!checkMediaDevices()) {
             // Send hangup to reject the call
-            socket.send(JSON.stringify({
+            sendMessage({
                 type: 'hangup',
                 target_id: message.sender_id
-            }));
+            });
+            return;
+        }
+        
+        // Busy in a group call
+        if (conferenceSocket) {
+            sendMessage({
+                type: 'hangup',
+                target_id: message.sender_id
+            });
             return;
         }
         
@@ -590,15 +832,17 @@ async function handleOffer(message) {
             stopRingtone();
             
             incomingCallElement.classList.add('hidden');
+            // Callers that predate call tracing send no call ID
+            startCallTrace('callee', message.call_id || newCallId());
             
             try {
                 // Test media access before proceeding
                 if (!(await testMediaAccess())) {
                     // Send hangup to reject the call
-                    socket.send(JSON.stringify({
+                    sendMessage({
                         type: 'hangup',
                         target_id: message.sender_id
-                    }));
+                    });
                     endCall();
                     return;
                 }
@@ -614,6 +858,7 @@ async function handleOffer(message) {
                 };
                 
                 localStream = await getMediaStream(constraints);
+                markCallPhase('get_user_media');
                 
                 // Create peer connection
                 createPeerConnection();
@@ -634,13 +879,15 @@ async function handleOffer(message) {
                 const answer = await peerConnection.createAnswer(answerOptions);
                 
                 await peerConnection.setLocalDescription(answer);
+                markCallPhase('create_answer');
                 
                 // Send answer to peer via signaling server
-                socket.send(JSON.stringify({
+                sendMessage({
                     type: 'answer',
                     target_id: message.sender_id,
+                    ...callStamp(),
                     answer: answer
-                }));
+                });
                 
                 // Show call controls
                 callControlsElement.classList.remove('hidden');
@@ -653,10 +900,10 @@ async function handleOffer(message) {
                 alert('Failed to accept call: ' + error.message);
                 
                 // Send hangup to reject the call
-                socket.send(JSON.stringify({
+                sendMessage({
                     type: 'hangup',
                     target_id: message.sender_id
-                }));
+                });
                 
                 // Clean up on error
                 endCall();
@@ -669,10 +916,10 @@ async function handleOffer(message) {
             
             incomingCallElement.classList.add('hidden');
             // Send hangup message to reject the call
-            socket.send(JSON.stringify({
+            sendMessage({
                 type: 'hangup',
                 target_id: message.sender_id
-            }));
+            });
             endCall();
         };
         
@@ -686,6 +933,7 @@ async function handleOffer(message) {
 
 // Handle incoming answer
 async function handleAnswer(message) {
+    markCallPhase('answer_received');
     try {
         await peerConnection.setRemoteDescription(message.answer);
     } catch (error) {
@@ -704,6 +952,20 @@ async function handleIceCandidate(message) {
     }
 }
 
+// Handle a batch of ICE candidates, possibly ending with end-of-candidates
+async function handleIceCandidates(message) {
+    for (const candidate of message.candidates || []) {
+        await handleIceCandidate({ candidate: candidate });
+    }
+    if (message.done && peerConnection) {
+        try {
+            await peerConnection.addIceCandidate();
+        } catch (error) {
+            // Older browsers don't support end-of-candidates
+        }
+    }
+}
+
 // Handle hangup
 function handleHangup(message) {
     // Stop ringtone if it's playing
@@ -714,6 +976,10 @@ function handleHangup(message) {
 
 // End the current call
 function endCall() {
+    // A call that ends before audio arrives reports how far it got
+    reportCallTrace(false);
+    callTrace = null;
+    
     // Hide call UI
     callControlsElement.classList.add('hidden');
     incomingCallElement.classList.add('hidden');
@@ -743,16 +1009,28 @@ function endCall() {
         peerConnection = null;
     }
     
+    // Candidates for the finished call are no use to anyone, nor is its
+    // signaling still waiting for the socket; a hangup still goes out
+    clearTimeout(iceBatchTimer);
+    iceBatchTimer = null;
+    outgoingCandidates = [];
+    pendingMessages = pendingMessages.filter(message => !CALL_SIGNALING_TYPES.has(message.type));
+    
     currentPeerId = null;
 }
 
 // Hang up the current call
 function hangUp() {
+    if (conferenceSocket) {
+        leaveConference();
+        return;
+    }
     if (currentPeerId) {
-        socket.send(JSON.stringify({
+        sendMessage({
             type: 'hangup',
-            target_id: currentPeerId
-        }));
+            target_id: currentPeerId,
+            ...callStamp()
+        });
     }
     endCall();
 }
@@ -775,60 +1053,320 @@ function toggleMute() {
     }
 }
 
-// Update the peers list in the UI
-function updatePeersList(clients) {
-    // Filter out our own ID
-    const peers = clients.filter(client => client.id !== userId);
+// Group calls go through the SFU (sfu_server.py), which listens on its own
+// port. Its offer has one audio stream for our microphone and one per
+// forwarded speaker; it switches who is on each without renegotiating.
+const sfuUrl = wsProtocol + wsHost + ':8766';
+let conferenceSocket = null;
+let conferenceConnection = null;
+let conferenceName = '';
+let conferenceMembers = new Map();
+let conferenceSpeakers = [];
+let conferenceAudio = [];
+
+async function joinConference() {
+    if (peerConnection || conferenceSocket) {
+        return;
+    }
+    if (!checkMediaDevices() || !(await testMediaAccess())) {
+        return;
+    }
     
-    if (peers.length === 0) {
-        peersListElement.innerHTML = `
-            <div class="empty-state">
-                <p>No peers connected yet</p>
-            </div>
-        `;
+    try {
+        localStream = await getMediaStream({
+            audio: {
+                echoCancellation: true,
+                noiseSuppression: true,
+                autoGainControl: true
+            },
+            video: false
+        });
+    } catch (error) {
+        alert('Failed to join group call: ' + error.message);
         return;
     }
     
-    peersListElement.innerHTML = '';
+    conferenceName = roomName || 'lobby';
+    showConference();
+    callControlsElement.classList.remove('hidden');
     
-    peers.forEach(peer => {
-        const peerElement = document.createElement('div');
-        peerElement.className = 'peer-item';
-        peerElement.innerHTML = `
-            <div class="peer-info">
-                <div class="peer-name">${peer.name || peer.id}</div>
-                <div class="peer-status">
-                    <span class="status-indicator status-online"></span>
-                    <span>Online</span>
-                </div>
-            </div>
-            <div class="peer-actions">
-                <button class="btn btn-primary call-button" data-peer-id="${peer.id}">
-                    <span>📞</span> Call
-                </button>
-            </div>
-        `;
-        peersListElement.appendChild(peerElement);
+    const socket = new WebSocket(sfuUrl);
+    conferenceSocket = socket;
+    socket.onopen = () => {
+        socket.send(JSON.stringify({
+            type: 'conference_join',
+            conference: conferenceName,
+            user_id: userId,
+            name: deviceName
+        }));
+    };
+    socket.onmessage = event => {
+        handleConferenceMessage(JSON.parse(event.data));
+    };
+    socket.onclose = () => {
+        if (conferenceSocket === socket) {
+            if (!conferenceConnection) {
+                alert('Group calls are not available on this server');
+            }
+            leaveConference();
+        }
+    };
+}
+
+function handleConferenceMessage(message) {
+    switch (message.type) {
+        case 'conference_offer':
+            answerConference(message.offer);
+            break;
+        case 'conference_members':
+            conferenceMembers = new Map(message.members.map(member => [member.id, member.name]));
+            showConference();
+            break;
+        case 'conference_speakers':
+            conferenceSpeakers = message.speakers;
+            showConference();
+            break;
+        case 'conference_error':
+            alert(message.reason === 'full' ? 'The group call is full' : 'Could not join the group call');
+            leaveConference();
+            break;
+    }
+}
+
+async function answerConference(offer) {
+    try {
+        conferenceConnection = new RTCPeerConnection(iceConfig);
+        
+        // One audio element per forwarded speaker
+        conferenceConnection.ontrack = event => {
+            const audio = new Audio();
+            audio.autoplay = true;
+            audio.srcObject = new MediaStream([event.track]);
+            audio.play().catch(error => {
+                // Played on the next tap instead
+            });
+            conferenceAudio.push(audio);
+        };
+        conferenceConnection.onconnectionstatechange = () => {
+            if (conferenceConnection && conferenceConnection.connectionState === 'failed') {
+                leaveConference();
+            }
+        };
+        
+        await conferenceConnection.setRemoteDescription(offer);
+        // The first stream of the offer is the one the SFU receives on
+        const microphone = conferenceConnection.getTransceivers()[0];
+        microphone.direction = 'sendonly';
+        await microphone.sender.replaceTrack(localStream.getAudioTracks()[0]);
+        await conferenceConnection.setLocalDescription(await conferenceConnection.createAnswer());
+        
+        // The SFU takes no trickled candidates, so the answer carries them
+        // all. With no ICE servers to wait on, gathering is over at once.
+        await iceGatheringComplete(conferenceConnection);
+        conferenceSocket.send(JSON.stringify({
+            type: 'conference_answer',
+            answer: conferenceConnection.localDescription
+        }));
+    } catch (error) {
+        alert('Failed to join group call: ' + error.message);
+        leaveConference();
+    }
+}
+
+function iceGatheringComplete(connection) {
+    if (connection.iceGatheringState === 'complete') {
+        return Promise.resolve();
+    }
+    return new Promise(resolve => {
+        const timer = setTimeout(resolve, 2000);
+        connection.addEventListener('icegatheringstatechange', () => {
+            if (connection.iceGatheringState === 'complete') {
+                clearTimeout(timer);
+                resolve();
+            }
+        });
     });
+}
+
+// Show who is in the group call and whose audio is being forwarded
+function showConference() {
+    const hearing = conferenceSpeakers
+        .filter(id => id && conferenceMembers.has(id))
+        .map(id => conferenceMembers.get(id));
+    let text = `Group call in ${conferenceName}`;
+    if (conferenceMembers.size) {
+        text += ` (${conferenceMembers.size} people)`;
+    }
+    if (hearing.length) {
+        text += ` · Hearing ${hearing.join(', ')}`;
+    }
+    currentPeerElement.textContent = text;
+}
+
+function leaveConference() {
+    const socket = conferenceSocket;
+    conferenceSocket = null;
+    if (socket) {
+        if (socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'conference_leave' }));
+        }
+        socket.close();
+    }
     
-    // Add event listeners to call buttons
-    document.querySelectorAll('.call-button').forEach(button => {
-        button.addEventListener('click', () => {
-            const peerId = button.getAttribute('data-peer-id');
-            startCall(peerId);
-        });
+    if (conferenceConnection) {
+        try {
+            conferenceConnection.close();
+        } catch (e) {
+            // Handle error silently
+        }
+        conferenceConnection = null;
+    }
+    conferenceAudio.forEach(audio => {
+        audio.srcObject = null;
     });
+    conferenceAudio = [];
+    conferenceMembers = new Map();
+    conferenceSpeakers = [];
+    
+    // Hides the call controls and stops the microphone
+    endCall();
+}
+
+// Roster state: version of the last applied snapshot/delta and one element per peer
+let rosterVersion = null;
+let resyncRequested = false;
+const peerElements = new Map();
+
+// Ask the server for a fresh snapshot after missing a roster delta
+function requestRosterResync() {
+    if (resyncRequested || !socket || socket.readyState !== WebSocket.OPEN) {
+        return;
+    }
+    resyncRequested = true;
+    socket.send(JSON.stringify({ type: 'resync' }));
 }
 
+// Create the list entry for a peer
+function createPeerElement(peer) {
+    const peerElement = document.createElement('div');
+    peerElement.className = 'peer-item';
+    peerElement.innerHTML = `
+        <div class="peer-info">
+            <div class="peer-name"></div>
+            <div class="peer-status">
+                <span class="status-indicator status-online"></span>
+                <span>Online</span>
+            </div>
+        </div>
+        <div class="peer-actions">
+            <button class="btn btn-primary call-button">
+                <span>📞</span> Call
+            </button>
+        </div>
+    `;
+    peerElement.querySelector('.peer-name').textContent = peer.name || peer.id;
+    peerElement.querySelector('.call-button').setAttribute('data-peer-id', peer.id);
+    return peerElement;
+}
+
+function addPeer(peer) {
+    // Filter out our own ID
+    if (peer.id === userId) {
+        return;
+    }
+    removePeer(peer.id);
+    const peerElement = createPeerElement(peer);
+    peerElements.set(peer.id, peerElement);
+    peersListElement.appendChild(peerElement);
+}
+
+function removePeer(peerId) {
+    const peerElement = peerElements.get(peerId);
+    if (peerElement) {
+        peerElement.remove();
+        peerElements.delete(peerId);
+    }
+}
+
+function renamePeer(peerId, name) {
+    const peerElement = peerElements.get(peerId);
+    if (peerElement) {
+        peerElement.querySelector('.peer-name').textContent = name || peerId;
+    }
+}
+
+// Show the empty state only when there is nobody to call
+function updateEmptyState() {
+    const emptyState = peersListElement.querySelector('.empty-state');
+    if (peerElements.size === 0 && !emptyState) {
+        peersListElement.insertAdjacentHTML('beforeend', `
+            <div class="empty-state">
+                <p>No peers connected yet</p>
+            </div>
+        `);
+    } else if (peerElements.size > 0 && emptyState) {
+        emptyState.remove();
+    }
+}
+
+// Update the peers list in the UI from a roster snapshot or delta
+function updatePeersList(message) {
+    if (message.type === 'client_list') {
+        // Full snapshot: rebuild the list once
+        rosterVersion = message.version;
+        resyncRequested = false;
+        peerElements.clear();
+        peersListElement.innerHTML = '';
+        message.clients.forEach(addPeer);
+        updateEmptyState();
+        return;
+    }
+
+    // Ignore deltas until we have a snapshot, and deltas it already covers
+    if (rosterVersion === null || message.version <= rosterVersion) {
+        return;
+    }
+    if (message.version !== rosterVersion + 1) {
+        requestRosterResync();
+        return;
+    }
+    rosterVersion = message.version;
+
+    switch (message.type) {
+        case 'peer_joined':
+            addPeer(message.client);
+            break;
+        case 'peer_left':
+            removePeer(message.id);
+            break;
+        case 'peers_left':
+            message.ids.forEach(removePeer);
+            break;
+        case 'peer_renamed':
+            renamePeer(message.id, message.name);
+            break;
+    }
+    updateEmptyState();
+}
+
+// One listener for every call button, including ones added later
+peersListElement.addEventListener('click', (e) => {
+    const button = e.target.closest('.call-button');
+    if (button) {
+        startCall(button.getAttribute('data-peer-id'));
+    }
+});
+
 // Event listeners
 hangupButton.addEventListener('click', hangUp);
+joinConferenceButton.addEventListener('click', joinConference);
 toggleMuteButton.addEventListener('click', toggleMute);
 
 // Handle page visibility changes to detect when user leaves
 document.addEventListener('visibilitychange', () => {
     if (document.visibilityState === 'hidden') {
         // Send hangup if in a call when leaving the page
-        if (currentPeerId) {
+        if (currentPeerId || conferenceSocket) {
             hangUp();
         }
     }
@@ -861,4 +1399,13 @@ document.addEventListener('click', function() {
     if (audioContext && audioContext.state === 'suspended') {
         audioContext.resume();
     }
+    
+    // Group call audio the browser wouldn't autoplay
+    conferenceAudio.forEach(audio => {
+        if (audio.paused) {
+            audio.play().catch(error => {
+                // Handle error silently
+            });
+        }
+    });
 });
\ No newline at end of file
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Benchmark roster broadcast fan-out in the signaling server
+
+Compares the old broadcast path (one json.dumps and one send coroutine per
+recipient, awaited with asyncio.gather) against signaling_server.broadcast,
+which encodes the frame once and queues it on every connection's outbox.
+The fan-out timings include the outbox writers draining their queues.
+
+Sockets are in-memory sinks, so the numbers cover the server's own work
+(encoding, task allocation, framing calls) and not the kernel's.
+
+Usage: python benchmarks/bench_broadcast.py [--sizes 100,1000,10000] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from websockets.protocol import State
+
+import signaling_server
+from outbox import Outbox
+
+class SinkProtocol:
+    """Stand-in for a websockets protocol object that counts bytes sent"""
+
+    def __init__(self):
+        self.state = State.OPEN
+        self.bytes_sent = 0
+
+    def send_text(self, data, fin=True):
+        self.bytes_sent += len(data)
+
+class SinkConnection:
+    """Stand-in for an open websocket connection that discards frames"""
+
+    logger = signaling_server.logger
+    send_in_progress = None
+
+    def __init__(self):
+        self.protocol = SinkProtocol()
+
+    def send_data(self):
+        pass
+
+    async def send(self, message):
+        self.protocol.send_text(message.encode())
+
+async def legacy_broadcast(connections, message):
+    """The pre-fan-out broadcast: encode and await a send per recipient"""
+    tasks = []
+    for client in list(connections):
+        tasks.append(client.send(json.dumps(message)))
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def fanout_broadcast(connections, message):
+    signaling_server.broadcast(message)
+    # Let the writer tasks flush the frame
+    while any(len(outbox) for outbox in signaling_server.outboxes.values()):
+        await asyncio.sleep(0)
+
+def make_delta(version):
+    return {
+        "type": "peer_renamed",
+        "version": version,
+        "id": "user-abcdefghi",
+        "name": "Windows PC 123"
+    }
+
+async def measure(broadcast_fn, size, rounds):
+    """Time and trace memory for one broadcast implementation"""
+    connections = [SinkConnection() for _ in range(size)]
+    for i, connection in enumerate(connections):
+        signaling_server.registry.add(connection, f"user-{i}", f"Device {i}")
+        outbox = Outbox(connection)
+        outbox.start()
+        signaling_server.outboxes[connection] = outbox
+
+    # Warm up so one-time allocations don't count
+    await broadcast_fn(connections, make_delta(0))
+
+    dumps_calls = 0
+    real_dumps = json.dumps
+
+    def counting_dumps(*args, **kwargs):
+        nonlocal dumps_calls
+        dumps_calls += 1
+        return real_dumps(*args, **kwargs)
+
+    json.dumps = counting_dumps
+    try:
+        start = time.perf_counter()
+        for version in range(rounds):
+            await broadcast_fn(connections, make_delta(version))
+        elapsed = time.perf_counter() - start
+    finally:
+        json.dumps = real_dumps
+
+    try:
+        tracemalloc.start()
+        snapshot_before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        await broadcast_fn(connections, make_delta(rounds))
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot_after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    finally:
+        for connection in connections:
+            signaling_server.registry.remove(connection)
+        for outbox in signaling_server.outboxes.values():
+            outbox.close()
+        signaling_server.outboxes.clear()
+
+    allocated_blocks = sum(
+        stat.count_diff for stat in snapshot_after.compare_to(snapshot_before, "filename")
+        if stat.count_diff > 0
+    )
+    return {
+        "connections": size,
+        "us_per_broadcast": elapsed / rounds * 1e6,
+        "json_dumps_per_broadcast": dumps_calls / rounds,
+        "peak_bytes_per_broadcast": peak,
+        "retained_blocks_per_broadcast": allocated_blocks,
+    }
+
+async def run(sizes, rounds):
+    results = []
+    for size in sizes:
+        for name, fn in (("legacy", legacy_broadcast), ("fanout", fanout_broadcast)):
+            result = await measure(fn, size, max(1, rounds * 100 // size))
+            result["path"] = name
+            results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="comma-separated connection counts")
+    parser.add_argument("--rounds", type=int, default=50,
+                        help="broadcasts per size at 100 connections (scaled down for larger sizes)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    signaling_server.logger.setLevel("WARNING")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = asyncio.run(run(sizes, args.rounds))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'path':<8} {'conns':>7} {'us/bcast':>12} {'dumps':>7} {'peak KiB':>10} {'blocks':>8}")
+    for r in results:
+        print(f"{r['path']:<8} {r['connections']:>7} {r['us_per_broadcast']:>12.1f} "
+              f"{r['json_dumps_per_broadcast']:>7.0f} {r['peak_bytes_per_broadcast'] / 1024:>10.1f} "
+              f"{r['retained_blocks_per_broadcast']:>8}")
+
+if __name__ == "__main__":
+    main()
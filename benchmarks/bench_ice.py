@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Time to connect a call with each ICE configuration
+
+Connects pairs of peers in-process with aiortc (pip install aiortc), the way
+two browsers on the LAN connect a call, and times candidate gathering and
+the time until ICE is connected on both sides. The configurations are:
+
+- unreachable_stun: a STUN server that never answers, which is what the
+  public STUN servers app.js used to list look like from an isolated LAN
+- lan: no ICE servers, the default the signaling server now sends
+- lan_stun: the built-in STUN responder of stun_server.py
+
+aiortc gathers every candidate before the offer goes out and uses only the
+first STUN server, so it is a conservative model of a browser: the gap it
+shows is the time lost waiting on one unreachable server, where browsers
+with five servers and a candidate pool of 10 also gather far more
+candidates than a LAN call needs.
+
+Usage: python benchmarks/bench_ice.py [--calls 10] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiortc import RTCConfiguration, RTCIceServer, RTCPeerConnection
+
+from bench_load import percentiles
+from stun_server import start_stun_server
+
+# Setup name -> ICE server URLs; {stun_port} is the local responder's port
+SETUPS = {
+    # TEST-NET-1 is never routed, so requests to it are never answered
+    "unreachable_stun": ["stun:192.0.2.1:3478"],
+    "lan": [],
+    "lan_stun": ["stun:127.0.0.1:{stun_port}"],
+}
+
+def configuration(urls, stun_port):
+    return RTCConfiguration(iceServers=[RTCIceServer(urls=url.format(stun_port=stun_port)) for url in urls])
+
+async def wait_connected(pc):
+    if pc.iceConnectionState == "completed":
+        return
+    connected = asyncio.get_running_loop().create_future()
+
+    @pc.on("iceconnectionstatechange")
+    def on_state():
+        if pc.iceConnectionState == "completed" and not connected.done():
+            connected.set_result(None)
+        elif pc.iceConnectionState == "failed" and not connected.done():
+            connected.set_exception(RuntimeError("ICE failed"))
+
+    await connected
+
+async def connect_call(config):
+    """Connect one call; returns (seconds gathering the offer, seconds until connected)"""
+    caller = RTCPeerConnection(config)
+    callee = RTCPeerConnection(config)
+    try:
+        caller.addTransceiver("audio")
+        started = time.perf_counter()
+        # Like the browser, from pressing Call to both sides connected
+        await caller.setLocalDescription(await caller.createOffer())
+        gathered = time.perf_counter() - started
+        await callee.setRemoteDescription(caller.localDescription)
+        await callee.setLocalDescription(await callee.createAnswer())
+        await caller.setRemoteDescription(callee.localDescription)
+        await asyncio.gather(wait_connected(caller), wait_connected(callee))
+        return gathered, time.perf_counter() - started
+    finally:
+        await caller.close()
+        await callee.close()
+
+async def run(args):
+    stun = await start_stun_server("127.0.0.1", args.stun_port)
+    results = {}
+    for setup, urls in SETUPS.items():
+        config = configuration(urls, args.stun_port)
+        timings = [await connect_call(config) for _ in range(args.calls)]
+        results[setup] = {
+            "gathering": percentiles([gathered for gathered, _ in timings]),
+            "connected": percentiles([connected for _, connected in timings]),
+        }
+    results["stun_requests"] = stun.requests
+    before = results["unreachable_stun"]["connected"]["p50_ms"]
+    results["speedup"] = before / results["lan"]["connected"]["p50_ms"]
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=10, help="calls to connect with each setup")
+    parser.add_argument("--stun-port", type=int, default=13478, help="local UDP port for the STUN responder")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # aioice logs every failed STUN transaction
+    logging.basicConfig(level=logging.ERROR)
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for setup, values in results.items():
+        if not isinstance(values, dict):
+            print(f"{setup}: {values:.2f}" if isinstance(values, float) else f"{setup}: {values}")
+            continue
+        print(f"{setup}:")
+        for key, value in values.items():
+            print(f"  {key}: " + ", ".join(f"{k}={v:.1f}" for k, v in value.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Load test for the signaling server
+
+Starts signaling_server in a child process on a local port and drives it
+with simulated clients that send the same messages as app.js:
+- register
+- update_name
+- offer/answer
+- bursts of batched ICE candidates
+- hangup
+
+The run ends with a reconnect storm: a share of the clients drop their
+connection at once and come back with their resume token.
+
+Reports:
+- frames per second
+- end-to-end forwarding latency percentiles, measured by the clients
+- the server's own latency and broadcast histograms, read from /metrics
+- server RSS per connection and CPU time (Linux only)
+
+Usage: python benchmarks/bench_load.py [--clients 1000] [--room-size 100]
+                                       [--calls 3] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import websockets
+
+# Roughly the size of a browser's audio-only offer
+FAKE_SDP = "v=0\r\n" + "a=candidate:0 1 UDP 2122252543 192.168.1.20 50000 typ host\r\n" * 40
+
+def raise_fd_limit():
+    """Allow as many sockets as the hard limit permits"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+# Server side ---------------------------------------------------------------
+
+async def serve(port):
+    """Run the signaling server on localhost, as the child process"""
+    import signaling_server
+    await signaling_server.start_bus()
+    server = await websockets.serve(
+        signaling_server.handler, "127.0.0.1", port,
+        process_request=signaling_server.process_request, **signaling_server.connection_limits()
+    )
+    signaling_server.spawn(signaling_server.monitor_event_loop())
+    signaling_server.start_heartbeat()
+    print("ready", flush=True)
+    await server.wait_closed()
+
+def start_server(port):
+    # Simulated clients register far faster than real devices; don't let
+    # admission control turn them away unless asked to
+    env = dict(os.environ, SIGNALING_LOG_LEVEL="WARNING")
+    env.setdefault("SIGNALING_REGISTER_RATE", "1000000")
+    env.setdefault("SIGNALING_SHED_LAG", "0")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True
+    )
+    if process.stdout.readline().strip() != "ready":
+        process.kill()
+        raise SystemExit("Signaling server failed to start")
+    return process
+
+def process_usage(pid):
+    """RSS in bytes and user+system CPU seconds of a process, from /proc"""
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    return rss, (int(fields[11]) + int(fields[12])) / ticks
+
+def scrape_metrics(port):
+    """Read the server's /metrics into {sample name with labels: value}"""
+    body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+    samples = {}
+    for line in body.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+def histogram_quantile(samples, name, quantile):
+    """Estimate a quantile from a histogram's buckets (upper bound of the bucket)"""
+    prefix = f'{name}_bucket{{le="'
+    buckets = sorted(
+        (float(key[len(prefix):-2]), value)
+        for key, value in samples.items() if key.startswith(prefix)
+    )
+    total = buckets[-1][1] if buckets else 0
+    for bound, count in buckets:
+        if total and count >= quantile * total:
+            return bound
+    return None
+
+def counter_total(samples, name):
+    return sum(value for key, value in samples.items() if key == name or key.startswith(name + "{"))
+
+# Client side ---------------------------------------------------------------
+
+def unwrap(message):
+    """Flatten a forwarding envelope into a list of payloads, as app.js does"""
+    if message.get("v") != 2:
+        return [message]
+    if "batch" in message:
+        return message["batch"]
+    return [message["payload"]]
+
+class SimClient:
+    """One simulated browser tab"""
+
+    def __init__(self, url, user_id, room, latencies):
+        self.url = url
+        self.user_id = user_id
+        self.room = room
+        self.name = f"Bench {user_id}"
+        self.latencies = latencies
+        self.websocket = None
+        self.token = None
+        self.resumed = None
+        self.registered = None
+        self.waiters = {}  # {message type: Future}
+        self.reader = None
+
+    async def connect(self, resume=False):
+        self.websocket = await websockets.connect(self.url, max_size=None, ping_interval=None)
+        self.registered = asyncio.get_running_loop().create_future()
+        register = {
+            "type": "register",
+            "user_id": self.user_id,
+            "name": self.name,
+            "protocol": 2,
+            "room": self.room
+        }
+        if resume and self.token:
+            register["resume_token"] = self.token
+        await self.websocket.send(json.dumps(register))
+        self.reader = asyncio.create_task(self.read())
+        await self.registered
+
+    async def read(self):
+        try:
+            async for raw in self.websocket:
+                self.dispatch(json.loads(raw))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def dispatch(self, message):
+        now = time.perf_counter()
+        msg_type = message.get("type")
+        if msg_type == "session":
+            self.token = message["resume_token"]
+            self.resumed = message["resumed"]
+            if not self.registered.done():
+                self.registered.set_result(None)
+            return
+        sender = message.get("sender_id")
+        for payload in unwrap(message):
+            if "sent" in payload:
+                self.latencies.append(now - payload["sent"])
+            if payload.get("type") == "offer":
+                asyncio.create_task(self.send({
+                    "type": "answer",
+                    "target_id": sender,
+                    "answer": {"type": "answer", "sdp": FAKE_SDP}
+                }))
+            if payload.get("type") == "ice_candidates" and payload.get("done"):
+                self.resolve("ice_done")
+            self.resolve(payload.get("type"))
+
+    def resolve(self, key):
+        waiter = self.waiters.pop(key, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def expect(self, key):
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[key] = waiter
+        return waiter
+
+    async def send(self, message):
+        # Routing fields first, as app.js sends them; the timestamp goes last
+        # so the server's header match is unaffected
+        message["sent"] = time.perf_counter()
+        await self.websocket.send(json.dumps(message))
+
+    async def send_ice(self, target_id, candidates, batch_size):
+        """Send a burst of candidates in batches, the last one flagged done"""
+        for start in range(0, candidates, batch_size):
+            count = min(batch_size, candidates - start)
+            message = {
+                "type": "ice_candidates",
+                "target_id": target_id,
+                "candidates": [
+                    {"candidate": f"candidate:{start + i} 1 UDP 2122252543 192.168.1.20 {50000 + i} typ host",
+                     "sdpMid": "0", "sdpMLineIndex": 0}
+                    for i in range(count)
+                ]
+            }
+            if start + count >= candidates:
+                message["done"] = True
+            await self.send(message)
+
+    async def drop(self):
+        """Lose the connection without a closing handshake"""
+        self.websocket.transport.abort()
+        await self.reader
+
+    async def close(self):
+        await self.websocket.close()
+
+async def call(caller, callee, candidates, batch_size, timeout):
+    """One call between two clients, following app.js's message sequence"""
+    await caller.send({"type": "update_name", "user_id": caller.user_id, "name": caller.name + "*"})
+    answered = caller.expect("answer")
+    await caller.send({"type": "offer", "target_id": callee.user_id,
+                       "offer": {"type": "offer", "sdp": FAKE_SDP}})
+    await asyncio.wait_for(answered, timeout)
+
+    caller_done, callee_done = callee.expect("ice_done"), caller.expect("ice_done")
+    await asyncio.gather(
+        caller.send_ice(callee.user_id, candidates, batch_size),
+        callee.send_ice(caller.user_id, candidates, batch_size),
+    )
+    await asyncio.wait_for(asyncio.gather(caller_done, callee_done), timeout)
+
+    hung_up = callee.expect("hangup")
+    await caller.send({"type": "hangup", "target_id": callee.user_id})
+    await asyncio.wait_for(hung_up, timeout)
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "p999_ms": pick(0.999), "max_ms": values[-1] * 1000}
+
+async def run(args):
+    server = start_server(args.port)
+    url = f"ws://127.0.0.1:{args.port}"
+    latencies = []
+    results = {"clients": args.clients, "room_size": args.room_size, "calls_per_pair": args.calls}
+    try:
+        base_rss, base_cpu = process_usage(server.pid)
+
+        # Phase 1: everyone registers, in waves, triggering roster broadcasts
+        clients = [
+            SimClient(url, f"user-{i}", f"room-{i // args.room_size}", latencies)
+            for i in range(args.clients)
+        ]
+        start = time.perf_counter()
+        for wave in range(0, len(clients), args.connect_batch):
+            await asyncio.gather(*(c.connect() for c in clients[wave:wave + args.connect_batch]))
+        connect_elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.5)
+        rss, cpu = process_usage(server.pid)
+        metrics = scrape_metrics(args.port)
+        results["register"] = {
+            "seconds": connect_elapsed,
+            "registrations_per_second": args.clients / connect_elapsed,
+            "rss_bytes_per_connection": (rss - base_rss) / args.clients,
+            "server_cpu_seconds": cpu - base_cpu,
+            "broadcasts": metrics.get("signaling_broadcast_seconds_count", 0),
+            "broadcast_mean_us": (
+                metrics["signaling_broadcast_seconds_sum"] / metrics["signaling_broadcast_seconds_count"] * 1e6
+                if metrics.get("signaling_broadcast_seconds_count") else None
+            ),
+            "broadcast_p99_ms": (histogram_quantile(metrics, "signaling_broadcast_seconds", 0.99) or 0) * 1000,
+        }
+
+        # Phase 2: calls between pairs within each room
+        frames_before = counter_total(metrics, "signaling_frames_in_total")
+        cpu_before = cpu
+        pairs = [(clients[i], clients[i + 1]) for i in range(0, len(clients) - 1, 2)]
+
+        async def pair_calls(caller, callee):
+            for _ in range(args.calls):
+                await call(caller, callee, args.candidates, args.batch_size, args.timeout)
+
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(pair_calls(a, b) for a, b in pairs), return_exceptions=True)
+        calls_elapsed = time.perf_counter() - start
+        metrics = scrape_metrics(args.port)
+        _, cpu = process_usage(server.pid)
+        frames = counter_total(metrics, "signaling_frames_in_total") - frames_before
+        results["calls"] = {
+            "seconds": calls_elapsed,
+            "calls": len(pairs) * args.calls,
+            "failed_pairs": sum(isinstance(outcome, Exception) for outcome in outcomes),
+            "frames_in": frames,
+            "frames_per_second": frames / calls_elapsed,
+            "server_cpu_seconds": cpu - cpu_before,
+            "end_to_end_latency": percentiles(latencies),
+            "server_latency_p50_ms": (histogram_quantile(metrics, "signaling_forward_latency_seconds", 0.5) or 0) * 1000,
+            "server_latency_p99_ms": (histogram_quantile(metrics, "signaling_forward_latency_seconds", 0.99) or 0) * 1000,
+            "forward_failures": counter_total(metrics, "signaling_forward_failures_total"),
+            "event_loop_lag_p99_ms": (histogram_quantile(metrics, "signaling_event_loop_lag_seconds", 0.99) or 0) * 1000,
+        }
+
+        # Phase 3: reconnect storm
+        stormers = random.Random(0).sample(clients, int(len(clients) * args.reconnect_share))
+        await asyncio.gather(*(c.drop() for c in stormers))
+        start = time.perf_counter()
+        await asyncio.gather(*(c.connect(resume=True) for c in stormers))
+        storm_elapsed = time.perf_counter() - start
+        results["reconnect_storm"] = {
+            "clients": len(stormers),
+            "seconds": storm_elapsed,
+            "resumed": sum(1 for c in stormers if c.resumed),
+            "reconnects_per_second": len(stormers) / storm_elapsed if storm_elapsed else None,
+        }
+
+        rss, cpu = process_usage(server.pid)
+        results["server"] = {"rss_bytes": rss, "cpu_seconds": cpu}
+        await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1000, help="simulated clients")
+    parser.add_argument("--room-size", type=int, default=100, help="clients per room")
+    parser.add_argument("--calls", type=int, default=3, help="calls made by each pair of clients")
+    parser.add_argument("--candidates", type=int, default=10, help="ICE candidates each side sends per call")
+    parser.add_argument("--batch-size", type=int, default=5, help="candidates per ice_candidates message")
+    parser.add_argument("--reconnect-share", type=float, default=0.5,
+                        help="share of clients that drop and resume at once")
+    parser.add_argument("--connect-batch", type=int, default=200, help="clients connecting concurrently")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for each step of a call")
+    parser.add_argument("--port", type=int, default=18765, help="local port for the server under test")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    if args.serve:
+        asyncio.run(serve(args.serve))
+        return
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for phase, values in results.items():
+        if not isinstance(values, dict):
+            print(f"{phase}: {values}")
+            continue
+        print(f"{phase}:")
+        for key, value in values.items():
+            if isinstance(value, dict):
+                value = ", ".join(f"{k}={v:.2f}" for k, v in value.items())
+            elif isinstance(value, float):
+                value = f"{value:.2f}"
+            print(f"  {key}: {value}")
+
+if __name__ == "__main__":
+    main()
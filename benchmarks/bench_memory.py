@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Memory cost of idle connections to the signaling server
+
+Starts the signaling server in a child process, once with the websockets
+library's default per-connection limits and compression, and once with the
+limits the server uses (the SIGNALING_MAX_MESSAGE_SIZE, SIGNALING_MAX_QUEUE,
+SIGNALING_WRITE_LIMIT and SIGNALING_COMPRESSION settings in the
+environment). Each time it opens many connections that register and then sit
+idle, like background browser tabs, and reports the growth of the server's
+RSS per connection (Linux only).
+
+Usage: python benchmarks/bench_memory.py [--clients 5000] [--room-size 20]
+                                         [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import websockets
+
+from bench_load import process_usage, raise_fd_limit, scrape_metrics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_LOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_load.py")
+
+# Settings name -> environment for the server
+SETTINGS = {
+    "websockets_defaults": {
+        "SIGNALING_MAX_MESSAGE_SIZE": str(1024 * 1024),
+        "SIGNALING_MAX_QUEUE": "16",
+        "SIGNALING_WRITE_LIMIT": str(32 * 1024),
+        "SIGNALING_COMPRESSION": "deflate",
+    },
+    "server": {},
+}
+
+def start_server(port, overrides):
+    """Run the same server as bench_load.py, with some settings overridden"""
+    # Simulated clients register far faster than real devices; don't let
+    # admission control turn them away unless asked to
+    env = dict(os.environ, SIGNALING_LOG_LEVEL="WARNING", **overrides)
+    env.setdefault("SIGNALING_REGISTER_RATE", "1000000")
+    env.setdefault("SIGNALING_SHED_LAG", "0")
+    process = subprocess.Popen(
+        [sys.executable, BENCH_LOAD, "--serve", str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True
+    )
+    if process.stdout.readline().strip() != "ready":
+        process.kill()
+        raise SystemExit("Signaling server failed to start")
+    return process
+
+async def drain(websocket):
+    try:
+        async for _ in websocket:
+            pass
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+async def open_client(url, index, room_size):
+    websocket = await websockets.connect(url, max_size=None)
+    await websocket.send(json.dumps({
+        "type": "register",
+        "user_id": f"idle-{index}",
+        "name": f"Tab {index}",
+        "protocol": 2,
+        "room": f"room-{index // room_size}",
+    }))
+    return websocket, asyncio.create_task(drain(websocket))
+
+async def wait_for_sessions(port, count, timeout=60):
+    """Wait until the server has registered count sessions"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if scrape_metrics(port).get("signaling_sessions", 0) >= count:
+            return
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"Only {scrape_metrics(port).get('signaling_sessions', 0)} of {count} clients registered")
+
+async def measure(name, args):
+    server = start_server(args.port, SETTINGS[name])
+    url = f"ws://127.0.0.1:{args.port}"
+    clients = []
+    try:
+        # Let the server reach a steady state before the baseline
+        clients.append(await open_client(url, -1, args.room_size))
+        await wait_for_sessions(args.port, 1)
+        baseline, _ = process_usage(server.pid)
+
+        for start in range(0, args.clients, args.connect_batch):
+            batch = range(start, min(start + args.connect_batch, args.clients))
+            clients.extend(await asyncio.gather(*(open_client(url, i, args.room_size) for i in batch)))
+        await wait_for_sessions(args.port, args.clients + 1)
+        # Roster broadcasts settle, then the connections are idle
+        await asyncio.sleep(args.settle)
+        rss, _ = process_usage(server.pid)
+        return {
+            "clients": args.clients,
+            "rss_baseline_mb": baseline / 2**20,
+            "rss_mb": rss / 2**20,
+            "bytes_per_connection": (rss - baseline) / args.clients,
+        }
+    finally:
+        for websocket, reader in clients:
+            await websocket.close()
+            await reader
+        server.terminate()
+        server.wait()
+
+async def run(args):
+    results = {name: await measure(name, args) for name in SETTINGS}
+    results["saving"] = 1 - (results["server"]["bytes_per_connection"]
+                             / results["websockets_defaults"]["bytes_per_connection"])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=5000, help="idle connections to open")
+    parser.add_argument("--room-size", type=int, default=20, help="clients per room")
+    parser.add_argument("--connect-batch", type=int, default=200, help="clients connecting concurrently")
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to wait before measuring")
+    parser.add_argument("--port", type=int, default=18766, help="local port for the server under test")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name, values in results.items():
+        if not isinstance(values, dict):
+            print(f"{name}: {values:.0%}")
+            continue
+        print(f"{name}:")
+        for key, value in values.items():
+            if isinstance(value, float):
+                value = f"{value:.2f}"
+            print(f"  {key}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+CPU cost of the SFU per conference participant
+
+Starts sfu_server.py in a child process and fills one conference with
+headless aiortc clients (pip install aiortc). A few of them talk, sending a
+tone; the rest send quiet noise, like muted-in-spirit listeners. Each size
+runs for a while once every client is receiving audio, and the benchmark
+reports the SFU's CPU time per second of call, per participant (Linux only),
+along with the audio packets clients received from it.
+
+The clients run in this process; on a machine with few cores they compete
+with the SFU for CPU, so compare the server figures between runs on the
+same machine rather than reading them as absolute.
+
+Usage: python benchmarks/bench_sfu.py [--sizes 2,4,8] [--talkers 2]
+                                      [--duration 10] [--json]
+"""
+
+import argparse
+import array
+import asyncio
+import fractions
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+from aiortc import MediaStreamTrack, RTCPeerConnection, RTCSessionDescription
+from aiortc.mediastreams import MediaStreamError
+from av import AudioFrame
+
+from bench_load import process_usage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lan_utils import READY_FILE_ENV
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960
+
+def tone(frequency, amplitude):
+    """One 20 ms frame of a sine wave, as s16 mono bytes"""
+    return array.array("h", (
+        int(amplitude * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE)) for i in range(FRAME_SAMPLES)
+    )).tobytes()
+
+def noise(amplitude):
+    return array.array("h", (random.randint(-amplitude, amplitude) for _ in range(FRAME_SAMPLES))).tobytes()
+
+class SyntheticAudio(MediaStreamTrack):
+    """A microphone playing the same 20 ms frame over and over, in real time"""
+
+    kind = "audio"
+
+    def __init__(self, samples):
+        super().__init__()
+        self.samples = samples
+        self.pts = 0
+        self.started = None
+
+    async def recv(self):
+        if self.started is None:
+            self.started = time.monotonic()
+        else:
+            self.pts += FRAME_SAMPLES
+            await asyncio.sleep(max(0.0, self.started + self.pts / SAMPLE_RATE - time.monotonic()))
+        frame = AudioFrame(format="s16", layout="mono", samples=FRAME_SAMPLES)
+        frame.planes[0].update(self.samples)
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = self.pts
+        frame.time_base = fractions.Fraction(1, SAMPLE_RATE)
+        return frame
+
+class Client:
+    """A headless conference participant"""
+
+    def __init__(self, index, talking):
+        self.id = f"client-{index}"
+        self.talking = talking
+        self.pc = RTCPeerConnection()
+        self.websocket = None
+        self.frames = 0  # audio frames received from the SFU
+        self.readers = []
+
+    async def consume(self, track):
+        while True:
+            try:
+                await track.recv()
+            except MediaStreamError:
+                return
+            self.frames += 1
+
+    async def join(self, url, conference):
+        self.websocket = await websockets.connect(url, max_size=None)
+        await self.websocket.send(json.dumps({
+            "type": "conference_join", "conference": conference, "user_id": self.id, "name": self.id
+        }))
+        while True:
+            message = json.loads(await self.websocket.recv())
+            if message["type"] == "conference_offer":
+                break
+            if message["type"] == "conference_error":
+                raise SystemExit(f"{self.id} could not join: {message['reason']}")
+
+        @self.pc.on("track")
+        def on_track(track):
+            self.readers.append(asyncio.create_task(self.consume(track)))
+
+        await self.pc.setRemoteDescription(RTCSessionDescription(**message["offer"]))
+        # Takes the first audio transceiver: the one the SFU receives on
+        samples = tone(440 + 110 * random.random(), 8000) if self.talking else noise(30)
+        self.pc.addTrack(SyntheticAudio(samples))
+        await self.pc.setLocalDescription(await self.pc.createAnswer())
+        await self.websocket.send(json.dumps({
+            "type": "conference_answer",
+            "answer": {"type": self.pc.localDescription.type, "sdp": self.pc.localDescription.sdp}
+        }))
+
+    async def leave(self):
+        for reader in self.readers:
+            reader.cancel()
+        await self.pc.close()
+        await self.websocket.close()
+
+def start_server(port, forwarded):
+    ready_file = os.path.join(tempfile.mkdtemp(prefix="bench-sfu-"), "ready")
+    env = dict(os.environ, SFU_PORT=str(port), SFU_FORWARDED_SPEAKERS=str(forwarded),
+               SIGNALING_LOG_LEVEL="WARNING", **{READY_FILE_ENV: ready_file})
+    # Plain ws: certificates in the working directory would turn on TLS
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "sfu_server.py")],
+                               cwd=tempfile.gettempdir(), env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while not os.path.exists(ready_file):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise SystemExit("SFU failed to start")
+        time.sleep(0.05)
+    return process
+
+async def wait_for_audio(clients, timeout=30):
+    """Wait until every client is receiving audio"""
+    deadline = time.monotonic() + timeout
+    while any(client.frames == 0 for client in clients):
+        if time.monotonic() > deadline:
+            raise SystemExit(f"{sum(c.frames == 0 for c in clients)} clients never received audio")
+        await asyncio.sleep(0.1)
+
+async def measure(size, args, server):
+    url = f"ws://127.0.0.1:{args.port}"
+    clients = [Client(index, index < args.talkers) for index in range(size)]
+    try:
+        for client in clients:
+            await client.join(url, f"bench-{size}")
+        await wait_for_audio(clients)
+        # Let speaker selection settle
+        await asyncio.sleep(1)
+
+        frames_before = sum(client.frames for client in clients)
+        _, cpu_before = process_usage(server.pid)
+        started = time.monotonic()
+        await asyncio.sleep(args.duration)
+        elapsed = time.monotonic() - started
+        _, cpu_after = process_usage(server.pid)
+        frames = sum(client.frames for client in clients) - frames_before
+
+        cpu = (cpu_after - cpu_before) / elapsed
+        return {
+            "participants": size,
+            "server_cpu_percent": cpu * 100,
+            "server_cpu_percent_per_participant": cpu * 100 / size,
+            "packets_received_per_second_per_client": frames / elapsed / size,
+        }
+    finally:
+        for client in clients:
+            await client.leave()
+
+async def run(args):
+    server = start_server(args.port, args.forwarded)
+    try:
+        return {f"participants_{size}": await measure(size, args, server) for size in args.sizes}
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in s.split(",")], default=[2, 4, 8],
+                        help="conference sizes to measure, comma-separated")
+    parser.add_argument("--talkers", type=int, default=2, help="participants sending a tone")
+    parser.add_argument("--forwarded", type=int, default=3, help="speakers the SFU forwards to each participant")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds measured per size")
+    parser.add_argument("--port", type=int, default=18766, help="local port for the SFU under test")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # aioice logs every failed connectivity check
+    logging.basicConfig(level=logging.ERROR)
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name, values in results.items():
+        print(f"{name}:")
+        for key, value in values.items():
+            if isinstance(value, float):
+                value = f"{value:.2f}"
+            print(f"  {key}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+TLS handshake throughput during a reconnect storm
+
+Compares the servers' old TLS setup (an RSA-2048 certificate and a default
+SSLContext) with the current one (an ECDSA P-256 certificate and the shared
+context from tls_config). Each setup runs in an asyncio server in a child
+process. Clients connect once to pick up a session ticket, then all
+reconnect at once, either resuming that session or doing a full handshake.
+
+Reports handshakes per second, handshake latency percentiles, how many
+handshakes were resumed and the server's CPU time per handshake (Linux only).
+Clients and server share the machine, so the server's CPU time per
+handshake is the steadier figure.
+
+Usage: python benchmarks/bench_tls.py [--clients 200] [--concurrency 16]
+                                      [--json]
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Setup name -> (certificate key type, use the tuned shared context)
+SETUPS = {
+    "rsa_default": ("rsa", False),
+    "ecdsa_tuned": ("ecdsa", True),
+}
+
+def make_certificates(directory):
+    """Write an RSA and an ECDSA certificate into directory/<key type>/"""
+    from generate_cert import generate_self_signed_cert
+    cwd = os.getcwd()
+    try:
+        for key_type in ("rsa", "ecdsa"):
+            os.makedirs(os.path.join(directory, key_type))
+            os.chdir(os.path.join(directory, key_type))
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_self_signed_cert(key_type)
+    finally:
+        os.chdir(cwd)
+
+# Server side ---------------------------------------------------------------
+
+async def answer(reader, writer):
+    """Complete the handshake (done by asyncio before this runs), say ok and close"""
+    try:
+        writer.write(b"ok")
+        await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(setup, port, cert_dir):
+    """Run a TLS server with one setup, as the child process"""
+    key_type, tuned = SETUPS[setup]
+    cert_file = os.path.join(cert_dir, key_type, "server.crt")
+    key_file = os.path.join(cert_dir, key_type, "server.key")
+    if tuned:
+        from tls_config import server_context
+        context = server_context(cert_file, key_file)
+    else:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+    server = await asyncio.start_server(answer, "127.0.0.1", port, ssl=context, backlog=1024)
+    print("ready", flush=True)
+    async with server:
+        await server.serve_forever()
+
+def start_server(setup, port, cert_dir):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", setup, str(port), cert_dir],
+        cwd=ROOT, stdout=subprocess.PIPE, text=True
+    )
+    if process.stdout.readline().strip() != "ready":
+        process.kill()
+        raise SystemExit(f"{setup} server failed to start")
+    return process
+
+def process_cpu(pid):
+    """User+system CPU seconds of a process, from /proc"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+# Client side ---------------------------------------------------------------
+
+def client_context():
+    # The certificates are self-signed
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+def handshake(context, port, session=None):
+    """Connect once; returns (seconds, the session to resume next, whether this one was resumed)"""
+    started = time.perf_counter()
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        with context.wrap_socket(sock, session=session) as tls:
+            elapsed = time.perf_counter() - started
+            # TLS 1.3 tickets arrive after the handshake, with the first data
+            tls.recv(2)
+            return elapsed, tls.session, tls.session_reused
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": values[-1] * 1000}
+
+def storm(pool, context, port, sessions):
+    """Reconnect every client at once; sessions is one session (or None) per client"""
+    futures = [pool.submit(handshake, context, port, session) for session in sessions]
+    return [future.result() for future in futures]
+
+def run_setup(setup, args, cert_dir):
+    server = start_server(setup, args.port, cert_dir)
+    context = client_context()
+    results = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+            # First visit: every client gets a session to resume later
+            sessions = [session for _, session, _ in storm(pool, context, args.port, [None] * args.clients)]
+            for mode in ("full", "resumed"):
+                cpu_before = process_cpu(server.pid)
+                started = time.perf_counter()
+                outcomes = storm(pool, context, args.port, sessions if mode == "resumed" else [None] * args.clients)
+                elapsed = time.perf_counter() - started
+                cpu_after = process_cpu(server.pid)
+                results[mode] = {
+                    "handshakes_per_second": len(outcomes) / elapsed,
+                    "latency": percentiles([seconds for seconds, _, _ in outcomes]),
+                    "resumed": sum(reused for _, _, reused in outcomes),
+                }
+                if cpu_before is not None:
+                    results[mode]["server_cpu_ms_per_handshake"] = (cpu_after - cpu_before) / len(outcomes) * 1000
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=200, help="clients reconnecting at once")
+    parser.add_argument("--concurrency", type=int, default=16, help="handshakes in flight at a time")
+    parser.add_argument("--port", type=int, default=18443, help="local port for the server under test")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--serve", nargs=3, metavar=("SETUP", "PORT", "CERT_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        setup, port, cert_dir = args.serve
+        asyncio.run(serve(setup, int(port), cert_dir))
+        return
+
+    with tempfile.TemporaryDirectory() as cert_dir:
+        make_certificates(cert_dir)
+        results = {setup: run_setup(setup, args, cert_dir) for setup in SETUPS}
+    before, after = results["rsa_default"]["full"], results["ecdsa_tuned"]["resumed"]
+    results["speedup"] = after["handshakes_per_second"] / before["handshakes_per_second"]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for setup, modes in results.items():
+        if not isinstance(modes, dict):
+            print(f"{setup}: {modes:.2f}")
+            continue
+        print(f"{setup}:")
+        for mode, values in modes.items():
+            print(f"  {mode}:")
+            for key, value in values.items():
+                if isinstance(value, dict):
+                    value = ", ".join(f"{k}={v:.2f}" for k, v in value.items())
+                elif isinstance(value, float):
+                    value = f"{value:.2f}"
+                print(f"    {key}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded signaling trace against a running server
+
+Each traced connection is reopened and sends its frames again, at the
+original pace or sped up, while its incoming frames are drained the way a
+browser would. Record a trace by starting the server with
+SIGNALING_TRACE=<file> (and SIGNALING_TRACE_REDACT=1 to blank out SDP).
+
+Reports how far behind schedule the replay fell (the server pushing back),
+connect latency and the server's forwarding latency from /metrics.
+
+Resume tokens in a trace have long expired, so replayed reconnects
+register as new sessions.
+
+Usage: python benchmarks/replay_trace.py TRACE [--url ws://127.0.0.1:8765]
+                                         [--speed 10] [--max-gap 5] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import ssl
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websockets
+
+from bench_load import counter_total
+from trace_recorder import read_trace
+
+def compress_gaps(events, max_gap):
+    """Start at the first event and shorten idle stretches longer than
+    max_gap seconds"""
+    shift = events[0][0] if events else 0.0
+    previous = None
+    for event in events:
+        if previous is not None and event[0] - previous > max_gap:
+            shift += event[0] - previous - max_gap
+        previous = event[0]
+        event[0] -= shift
+    return events
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "p999_ms": pick(0.999), "max_ms": values[-1] * 1000}
+
+class Replay:
+    def __init__(self, url, speed, ssl_context):
+        self.url = url
+        self.speed = speed
+        self.ssl_context = ssl_context
+        self.start = None
+        self.send_lag = []
+        self.connect_times = []
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.errors = 0
+
+    def due(self, timestamp):
+        """Wall-clock time an event should happen at"""
+        return self.start + (timestamp / self.speed if self.speed else 0)
+
+    async def wait_until(self, timestamp):
+        delay = self.due(timestamp) - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def drain(self, websocket):
+        try:
+            async for _ in websocket:
+                self.frames_received += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def connection(self, events):
+        """Replay one traced connection's events in order"""
+        websocket = None
+        reader = None
+        try:
+            for timestamp, _, kind, *frame in events:
+                await self.wait_until(timestamp)
+                if kind == "o":
+                    opened = time.perf_counter()
+                    websocket = await websockets.connect(
+                        self.url, ssl=self.ssl_context, max_size=None, ping_interval=None
+                    )
+                    self.connect_times.append(time.perf_counter() - opened)
+                    reader = asyncio.create_task(self.drain(websocket))
+                elif kind == "m" and websocket is not None:
+                    self.send_lag.append(max(0.0, time.perf_counter() - self.due(timestamp)))
+                    await websocket.send(frame[0])
+                    self.frames_sent += 1
+                elif kind == "c" and websocket is not None:
+                    await websocket.close()
+        except (OSError, websockets.exceptions.WebSocketException):
+            self.errors += 1
+        finally:
+            if websocket is not None:
+                await websocket.close()
+            if reader is not None:
+                await reader
+
+    async def run(self, events):
+        connections = {}
+        for event in events:
+            connections.setdefault(event[1], []).append(event)
+        self.start = time.perf_counter()
+        await asyncio.gather(*(self.connection(evs) for evs in connections.values()))
+        return time.perf_counter() - self.start
+
+def metrics_url(url):
+    """The /metrics URL of the server behind a WebSocket URL, which in
+    unified mode has a path of its own (/ws)"""
+    parts = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit((parts.scheme.replace("ws", "http", 1), parts.netloc, "/metrics", "", ""))
+
+def scrape_latency(url, ssl_context):
+    """Read the forwarding latency histogram sum and count from /metrics,
+    summed over labels (a worker pool labels every series by worker)"""
+    body = urllib.request.urlopen(url, context=ssl_context).read().decode()
+    samples = {}
+    for line in body.splitlines():
+        if line.startswith("signaling_forward_latency_seconds_"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return {name: counter_total(samples, name) for name in
+            ("signaling_forward_latency_seconds_sum", "signaling_forward_latency_seconds_count")}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", help="trace file written by the signaling server")
+    parser.add_argument("--url", default="ws://127.0.0.1:8765", help="signaling server to replay against")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="speed-up factor; 0 sends everything as fast as possible")
+    parser.add_argument("--max-gap", type=float, default=5.0,
+                        help="shorten idle periods in the trace to this many seconds")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    header, events = read_trace(args.trace)
+    events = compress_gaps(events, args.max_gap)
+
+    ssl_context = None
+    if args.url.startswith("wss://"):
+        # The server uses a self-signed certificate
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+    status_url = metrics_url(args.url)
+
+    try:
+        before = scrape_latency(status_url, ssl_context)
+    except OSError:
+        before = None
+
+    replay = Replay(args.url, args.speed, ssl_context)
+    elapsed = asyncio.run(replay.run(events))
+
+    results = {
+        "trace_start": header["start"],
+        "trace_seconds": events[-1][0] if events else 0,
+        "connections": len({event[1] for event in events}),
+        "speed": args.speed,
+        "seconds": elapsed,
+        "frames_sent": replay.frames_sent,
+        "frames_received": replay.frames_received,
+        "frames_per_second": replay.frames_sent / elapsed if elapsed else None,
+        "errors": replay.errors,
+        "send_lag": percentiles(replay.send_lag),
+        "connect": percentiles(replay.connect_times),
+    }
+    if before is not None:
+        after = scrape_latency(status_url, ssl_context)
+        count = after["signaling_forward_latency_seconds_count"] - before["signaling_forward_latency_seconds_count"]
+        total = after["signaling_forward_latency_seconds_sum"] - before["signaling_forward_latency_seconds_sum"]
+        results["server_forward_latency_mean_ms"] = total / count * 1000 if count else None
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for key, value in results.items():
+        if isinstance(value, dict):
+            value = ", ".join(f"{k}={v:.2f}" for k, v in value.items())
+        elif isinstance(value, float):
+            value = f"{value:.2f}"
+        print(f"{key}: {value}")
+
+if __name__ == "__main__":
+    main()
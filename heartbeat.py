@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Liveness checks for every connection of the signaling server, driven by
+one timer wheel instead of a keepalive task and timer per socket
+"""
+
+import asyncio
+import logging
+import math
+
+from websockets.exceptions import ConnectionClosed
+from websockets.protocol import State
+
+logger = logging.getLogger(__name__)
+
+class Heartbeat:
+    """Pings quiet connections and reports the ones that stop answering
+
+    Any frame received from a connection (reported with touch()) or a pong
+    counts as a sign of life. A connection silent for `interval` seconds is
+    pinged; if nothing arrives within `timeout` seconds of the ping, it is
+    dead. Each connection sits in one slot of a wheel that turns one slot
+    every `tick` seconds, so a turn only visits the connections due then;
+    deadlines are rounded up to whole ticks.
+
+    Pings are sent from tasks of their own: ping() waits for the write
+    buffer to drain, and a peer that stopped reading never lets it. Such a
+    connection (its writing paused) isn't pinged at all, and is dead unless
+    heard from before the timeout.
+
+    Dead connections found on the same tick are passed to on_dead together,
+    as one list.
+    """
+
+    def __init__(self, interval, timeout, on_dead, tick=1.0):
+        self.interval = interval
+        self.timeout = timeout
+        self.on_dead = on_dead
+        self.tick = tick
+        self.slots = [set() for _ in range(math.ceil(max(interval, timeout) / tick) + 1)]
+        self.cursor = 0
+        self.slot_of = {}  # {websocket: slot index}
+        self.last_seen = {}  # {websocket: loop time it was last heard from}
+        self.pinged = {}  # {websocket: loop time of the unanswered ping}
+        self.ping_tasks = set()
+        self.task = None
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def start(self):
+        """Start turning the wheel"""
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for task in self.ping_tasks:
+            task.cancel()
+
+    def schedule(self, websocket, delay):
+        """Visit a websocket again in delay seconds (rounded up to a tick)"""
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self.slots))
+        # The slot at the cursor is the next one visited, one tick from now
+        slot = (self.cursor + ticks - 1) % len(self.slots)
+        self.slots[slot].add(websocket)
+        self.slot_of[websocket] = slot
+
+    def add(self, websocket):
+        """Start watching a new connection"""
+        self.last_seen[websocket] = asyncio.get_running_loop().time()
+        self.schedule(websocket, self.interval)
+
+    def remove(self, websocket):
+        """Stop watching a connection"""
+        slot = self.slot_of.pop(websocket, None)
+        if slot is not None:
+            self.slots[slot].discard(websocket)
+        self.last_seen.pop(websocket, None)
+        self.pinged.pop(websocket, None)
+
+    def touch(self, websocket):
+        """Note that a connection was heard from"""
+        if websocket in self.last_seen:
+            self.last_seen[websocket] = asyncio.get_running_loop().time()
+
+    def pong(self, websocket, pong_received):
+        if not pong_received.cancelled() and pong_received.exception() is None:
+            self.touch(websocket)
+
+    async def ping(self, websocket):
+        # On a closing connection ping() would wait for the close to finish
+        if websocket.state is not State.OPEN:
+            return
+        try:
+            pong_received = await asyncio.wait_for(websocket.ping(), self.timeout)
+        except (ConnectionClosed, asyncio.TimeoutError):
+            return
+        pong_received.add_done_callback(lambda future: self.pong(websocket, future))
+
+    def send_ping(self, websocket):
+        """Ping a connection without waiting for the ping to be written"""
+        if websocket.paused:
+            return
+        task = asyncio.create_task(self.ping(websocket))
+        self.ping_tasks.add(task)
+        task.add_done_callback(self.ping_tasks.discard)
+
+    def turn(self):
+        """Advance one slot, pinging quiet connections and collecting dead ones"""
+        due = self.slots[self.cursor]
+        self.slots[self.cursor] = set()
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        now = asyncio.get_running_loop().time()
+
+        dead = []
+        to_ping = []
+        for websocket in due:
+            del self.slot_of[websocket]
+            last_seen = self.last_seen[websocket]
+            sent = self.pinged.pop(websocket, None)
+            if sent is not None and last_seen < sent:
+                dead.append(websocket)
+            elif now - last_seen < self.interval - self.tick:
+                # Heard from recently, no need to ping yet
+                self.schedule(websocket, self.interval - (now - last_seen))
+            else:
+                self.pinged[websocket] = now
+                self.schedule(websocket, self.timeout)
+                to_ping.append(websocket)
+
+        for websocket in to_ping:
+            self.send_ping(websocket)
+        if dead:
+            for websocket in dead:
+                self.remove(websocket)
+            self.on_dead(dead)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_turn = loop.time()
+        while True:
+            next_turn += self.tick
+            await asyncio.sleep(max(0.0, next_turn - loop.time()))
+            try:
+                self.turn()
+            except Exception as e:
+                logger.error(f"Heartbeat error: {e}")
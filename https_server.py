@@ -3,22 +3,19 @@
 HTTPS server for the LAN voice call application
 """
 
-import http.server
-import ssl
-import socket
+import asyncio
 import os
 
-def get_local_ip():
-    """Get the local IP address"""
-    try:
-        # Connect to a remote address to determine local IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return "127.0.0.1"
+from static_files import start_static_server
+from lan_utils import get_local_ip, notify_ready
+from tls_config import server_context
+
+async def serve(script_dir, context):
+    """Serve the app until cancelled"""
+    server = await start_static_server(script_dir, '0.0.0.0', 8443, context)
+    notify_ready()
+    async with server:
+        await server.serve_forever()
 
 def run_https_server():
     """Run the HTTPS server"""
@@ -28,24 +25,10 @@ def run_https_server():
         print("Please run 'python generate_cert.py' first to generate them.")
         return
     
-    # Get the directory where this script is located
+    # Serve the app files that sit next to this script
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
-    # Change to the script directory to serve files from there
-    os.chdir(script_dir)
-    
-    # Set up the HTTP server
-    server_address = ('0.0.0.0', 8443)
-    
-    # Create HTTP server
-    httpd = http.server.HTTPServer(server_address, http.server.SimpleHTTPRequestHandler)
-    
-    # Create SSL context (modern approach)
-    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    context.load_cert_chain('server.crt', 'server.key')
-    
-    # Wrap the HTTP server with SSL
-    httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+    context = server_context()
     
     local_ip = get_local_ip()
     
@@ -66,9 +49,9 @@ def run_https_server():
     print("=" * 50)
     
     try:
-        httpd.serve_forever()
+        asyncio.run(serve(script_dir, context))
     except KeyboardInterrupt:
         print("\nServer stopped.")
 
 if __name__ == "__main__":
-    run_https_server()
\ No newline at end of file
+    run_https_server()
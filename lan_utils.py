@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the servers and the start script
+"""
+
+import functools
+import os
+import socket
+
+# Set by start_server.py: a file each server creates once it is listening
+READY_FILE_ENV = "LANCALL_READY_FILE"
+
+@functools.lru_cache(maxsize=None)
+def get_local_ip():
+    """Get the local IP address"""
+    try:
+        # Connect to a remote address to determine local IP (doesn't
+        # actually send data)
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        ip = s.getsockname()[0]
+        s.close()
+        return ip
+    except Exception:
+        return "127.0.0.1"
+
+def get_local_ips():
+    """Get every IPv4 address this host may be reached at, the primary one first"""
+    ips = [get_local_ip()]
+    try:
+        infos = socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)
+    except OSError:
+        infos = []
+    for info in infos:
+        ip = info[4][0]
+        if ip not in ips and not ip.startswith("127."):
+            ips.append(ip)
+    return ips
+
+def notify_ready():
+    """Tell the start script that this server is accepting connections"""
+    path = os.environ.get(READY_FILE_ENV)
+    if path:
+        with open(path, "w"):
+            pass
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Minimal Prometheus-style metrics for the signaling server
+Counters and histograms are plain Python numbers updated inline, cheap
+enough to leave on in production; render() produces the text exposition
+format served at /metrics
+"""
+
+import bisect
+
+# Histogram buckets in seconds, from sub-millisecond queue hops up to
+# multi-second stalls
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+class Counter:
+    """Monotonic count, optionally split by one label"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.values = {}  # {label value: count}
+
+    def inc(self, label_value=None, amount=1):
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def samples(self):
+        for label_value, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            labels = [(self.label, label_value)] if self.label else []
+            yield self.name, labels, value
+
+class Gauge:
+    """Value read when metrics are collected, from a callable returning a
+    number or a {label value: number} dict"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, read, label=None):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.label = label
+
+    def samples(self):
+        value = self.read()
+        if self.label is None:
+            yield self.name, [], value
+            return
+        for label_value, item in sorted(value.items()):
+            yield self.name, [(self.label, label_value)], item
+
+class Histogram:
+    """Distribution of observed values over fixed buckets, optionally split
+    by one label"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, label=None):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.label = label
+        self.series = {}  # {label value: [bucket counts (the last is +Inf), sum, count]}
+        if label is None:
+            # Exposed at zero before the first observation
+            self.series[None] = self.new_series()
+
+    def new_series(self):
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value, label_value=None):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = self.new_series()
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for label_value, (counts, total, count) in sorted(self.series.items(), key=lambda item: str(item[0])):
+            labels = [(self.label, label_value)] if self.label else []
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", labels + [("le", bound)], cumulative
+            yield f"{self.name}_bucket", labels + [("le", "+Inf")], count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+class Registry:
+    """The set of metrics a process exposes"""
+
+    def __init__(self, const_labels=()):
+        # Added to every sample, e.g. the worker ID in multi-worker mode
+        self.const_labels = list(const_labels)
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label=None):
+        return self.add(Counter(name, help_text, label))
+
+    def gauge(self, name, help_text, read, label=None):
+        return self.add(Gauge(name, help_text, read, label))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, label=None):
+        return self.add(Histogram(name, help_text, buckets, label))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(self.const_labels + labels)} {value}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Bounded per-connection outbound queues for the signaling server
+Each connection gets its own writer task, so a slow receiver never blocks
+the client that is sending to it
+"""
+
+import asyncio
+import collections
+import logging
+
+from websockets.exceptions import ConnectionClosed
+
+logger = logging.getLogger(__name__)
+
+# What to do when a connection's queue is full:
+# - drop_oldest_ice: discard the oldest queued ICE candidate (trickle ICE
+#   tolerates losing some), disconnect if there is none to discard
+# - coalesce: collapse all queued roster updates into one fresh snapshot,
+#   disconnect if there are no roster updates to collapse
+# - disconnect: close the connection straight away, the client reconnects
+POLICY_DROP_OLDEST_ICE = "drop_oldest_ice"
+POLICY_COALESCE = "coalesce"
+POLICY_DISCONNECT = "disconnect"
+POLICIES = (POLICY_DROP_OLDEST_ICE, POLICY_COALESCE, POLICY_DISCONNECT)
+
+# Close code for connections that fall too far behind (1013: try again later)
+CLOSE_SLOW_CONSUMER = 1013
+
+# Frame kinds, used by the overflow policies to decide what can be dropped
+KIND_SIGNAL = "signal"
+KIND_ICE = "ice"
+KIND_PRESENCE = "presence"
+
+class Outbox:
+    """Bounded queue of frames waiting to be written to one websocket
+
+    Frames are strings, or callables that build the string from the
+    websocket when it is about to be written (used for roster snapshots,
+    which should be current).
+
+    An outbox can outlive its websocket: detach() stops the writer but keeps
+    queuing, and attach() resumes writing to a new websocket.
+    """
+
+    def __init__(self, websocket, limit=256, policy=POLICY_DROP_OLDEST_ICE, snapshot=None, on_sent=None):
+        # snapshot: callable(websocket) building a roster snapshot, used by coalesce
+        # on_sent: callable(started) called once a frame pushed with a start
+        # time has been written, used for latency metrics
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown outbox policy: {policy}")
+        self.websocket = websocket
+        self.limit = limit
+        self.policy = policy
+        self.snapshot = snapshot
+        self.on_sent = on_sent
+        self.frames = collections.deque()  # [(kind, frame, started)]
+        self.wakeup = asyncio.Event()
+        self.high_water = 0
+        self.dropped = 0
+        self.closed = False
+        self.task = None
+        self.close_task = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def start(self):
+        """Start the writer task"""
+        self.task = asyncio.create_task(self.run())
+
+    def detach(self):
+        """Stop writing but keep accepting frames, until attach() is called"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def attach(self, websocket):
+        """Resume writing queued and future frames to a new websocket"""
+        self.websocket = websocket
+        self.start()
+        if self.frames:
+            self.wakeup.set()
+
+    def push(self, frame, kind=KIND_SIGNAL, started=None):
+        """Queue a frame, returning False if it was not accepted"""
+        if self.closed:
+            return False
+        if len(self.frames) >= self.limit and not self.make_room():
+            self.disconnect()
+            return False
+
+        self.frames.append((kind, frame, started))
+        self.high_water = max(self.high_water, len(self.frames))
+        self.wakeup.set()
+        return True
+
+    def make_room(self):
+        """Apply the overflow policy, returning True if space was freed"""
+        if self.policy == POLICY_DROP_OLDEST_ICE:
+            for i, entry in enumerate(self.frames):
+                if entry[0] == KIND_ICE:
+                    del self.frames[i]
+                    self.dropped += 1
+                    return True
+
+        elif self.policy == POLICY_COALESCE and self.snapshot is not None:
+            kept = collections.deque(entry for entry in self.frames if entry[0] != KIND_PRESENCE)
+            collapsed = len(self.frames) - len(kept)
+            if collapsed:
+                self.dropped += collapsed
+                # The snapshot is built at write time, so it covers every
+                # update that was dropped here
+                kept.append((KIND_PRESENCE, self.snapshot, None))
+                self.frames = kept
+                return len(self.frames) < self.limit
+
+        return False
+
+    def disconnect(self):
+        """Give up on a consumer that can't keep up"""
+        if self.closed:
+            return
+        logger.warning(f"Outbound queue full ({self.limit} frames), disconnecting slow consumer")
+        self.dropped += len(self.frames)
+        self.close()
+        self.close_task = asyncio.create_task(
+            self.websocket.close(CLOSE_SLOW_CONSUMER, "Slow consumer")
+        )
+
+    def close(self):
+        """Stop the writer task and discard queued frames"""
+        self.closed = True
+        self.frames.clear()
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    async def run(self):
+        """Write queued frames to the websocket in order"""
+        pending = None
+        try:
+            while True:
+                await self.wakeup.wait()
+                while self.frames:
+                    pending = self.frames.popleft()
+                    _, frame, started = pending
+                    await self.websocket.send(frame(self.websocket) if callable(frame) else frame)
+                    pending = None
+                    if started is not None and self.on_sent is not None:
+                        self.on_sent(started)
+                self.wakeup.clear()
+        except ConnectionClosed:
+            # Keep what's queued, the session may resume on a new websocket
+            pass
+        except Exception as e:
+            logger.error(f"Outbound writer error: {e}")
+            self.close()
+        finally:
+            # A frame cut off mid-send goes back to the front of the queue
+            if pending is not None and not self.closed:
+                self.frames.appendleft(pending)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Presence and routing bus for running the signaling server as several workers
+One hub owns the roster for the whole LAN; every worker mirrors it and asks
+the hub to route signaling messages to clients held by another worker
+
+Run the hub on its own with: python presence_bus.py <socket path>
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+
+from structured_logging import setup_logging
+from lan_utils import notify_ready
+
+logger = logging.getLogger(__name__)
+
+# Largest bus message (one line of JSON), big enough for a forwarded SDP offer
+MAX_LINE = 1024 * 1024
+
+# Roster snapshots are sent in chunks of about this many bytes of JSON, so a
+# large roster never exceeds MAX_LINE
+SNAPSHOT_CHUNK_BYTES = 256 * 1024
+
+class PresenceHub:
+    """Authoritative roster shared by all workers
+
+    Workers send it operations:
+    - {"op": "join", "id", "name", "room"}: a client registered
+    - {"op": "leave", "id"}: a client went away
+    - {"op": "leave_many", "ids"}: several clients went away at once; each
+      room gets one peers_left delta listing them
+    - {"op": "rename", "id", "name"}: a client changed its name
+    - {"op": "forward", "worker", "target_id", ...}: deliver a message to a
+      client held by another worker
+
+    handle() answers with (worker, message) pairs, where worker None means
+    every worker. Roster changes become {"op": "presence", "delta", "room",
+    "worker"} messages carrying the delta the room's members should see,
+    stamped with the room's next roster version. A room's version is dropped
+    when its last member leaves; if the room fills again, it continues from
+    version_floor, the highest version handed out to a room that emptied, so
+    versions never go backwards. When a user ID registers on
+    a second worker, the worker holding the old connection gets
+    {"op": "evict", "id"}.
+
+    A worker that connects gets the full roster as {"op": "snapshot_begin",
+    "version_floor"},
+    {"op": "snapshot_chunk", "versions", "clients"} messages and
+    {"op": "snapshot_end"}.
+    """
+
+    def __init__(self):
+        self.clients = {}  # {user_id: {id, name, room, worker}}
+        self.versions = {}  # {room: roster version}
+        self.room_sizes = {}  # {room: members}
+        self.version_floor = 0
+
+    def snapshot(self):
+        """The full roster, as the list of messages sent to a worker when it
+        connects"""
+        messages = [{"op": "snapshot_begin", "version_floor": self.version_floor}]
+        chunk = {"op": "snapshot_chunk", "versions": {}, "clients": []}
+        size = 0
+        entries = [("versions", entry) for entry in self.versions.items()]
+        entries += [("clients", client) for client in self.clients.values()]
+        for key, entry in entries:
+            entry_size = len(json.dumps(entry))
+            if size and size + entry_size > SNAPSHOT_CHUNK_BYTES:
+                messages.append(chunk)
+                chunk = {"op": "snapshot_chunk", "versions": {}, "clients": []}
+                size = 0
+            if key == "versions":
+                chunk["versions"][entry[0]] = entry[1]
+            else:
+                chunk["clients"].append(entry)
+            size += entry_size
+        if size:
+            messages.append(chunk)
+        messages.append({"op": "snapshot_end"})
+        return messages
+
+    def presence(self, room, worker, delta):
+        """Stamp a delta with the room's next version"""
+        version = self.versions.get(room, self.version_floor) + 1
+        if self.room_sizes.get(room):
+            self.versions[room] = version
+        else:
+            # The room emptied
+            self.versions.pop(room, None)
+            self.room_sizes.pop(room, None)
+            self.version_floor = max(self.version_floor, version)
+        delta["version"] = version
+        return (None, {"op": "presence", "delta": delta, "room": room, "worker": worker})
+
+    def handle(self, worker, message):
+        """Apply an operation from a worker, returning the messages to send"""
+        op = message["op"]
+        user_id = message.get("id")
+        existing = self.clients.get(user_id)
+
+        if op == "forward":
+            return [(message["worker"], dict(message, op="deliver"))]
+        if op == "leave_many":
+            return self.leave_many(worker, message["ids"])
+
+        out = []
+        if op == "join":
+            room = message["room"]
+            if existing is not None and existing["worker"] != worker:
+                out.append((existing["worker"], {"op": "evict", "id": user_id}))
+            if existing is not None and existing["room"] != room:
+                self.room_sizes[existing["room"]] -= 1
+                out.append(self.presence(existing["room"], worker, {"type": "peer_left", "id": user_id}))
+                existing = None
+            if existing is None:
+                self.room_sizes[room] = self.room_sizes.get(room, 0) + 1
+            self.clients[user_id] = {"id": user_id, "name": message["name"], "room": room, "worker": worker}
+            if existing is None:
+                delta = {"type": "peer_joined", "client": {"id": user_id, "name": message["name"]}}
+            else:
+                delta = {"type": "peer_renamed", "id": user_id, "name": message["name"]}
+
+        elif op in ("leave", "rename"):
+            # Ignore stale updates from a worker that lost the user ID
+            if existing is None or existing["worker"] != worker:
+                return out
+            room = existing["room"]
+            if op == "leave":
+                del self.clients[user_id]
+                self.room_sizes[room] -= 1
+                delta = {"type": "peer_left", "id": user_id}
+            else:
+                existing["name"] = message["name"]
+                delta = {"type": "peer_renamed", "id": user_id, "name": message["name"]}
+
+        else:
+            logger.error(f"Unknown bus operation: {op}")
+            return out
+
+        out.append(self.presence(room, worker, delta))
+        return out
+
+    def leave_many(self, worker, user_ids):
+        """Remove several clients of a worker, with one delta per room"""
+        left = {}  # {room: [user_id]}
+        for user_id in user_ids:
+            existing = self.clients.get(user_id)
+            # Ignore stale updates from a worker that lost the user ID
+            if existing is None or existing["worker"] != worker:
+                continue
+            del self.clients[user_id]
+            self.room_sizes[existing["room"]] -= 1
+            left.setdefault(existing["room"], []).append(user_id)
+        return [self.presence(room, worker, {"type": "peers_left", "ids": ids}) for room, ids in left.items()]
+
+    def drop_worker(self, worker):
+        """Remove every client held by a worker that went away"""
+        return self.leave_many(worker, [c["id"] for c in self.clients.values() if c["worker"] == worker])
+
+class LocalBus:
+    """In-process bus for a single signaling process, or several simulated
+    workers in one process (used by tests and benchmarks)"""
+
+    def __init__(self):
+        self.hub = PresenceHub()
+        self.listeners = {}  # {worker_id: callback}
+
+    async def start(self, worker_id, on_message):
+        """Attach a worker; on_message is called with every bus message for it"""
+        self.listeners[worker_id] = on_message
+        for message in self.hub.snapshot():
+            on_message(message)
+        return LocalBusHandle(self, worker_id)
+
+    def dispatch(self, out):
+        for worker, message in out:
+            if worker is None:
+                for listener in list(self.listeners.values()):
+                    listener(message)
+            elif worker in self.listeners:
+                self.listeners[worker](message)
+
+class LocalBusHandle:
+    """A worker's connection to a LocalBus"""
+
+    def __init__(self, bus, worker_id):
+        self.bus = bus
+        self.worker_id = worker_id
+
+    def publish(self, message):
+        """Send an operation to the hub"""
+        self.bus.dispatch(self.bus.hub.handle(self.worker_id, message))
+
+    async def wait_closed(self):
+        """Wait until the bus goes away (never, for an in-process bus)"""
+        await asyncio.Event().wait()
+
+    async def close(self):
+        self.bus.listeners.pop(self.worker_id, None)
+        self.bus.dispatch(self.bus.hub.drop_worker(self.worker_id))
+
+def encode(message):
+    """Encode a bus message as one line of compact JSON"""
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+class UnixSocketBus:
+    """Connection from a worker to a hub process over a Unix-domain socket"""
+
+    def __init__(self, path):
+        self.path = path
+        self.worker_id = None
+        self.reader = None
+        self.writer = None
+        self.task = None
+
+    async def start(self, worker_id, on_message):
+        """Connect to the hub; on_message is called with every bus message"""
+        self.worker_id = worker_id
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path, limit=MAX_LINE)
+        self.writer.write(encode({"op": "hello", "worker": worker_id}))
+        self.task = asyncio.create_task(self.read_loop(on_message))
+        return self
+
+    async def read_loop(self, on_message):
+        while True:
+            try:
+                line = await self.reader.readline()
+            except ValueError as e:
+                # Over MAX_LINE: readline discards what it buffered, and the
+                # rest of the line fails to decode below
+                logger.error(f"Skipping oversized bus message: {e}")
+                continue
+            if not line:
+                logger.error("Lost connection to the presence bus")
+                return
+            try:
+                on_message(json.loads(line))
+            except Exception as e:
+                logger.error(f"Error handling bus message: {e}")
+
+    def publish(self, message):
+        """Send an operation to the hub"""
+        self.writer.write(encode(message))
+
+    async def wait_closed(self):
+        """Wait until the connection to the hub is lost"""
+        await self.task
+
+    async def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+async def run_hub(path):
+    """Serve a PresenceHub to worker processes on a Unix-domain socket"""
+    hub = PresenceHub()
+    writers = {}  # {worker_id: StreamWriter}
+
+    def dispatch(out):
+        for worker, message in out:
+            line = encode(message)
+            if worker is None:
+                for writer in writers.values():
+                    writer.write(line)
+            elif worker in writers:
+                writers[worker].write(line)
+
+    async def serve_worker(reader, writer):
+        hello = json.loads(await reader.readline())
+        worker = hello["worker"]
+        writers[worker] = writer
+        writer.writelines(encode(message) for message in hub.snapshot())
+        logger.info(f"Worker {worker} connected")
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError as e:
+                    logger.error(f"Skipping oversized message from worker {worker}: {e}")
+                    continue
+                if not line:
+                    break
+                try:
+                    dispatch(hub.handle(worker, json.loads(line)))
+                except Exception as e:
+                    logger.error(f"Error handling message from worker {worker}: {e}")
+        except Exception as e:
+            logger.error(f"Error from worker {worker}: {e}")
+        finally:
+            logger.info(f"Worker {worker} disconnected")
+            if writers.get(worker) is writer:
+                del writers[worker]
+            dispatch(hub.drop_worker(worker))
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(serve_worker, path, limit=MAX_LINE)
+    logger.info(f"Presence bus listening on {path}")
+    notify_ready()
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    setup_logging()
+    if len(sys.argv) != 2:
+        print("Usage: python presence_bus.py <socket path>")
+        sys.exit(1)
+    try:
+        asyncio.run(run_hub(sys.argv[1]))
+    except KeyboardInterrupt:
+        logger.info("Presence bus stopped by user")
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Selective forwarding media relay (SFU) for group calls
+
+Runs alongside the signaling server, on its own port. A browser joining a
+conference opens one peer connection to the SFU and sends it one audio
+stream, however many people are in the call. The SFU sends back the
+FORWARDED_SPEAKERS loudest other participants on a fixed set of slots, so
+the browser never renegotiates when the speakers change.
+
+Each participant's audio is decoded once, to measure its level. It is
+encoded again once, and only while someone listens to it; every listener
+gets the same Opus packets.
+
+Conference signaling, as JSON messages on the SFU's WebSocket:
+
+    client -> {"type": "conference_join", "conference": ..., "user_id": ..., "name": ...}
+    server -> {"type": "conference_offer", "offer": {...}, "slots": N}
+    client -> {"type": "conference_answer", "answer": {...}}
+    server -> {"type": "conference_members", "members": [{"id": ..., "name": ...}]}
+    server -> {"type": "conference_speakers", "speakers": [user ID or null, one per slot]}
+    client -> {"type": "conference_leave"}
+
+Needs aiortc (pip install aiortc).
+"""
+
+import asyncio
+import collections
+import fractions
+import json
+import logging
+import os
+import time
+
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+try:
+    from aiortc import MediaStreamTrack, RTCPeerConnection, RTCRtpSender, RTCSessionDescription
+    from aiortc.codecs.opus import OpusEncoder
+    from aiortc.mediastreams import MediaStreamError
+    from av.packet import Packet
+except ImportError:
+    raise SystemExit("The SFU needs aiortc: pip install aiortc")
+
+from structured_logging import setup_logging
+from lan_utils import get_local_ip, notify_ready
+from tls_config import server_context
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+SFU_PORT = int(os.environ.get("SFU_PORT", "8766"))
+
+# Streams each participant receives: the loudest speakers other than itself
+FORWARDED_SPEAKERS = int(os.environ.get("SFU_FORWARDED_SPEAKERS", "3"))
+MAX_PARTICIPANTS = int(os.environ.get("SFU_MAX_PARTICIPANTS", "32"))
+MAX_CONFERENCE_LENGTH = 64
+
+# How often the speakers are picked again (seconds). A speaker keeps its
+# slot until someone else is SPEAKER_HOLD times louder, so short noises
+# don't make the slots flap.
+SPEAKER_INTERVAL = float(os.environ.get("SFU_SPEAKER_INTERVAL", "0.3"))
+SPEAKER_HOLD = 2.0
+
+# Levels are a moving average over roughly 1 / LEVEL_SMOOTHING frames, of
+# every LEVEL_STRIDE-th sample
+LEVEL_SMOOTHING = 0.1
+LEVEL_STRIDE = 16
+
+# Opus at 48 kHz in 20 ms packets, as aiortc's encoder produces it
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960
+TIME_BASE = fractions.Fraction(1, SAMPLE_RATE)
+
+# Packets queued per slot before the oldest are dropped (20 ms each)
+SLOT_QUEUE = 10
+
+# name -> Conference
+conferences = {}
+
+lan_ip = get_local_ip()
+
+def frame_level(frame):
+    """Mean square of a decoded s16 frame, from 0 to 1, over a sample of it"""
+    samples = memoryview(bytes(frame.planes[0])).cast("h")[::LEVEL_STRIDE]
+    if not samples:
+        return 0.0
+    return sum(sample * sample for sample in samples) / (len(samples) * 32768.0 ** 2)
+
+def send(websocket, message):
+    """Queue a message without waiting for it to be written"""
+    websockets.broadcast([websocket], json.dumps(message))
+
+class SlotTrack(MediaStreamTrack):
+    """One outgoing audio stream of a participant, forwarding one speaker at a time
+
+    Returns the speaker's encoded packets as they arrive, restamped so RTP
+    time runs on smoothly when the speaker changes or falls silent.
+    """
+
+    kind = "audio"
+
+    def __init__(self):
+        super().__init__()
+        self.speaker = None  # Participant forwarded on this slot
+        self.queue = collections.deque(maxlen=SLOT_QUEUE)
+        self.ready = asyncio.Event()
+        self.started = None
+        self.timestamp = 0
+
+    def push(self, payload):
+        self.queue.append(payload)
+        self.ready.set()
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        while not self.queue:
+            self.ready.clear()
+            await self.ready.wait()
+        payload = self.queue.popleft()
+
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        else:
+            # Steady within a stream; after a gap, jump to the wall clock
+            self.timestamp += FRAME_SAMPLES
+            elapsed = int((now - self.started) * SAMPLE_RATE)
+            if elapsed - self.timestamp > 3 * FRAME_SAMPLES:
+                self.timestamp = elapsed
+        packet = Packet(payload)
+        packet.pts = self.timestamp
+        packet.time_base = TIME_BASE
+        return packet
+
+class Participant:
+    """A member of a conference and its peer connection to the SFU"""
+
+    def __init__(self, websocket, user_id, name):
+        self.websocket = websocket
+        self.id = user_id
+        self.name = name
+        self.conference = None
+        self.pc = RTCPeerConnection()
+        self.slots = [SlotTrack() for _ in range(FORWARDED_SPEAKERS)]
+        self.level = 0.0
+        self.listeners = set()  # SlotTracks of other participants forwarding this one
+        self.encoder = None
+        self.relay = None  # task reading this participant's audio
+
+    async def relay_audio(self, track):
+        """Measure the level of incoming audio and feed it to its listeners"""
+        while True:
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                return
+            self.level += LEVEL_SMOOTHING * (frame_level(frame) - self.level)
+            if not self.listeners:
+                continue
+            if self.encoder is None:
+                self.encoder = OpusEncoder()
+            payloads, _ = self.encoder.encode(frame)
+            for payload in payloads:
+                for slot in self.listeners:
+                    slot.push(payload)
+
+    def assign(self, speakers):
+        """Forward speakers on this participant's slots, returning True if a slot changed
+
+        A speaker already on a slot stays there; new ones take the slots
+        that are freed.
+        """
+        current = [slot.speaker for slot in self.slots]
+        incoming = [speaker for speaker in speakers if speaker not in current]
+        changed = False
+        for slot in self.slots:
+            if slot.speaker in speakers:
+                continue
+            speaker = incoming.pop(0) if incoming else None
+            if speaker is slot.speaker:
+                continue
+            if slot.speaker is not None:
+                slot.speaker.listeners.discard(slot)
+            slot.queue.clear()
+            slot.speaker = speaker
+            if speaker is not None:
+                speaker.listeners.add(slot)
+            changed = True
+        return changed
+
+    def speakers_message(self):
+        return {
+            "type": "conference_speakers",
+            "speakers": [slot.speaker.id if slot.speaker is not None else None for slot in self.slots]
+        }
+
+class Conference:
+    """The participants of one group call and who is forwarded to whom"""
+
+    def __init__(self, name):
+        self.name = name
+        self.participants = {}  # {user ID: Participant}
+        self.speakers = []  # loudest first, as last picked
+        self.task = None
+
+    def members_message(self):
+        return {
+            "type": "conference_members",
+            "conference": self.name,
+            "members": [{"id": p.id, "name": p.name} for p in self.participants.values()]
+        }
+
+    def announce_members(self):
+        frame = json.dumps(self.members_message())
+        websockets.broadcast([p.websocket for p in self.participants.values()], frame)
+
+    def select_speakers(self):
+        """Pick the loudest participants and forward them to everyone else"""
+        held = set(self.speakers)
+        ranked = sorted(
+            self.participants.values(),
+            key=lambda p: p.level * (SPEAKER_HOLD if p in held else 1),
+            reverse=True
+        )
+        # One more than the slots, since nobody hears themselves
+        self.speakers = ranked[:FORWARDED_SPEAKERS + 1]
+        for participant in self.participants.values():
+            speakers = [p for p in self.speakers if p is not participant][:FORWARDED_SPEAKERS]
+            if participant.assign(speakers):
+                send(participant.websocket, participant.speakers_message())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(SPEAKER_INTERVAL)
+            try:
+                self.select_speakers()
+            except Exception as e:
+                logger.error(f"Speaker selection error in {self.name}: {e}")
+
+    def add(self, participant):
+        previous = self.participants.pop(participant.id, None)
+        self.participants[participant.id] = participant
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        self.announce_members()
+        self.select_speakers()
+        return previous
+
+    def remove(self, participant):
+        """Remove a participant, returning True if the conference is now empty"""
+        if self.participants.get(participant.id) is participant:
+            del self.participants[participant.id]
+        participant.assign([])
+        if not self.participants:
+            self.task.cancel()
+            return True
+        self.announce_members()
+        self.select_speakers()
+        return False
+
+def opus_only(transceiver):
+    """Forwarded packets are Opus, so only negotiate Opus"""
+    codecs = [codec for codec in RTCRtpSender.getCapabilities("audio").codecs
+              if codec.mimeType.lower() == "audio/opus"]
+    transceiver.setCodecPreferences(codecs)
+
+async def join(websocket, data):
+    """Add a client to a conference and send it the SFU's offer, returning its Participant"""
+    name = data.get("conference")
+    user_id = data.get("user_id")
+    if not isinstance(name, str) or not name or len(name) > MAX_CONFERENCE_LENGTH or not isinstance(user_id, str):
+        send(websocket, {"type": "conference_error", "reason": "invalid"})
+        return None
+    conference = conferences.get(name)
+    if conference is not None and len(conference.participants) >= MAX_PARTICIPANTS:
+        send(websocket, {"type": "conference_error", "reason": "full"})
+        return None
+
+    participant = Participant(websocket, user_id, str(data.get("name") or user_id))
+    pc = participant.pc
+
+    @pc.on("track")
+    def on_track(track):
+        if track.kind == "audio" and participant.relay is None:
+            participant.relay = asyncio.create_task(participant.relay_audio(track))
+
+    @pc.on("connectionstatechange")
+    async def on_connection_state():
+        if pc.connectionState == "failed":
+            logger.warning(f"Media connection to {user_id} failed")
+            await websocket.close()
+
+    opus_only(pc.addTransceiver("audio", direction="recvonly"))
+    for slot in participant.slots:
+        opus_only(pc.addTransceiver(slot, direction="sendonly"))
+    # aiortc gathers every candidate first, so the offer is complete
+    await pc.setLocalDescription(await pc.createOffer())
+
+    # The conference may have filled up, or gone, during gathering
+    conference = conferences.get(name)
+    if conference is None:
+        conference = conferences[name] = Conference(name)
+    elif len(conference.participants) >= MAX_PARTICIPANTS:
+        await pc.close()
+        send(websocket, {"type": "conference_error", "reason": "full"})
+        return None
+    participant.conference = conference
+
+    send(websocket, {
+        "type": "conference_offer",
+        "offer": {"type": pc.localDescription.type, "sdp": pc.localDescription.sdp},
+        "slots": len(participant.slots)
+    })
+    previous = conference.add(participant)
+    if previous is not None:
+        # Same user joining again from a new connection
+        await previous.websocket.close()
+    logger.info(f"{user_id} joined conference {name} ({len(conference.participants)} participants)")
+    return participant
+
+async def leave(participant):
+    conference = participant.conference
+    if conference.remove(participant) and conferences.get(conference.name) is conference:
+        del conferences[conference.name]
+    if participant.relay is not None:
+        participant.relay.cancel()
+    await participant.pc.close()
+    logger.info(f"{participant.id} left conference {conference.name}")
+
+async def handler(websocket):
+    """Handle the conference signaling of one client"""
+    participant = None
+    try:
+        async for message in websocket:
+            try:
+                data = json.loads(message)
+            except json.JSONDecodeError:
+                logger.error("Invalid JSON message received")
+                continue
+            msg_type = data.get("type")
+            if msg_type == "conference_join" and participant is None:
+                participant = await join(websocket, data)
+            elif msg_type == "conference_answer" and participant is not None:
+                answer = data.get("answer") or {}
+                try:
+                    await participant.pc.setRemoteDescription(
+                        RTCSessionDescription(sdp=answer.get("sdp", ""), type=answer.get("type", "answer"))
+                    )
+                except Exception as e:
+                    logger.error(f"Bad answer from {participant.id}: {e}")
+                    break
+            elif msg_type == "conference_leave":
+                break
+    except ConnectionClosed:
+        pass
+    finally:
+        if participant is not None:
+            await leave(participant)
+
+async def main():
+    """Start the SFU"""
+    # Check if we should use SSL
+    use_ssl = os.path.exists("server.crt") and os.path.exists("server.key")
+    ssl = server_context() if use_ssl else None
+    scheme = "wss" if use_ssl else "ws"
+    server = await websockets.serve(handler, "0.0.0.0", SFU_PORT, ssl=ssl, max_size=64 * 1024)
+
+    for line in (f"SFU started on {scheme}://{lan_ip}:{SFU_PORT} ({FORWARDED_SPEAKERS} speakers forwarded)",
+                 f"Accessible locally at {scheme}://localhost:{SFU_PORT}"):
+        logger.info(line)
+        print(line)
+    notify_ready()
+    await server.wait_closed()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("SFU stopped by user")
@@ -5,202 +5,1153 @@ Handles WebSocket connections for WebRTC signaling
 """
 
 import asyncio
+import collections
+import functools
+import ipaddress
 import websockets
 import json
 import logging
-import socket
-import ssl
+import re
 import os
+import secrets
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qs
 
-# Get the LAN IP address
-def get_lan_ip():
-    try:
-        # Connect to a remote address (doesn't actually send data)
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return "127.0.0.1"
-
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+from outbox import Outbox, POLICIES, KIND_ICE, KIND_PRESENCE, KIND_SIGNAL
+from heartbeat import Heartbeat
+from admission import ANY_TYPE, DEFAULT_LIMITS, ConnectionLimits, Overload, TokenBucket, parse_limit
+from presence_bus import LocalBus, UnixSocketBus
+from structured_logging import setup_logging, log_frame, parse_type_map
+from metrics import Registry
+from trace_recorder import TraceRecorder
+from static_files import AssetCache, respond, start_http_server
+from websockets.datastructures import Headers
+from websockets.http11 import Response
+from lan_utils import get_local_ip, notify_ready
+from tls_config import server_context
+from stun_server import start_stun_server
+from unified_connection import UnifiedConnection
+
+# Set up logging (queued to a writer thread, see structured_logging.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Store connected clients: {websocket: {id, name}}
-connected_clients = {}
+# Close code sent to a socket whose user ID was taken over by a newer registration
+CLOSE_SESSION_REPLACED = 4001
 
-# Get the LAN IP address
-lan_ip = get_lan_ip()
+# Room for clients that don't ask for one, and the longest room name accepted
+DEFAULT_ROOM = "lobby"
+MAX_ROOM_LENGTH = 64
+
+class Session:
+    """What the server knows about one registered client
+
+    Slotted: a server may hold tens of thousands of idle sessions.
+    """
+
+    __slots__ = ("id", "name", "room", "protocol", "token")
+
+    def __init__(self, user_id, name, room=DEFAULT_ROOM, protocol=1, token=None):
+        self.id = user_id
+        self.name = name
+        self.room = room
+        self.protocol = protocol
+        self.token = token
+
+# Stands in for the sender of a message from a socket that never registered.
+# It is in no room, so SAME_ROOM_ONLY lets nothing through from it.
+UNKNOWN_SESSION = Session("unknown", "unknown", room=None)
+
+class SessionRegistry:
+    """Registered clients, indexed by websocket, by user ID and by room
+
+    A user ID maps to exactly one socket. When a second socket registers an
+    ID that is already taken, the newest registration wins: the older socket
+    is dropped from the registry and handed back to the caller to close.
+    """
+
+    def __init__(self):
+        self.by_socket = {}  # {websocket: Session}
+        self.by_id = {}  # {user_id: websocket}
+        self.by_room = {}  # {room: {websocket, ...}}
+        self.by_token = {}  # {resume token: websocket}
+
+    def __len__(self):
+        return len(self.by_socket)
+
+    def __contains__(self, websocket):
+        return websocket in self.by_socket
+
+    def get(self, websocket, default=None):
+        """Return the Session of a websocket"""
+        return self.by_socket.get(websocket, default)
+
+    def socket_for(self, user_id):
+        """Return the websocket registered under a user ID, or None"""
+        return self.by_id.get(user_id)
+
+    def sockets_in(self, room):
+        """Return the websockets registered in a room"""
+        return self.by_room.get(room, ())
+
+    def socket_for_token(self, token):
+        """Return the websocket holding the session with a resume token, or None"""
+        return self.by_token.get(token)
+
+    def add(self, websocket, user_id, name, protocol=1, room=DEFAULT_ROOM, token=None):
+        """Register a websocket, returning the socket it displaced (if any)"""
+        displaced = self.by_id.get(user_id)
+        if displaced is websocket:
+            displaced = None
+        elif displaced is not None:
+            self.forget(displaced, self.by_socket.pop(displaced))
+
+        # A socket re-registering releases its old ID, room and token
+        current = self.by_socket.get(websocket)
+        if current is not None:
+            if current.id != user_id:
+                del self.by_id[current.id]
+            self.forget(websocket, current)
+
+        self.by_socket[websocket] = Session(user_id, name, room, protocol, token)
+        self.by_id[user_id] = websocket
+        self.by_room.setdefault(room, set()).add(websocket)
+        if token is not None:
+            self.by_token[token] = websocket
+        return displaced
+
+    def rebind(self, old_websocket, new_websocket):
+        """Move a session to the websocket that resumed it"""
+        session = self.by_socket.pop(old_websocket)
+        self.forget(old_websocket, session)
+        self.by_socket[new_websocket] = session
+        self.by_id[session.id] = new_websocket
+        self.by_room.setdefault(session.room, set()).add(new_websocket)
+        if session.token is not None:
+            self.by_token[session.token] = new_websocket
 
-async def register_client(websocket, user_id, name=None):
-    """Register a new client with their user ID and name"""
-    connected_clients[websocket] = {
-        "id": user_id,
-        "name": name or user_id
+    def forget(self, websocket, session):
+        """Drop a websocket from the room and token indexes"""
+        members = self.by_room[session.room]
+        members.discard(websocket)
+        if not members:
+            del self.by_room[session.room]
+        if self.by_token.get(session.token) is websocket:
+            del self.by_token[session.token]
+
+    def rename(self, websocket, name):
+        """Change the display name of a registered websocket"""
+        session = self.by_socket.get(websocket)
+        if session is None:
+            return False
+        session.name = name
+        return True
+
+    def remove(self, websocket):
+        """Unregister a websocket, returning its Session (or None)"""
+        session = self.by_socket.pop(websocket, None)
+        if session is not None:
+            del self.by_id[session.id]
+            self.forget(websocket, session)
+        return session
+
+registry = SessionRegistry()
+
+# Store connected clients: {websocket: Session}
+connected_clients = registry.by_socket
+
+# Outbound queue per connection: {websocket: Outbox}
+outboxes = {}
+
+# Outbound queue size and overflow policy (drop_oldest_ice, coalesce or disconnect)
+OUTBOX_LIMIT = int(os.environ.get("SIGNALING_OUTBOX_LIMIT", "256"))
+OUTBOX_POLICY = os.environ.get("SIGNALING_OUTBOX_POLICY", "drop_oldest_ice")
+
+# How often to log connections whose outbound queue is backing up (seconds)
+OUTBOX_REPORT_INTERVAL = float(os.environ.get("SIGNALING_OUTBOX_REPORT_INTERVAL", "10"))
+# Connections listed at /outboxes, deepest queue first
+OUTBOX_STATS_LIMIT = 100
+
+# How long a dropped client's session is kept for it to resume (seconds).
+# Frames addressed to it meanwhile stay queued in its outbox. 0 disables.
+RESUME_GRACE = float(os.environ.get("SIGNALING_RESUME_GRACE", "30"))
+
+# Per-connection limits of the websockets library, which dominate the memory
+# an idle connection costs. Signaling frames are a few KB at most: an SDP
+# offer is the largest. max_size caps one incoming message (bytes),
+# max_queue is how many incoming frames are buffered before reading pauses,
+# write_limit is the write buffer high-water mark (bytes). Compression keeps
+# a zlib context per connection, so it is off unless set to "deflate".
+MAX_MESSAGE_SIZE = int(os.environ.get("SIGNALING_MAX_MESSAGE_SIZE", str(64 * 1024)))
+MAX_QUEUE = int(os.environ.get("SIGNALING_MAX_QUEUE", "4"))
+WRITE_LIMIT = int(os.environ.get("SIGNALING_WRITE_LIMIT", str(16 * 1024)))
+COMPRESSION = os.environ.get("SIGNALING_COMPRESSION", "none")
+
+# Liveness checks (see heartbeat.py): a connection silent for
+# HEARTBEAT_INTERVAL seconds is pinged, and dropped if it doesn't answer
+# within HEARTBEAT_TIMEOUT seconds. An interval of 0 leaves it to the
+# websockets library's keepalive task on each connection.
+HEARTBEAT_INTERVAL = float(os.environ.get("SIGNALING_HEARTBEAT_INTERVAL", "15"))
+HEARTBEAT_TIMEOUT = float(os.environ.get("SIGNALING_HEARTBEAT_TIMEOUT", "10"))
+heartbeat = None
+
+def connection_limits():
+    """Keyword arguments for websockets.serve that size each connection"""
+    limits = {
+        "max_size": MAX_MESSAGE_SIZE,
+        "max_queue": MAX_QUEUE,
+        "write_limit": WRITE_LIMIT,
+        "compression": None if COMPRESSION == "none" else COMPRESSION,
     }
-    logger.info(f"Client registered: {user_id} ({name or 'unnamed'})")
-    
-    # Send the list of all connected clients to the new client
-    await send_client_list()
+    if HEARTBEAT_INTERVAL > 0:
+        limits["ping_interval"] = None
+    return limits
+
+# Admission control (see admission.py). Each connection has token buckets
+# per message type; SIGNALING_RATE_LIMITS overrides them as
+# "type=rate/burst,...", where "*" is the limit on all of a connection's
+# messages together. Connections that keep going over are closed.
+RATE_LIMITS = dict(DEFAULT_LIMITS)
+RATE_LIMITS.update(parse_type_map(os.environ.get("SIGNALING_RATE_LIMITS", ""), parse_limit))
+MAX_REJECTED = 500
+CLOSE_POLICY_VIOLATION = 1008
+
+# Open connections accepted, and new registrations per second ("rate/burst"),
+# for the whole process
+MAX_CONNECTIONS = int(os.environ.get("SIGNALING_MAX_CONNECTIONS", "20000"))
+registrations = TokenBucket(*parse_limit(os.environ.get("SIGNALING_REGISTER_RATE", "50/100")))
+
+# Close code for registrations refused while the server is busy (1013: try again later)
+CLOSE_TRY_AGAIN_LATER = 1013
+
+# Event loop lag (seconds) at which the server counts as overloaded. It then
+# refuses new connections and registrations and puts off renames and
+# resyncs, so calls in progress keep their signaling. 0 disables.
+overload = Overload(float(os.environ.get("SIGNALING_SHED_LAG", "0.1")))
+
+# Rate limits per connection: {websocket: ConnectionLimits}
+rate_limits = {}
+
+# Presence work put off while overloaded: websockets waiting for a snapshot,
+# and the latest name each client asked for
+deferred_resyncs = set()
+deferred_renames = {}  # {websocket: name}
+
+# Sessions whose websocket dropped, waiting to be resumed: {websocket: TimerHandle}
+detached = {}
+
+# User IDs of clients that left in the last DEPARTURE_WINDOW seconds,
+# announced to their rooms together (see unregister_client). Connections
+# reaped at once finish their handlers, and their resume timers expire, a
+# few loop passes apart.
+DEPARTURE_WINDOW = 0.1
+departed = []
+departure_timer = None
+
+# Keep references to fire-and-forget tasks so they aren't garbage collected
+background_tasks = set()
+
+def spawn(coro):
+    """Run a coroutine in the background without awaiting it"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Get the LAN IP address
+lan_ip = get_local_ip()
+
+# ICE configuration sent to clients when they register. By default there
+# are no ICE servers: on a LAN, host candidates connect a call at once,
+# while STUN servers on the internet that can't be reached hold up
+# candidate gathering on every call. SIGNALING_ICE_SERVERS lists STUN/TURN
+# URLs to use anyway (comma-separated). SIGNALING_STUN_PORT starts the STUN
+# responder of stun_server.py on that UDP port and points clients at it;
+# 0 disables it.
+ICE_SERVERS = [url.strip() for url in os.environ.get("SIGNALING_ICE_SERVERS", "").split(",") if url.strip()]
+ICE_CANDIDATE_POOL = int(os.environ.get("SIGNALING_ICE_CANDIDATE_POOL", "0"))
+STUN_PORT = int(os.environ.get("SIGNALING_STUN_PORT", "0"))
+
+@functools.lru_cache(maxsize=16)
+def ice_config_frame(host):
+    """Encode the ICE configuration clients create their peer connections with
+
+    host is the address the client reached this server on, which is where it
+    can reach the STUN responder too.
+    """
+    urls = ([f"stun:{host}:{STUN_PORT}"] if STUN_PORT else []) + ICE_SERVERS
+    return json.dumps({
+        "type": "ice_config",
+        "ice_servers": [{"urls": url} for url in urls],
+        "ice_candidate_pool_size": ICE_CANDIDATE_POOL
+    })
+
+def stun_host(websocket):
+    """Return the local address a client connected to, as a URL host"""
+    address = websocket.local_address
+    if not address:
+        return lan_ip
+    ip = ipaddress.ip_address(address[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return f"[{ip}]" if ip.version == 6 else str(ip)
+
+# Presence bus connecting this process to the roster. Without
+# SIGNALING_BUS it is an in-process bus; in worker mode it is a Unix-domain
+# socket to the hub that ties all workers together (see presence_bus.py).
+BUS_PATH = os.environ.get("SIGNALING_BUS")
+WORKER_ID = os.environ.get("SIGNALING_WORKER_ID", str(os.getpid()))
+# The worker's place in the pool, which unlike its ID survives restarts
+WORKER_INDEX = os.environ.get("SIGNALING_WORKER_INDEX", WORKER_ID)
+bus = None
+
+# Roster for the whole LAN as seen through the bus, by user ID and by room:
+# {user_id: {id, name, room, worker}} and {room: {user_id: client}}
+roster = {}
+room_members = {}
+
+# Roster version per room, bumped by the hub on every presence change in
+# the room. Every member receives every delta for its room, so a client that
+# sees a jump in versions knows it missed one and asks for a fresh snapshot.
+# A room's version is dropped once it is empty; rooms without one are at
+# version_floor, mirroring the hub.
+room_versions = {}
+version_floor = 0
+
+# Roster snapshot being received from the hub in chunks: {versions, clients}
+staged_snapshot = None
+
+# Only forward signaling between clients in the same room
+SAME_ROOM_ONLY = os.environ.get("SIGNALING_SAME_ROOM_ONLY", "0") == "1"
+
+# Metrics, served at /metrics on the signaling port. Each worker has its own,
+# labelled with its worker index.
+metrics = Registry([("worker", WORKER_INDEX)] if BUS_PATH else [])
+frames_in = metrics.counter("signaling_frames_in_total", "Frames received from clients", "type")
+frames_out = metrics.counter("signaling_frames_out_total", "Frames queued for clients", "type")
+forward_failures = metrics.counter(
+    "signaling_forward_failures_total", "Signaling messages that were not delivered", "reason")
+forward_latency = metrics.histogram(
+    "signaling_forward_latency_seconds",
+    "Time from receiving a signaling message to finishing sending it (includes ICE batching)")
+broadcast_duration = metrics.histogram(
+    "signaling_broadcast_seconds", "Time to encode a roster update and queue it for a room")
+loop_lag = metrics.histogram("signaling_event_loop_lag_seconds", "How late the event loop woke from a timer")
+rate_limited = metrics.counter(
+    "signaling_rate_limited_total", "Messages dropped for going over a per-connection rate limit", "type")
+shed = metrics.counter("signaling_shed_total", "Presence messages put off while overloaded", "type")
+refused = metrics.counter("signaling_refused_total", "Connections and registrations turned away", "reason")
+metrics.gauge("signaling_overloaded", "1 while the event loop is falling behind", lambda: int(overload.active))
+call_phases = metrics.histogram(
+    "signaling_call_setup_seconds",
+    "Call setup phases: reported by each side from pressing Call (caller) or accepting (callee), "
+    "and relay and answer times seen by the server",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0),
+    label="phase")
+call_setups = metrics.counter("signaling_call_setups_total", "Call setups reported by clients", "outcome")
+reaped = metrics.counter("signaling_reaped_connections_total", "Connections dropped for not answering heartbeats")
+metrics.gauge("signaling_sessions", "Registered sessions", lambda: len(registry))
+metrics.gauge("signaling_detached_sessions", "Sessions waiting to be resumed", lambda: len(detached))
+metrics.gauge("signaling_connections", "Open connections with an outbound queue", lambda: len(outboxes))
+metrics.gauge("signaling_outbox_frames", "Frames waiting in outbound queues",
+              lambda: sum(len(outbox) for outbox in outboxes.values()))
+metrics.gauge("signaling_outbox_max_depth", "Frames waiting in the fullest outbound queue",
+              lambda: max((len(outbox) for outbox in outboxes.values()), default=0))
+
+# Record every inbound frame to this file for benchmarks/replay_trace.py.
+# Workers each write their own file, suffixed with the worker ID.
+TRACE_PATH = os.environ.get("SIGNALING_TRACE")
+TRACE_REDACT = os.environ.get("SIGNALING_TRACE_REDACT", "0") == "1"
+recorder = None
+
+# How often the event loop lag is sampled (seconds)
+LOOP_LAG_INTERVAL = 0.5
+
+# Message types counted under their own label, anything else is "other"
+METRIC_TYPES = {"register", "update_name", "resync", "offer", "answer", "ice_candidate", "ice_candidates", "hangup",
+                "call_metrics"}
+
+def type_label(msg_type):
+    return msg_type if msg_type in METRIC_TYPES else "other"
+
+def observe_forward(started):
+    """Outbox callback: a forwarded frame has been written"""
+    forward_latency.observe(time.perf_counter() - started)
+
+async def monitor_event_loop():
+    """Measure how late the event loop runs a timer that should fire on time"""
+    while True:
+        expected = time.perf_counter() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.perf_counter() - expected)
+        loop_lag.observe(lag)
+        if overload.update(lag):
+            if overload.active:
+                logger.warning(f"Event loop {lag * 1000:.0f} ms behind: refusing new clients, "
+                               f"putting off presence updates")
+            else:
+                logger.info(f"Load back to normal, applying {len(deferred_renames)} renames "
+                            f"and {len(deferred_resyncs)} resyncs put off")
+                await apply_deferred()
+
+def start_recording():
+    """Start writing a trace if SIGNALING_TRACE is set"""
+    global recorder
+    if TRACE_PATH:
+        path = f"{TRACE_PATH}.{WORKER_ID}" if BUS_PATH else TRACE_PATH
+        recorder = TraceRecorder(path, redact_sdp=TRACE_REDACT)
+        spawn(recorder.run())
+        logger.info(f"Recording signaling trace to {path}")
+
+# Unified mode: serve the web app over HTTPS on APP_PORT and take WebSocket
+# upgrades at WS_PATH on the same port, instead of running https_server.py
+SERVE_APP = os.environ.get("SIGNALING_SERVE_APP", "0") == "1"
+APP_PORT = 8443
+SIGNALING_PORT = 8765
+WS_PATH = "/ws"
+assets = AssetCache(os.path.dirname(os.path.abspath(__file__))) if SERVE_APP else None
+
+# Also serve /metrics and /outboxes over plain HTTP on this port (0: only on
+# the signaling port). start_server.py gives each worker its own, since a
+# scrape of the shared signaling port reaches whichever worker accepts it.
+METRICS_PORT = int(os.environ.get("SIGNALING_METRICS_PORT", "0"))
+STATUS_PATHS = ("/metrics", "/outboxes")
+
+def status_response(method, target, headers):
+    """Answer a request for /metrics or /outboxes, like respond() does for assets"""
+    path = target.split("?", 1)[0]
+    if path == "/metrics":
+        body, content_type = metrics.render().encode(), "text/plain; charset=utf-8"
+    elif path == "/outboxes":
+        body, content_type = json.dumps(outbox_stats()[:OUTBOX_STATS_LIMIT]).encode(), "application/json"
+    else:
+        body = b"Not found\n"
+        return 404, "Not Found", [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))], body
+    return 200, "OK", [("Content-Type", content_type), ("Content-Length", str(len(body)))], body
+
+def app_response(method, target, headers):
+    """Answer a plain HTTP request in unified mode: the app, /metrics or /outboxes"""
+    if target.split("?", 1)[0] in STATUS_PATHS:
+        return status_response(method, target, headers)
+    return respond(assets, method, target, headers)
+
+def process_request(connection, request):
+    """Answer /metrics and /outboxes, and admit WebSocket handshakes
+
+    In unified mode, UnifiedConnection answers the plain requests for the
+    app, so only upgrades get here.
+    """
+    path, _, query = request.path.partition("?")
+    if path in STATUS_PATHS:
+        status, reason, headers, body = status_response("GET", path, {})
+        return Response(status, reason, Headers(headers), body)
+    if SERVE_APP and path != WS_PATH:
+        return connection.respond(HTTPStatus.NOT_FOUND, "Not found\n")
+    resume_token = parse_qs(query).get("resume", [None])[0]
+    return admit_connection(connection, resume_token)
+
+def admit_connection(connection, resume_token=None):
+    """Turn away a WebSocket handshake when at capacity or overloaded
+
+    A client resuming a session it still holds (?resume=<token>) is let in
+    while overloaded: picking its session back up costs no roster update.
+    """
+    if len(outboxes) - len(detached) >= MAX_CONNECTIONS:
+        reason = "max_connections"
+    elif overload.active and registry.socket_for_token(resume_token) is None:
+        reason = "overload"
+    else:
+        return None
+    refused.inc(reason)
+    response = connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, try again later\n")
+    response.headers["Retry-After"] = "5"
+    return response
+
+def admit(websocket, msg_type, now):
+    """Check a message against its connection's rate limits, returning False
+    if it must be dropped"""
+    limits = rate_limits.get(websocket)
+    if limits is None or limits.allow(msg_type, now):
+        return True
+    rate_limited.inc("all" if msg_type == ANY_TYPE else type_label(msg_type))
+    if limits.rejected == 1:
+        logger.warning(f"Client {registry.get(websocket, UNKNOWN_SESSION).id} is over its "
+                       f"{msg_type} rate limit, dropping messages")
+    elif limits.rejected == MAX_REJECTED:
+        logger.warning(f"Client {registry.get(websocket, UNKNOWN_SESSION).id} kept over its rate limits, "
+                       f"closing connection")
+        spawn(websocket.close(CLOSE_POLICY_VIOLATION, "Rate limit exceeded"))
+    return False
+
+async def apply_deferred():
+    """Carry out the renames and resyncs put off during an overload"""
+    renames = list(deferred_renames.items())
+    deferred_renames.clear()
+    for websocket, name in renames:
+        session = registry.get(websocket)
+        if session is not None:
+            await update_client_name(websocket, session.id, name)
+    resyncs = list(deferred_resyncs)
+    deferred_resyncs.clear()
+    for websocket in resyncs:
+        if websocket in registry:
+            send_client_list(websocket)
+
+async def start_bus():
+    """Connect to the presence bus"""
+    global bus
+    transport = UnixSocketBus(BUS_PATH) if BUS_PATH else LocalBus()
+    bus = await transport.start(WORKER_ID, on_bus_message)
+    return bus
+
+def roster_add(client):
+    roster_remove(client["id"])
+    roster[client["id"]] = client
+    room_members.setdefault(client["room"], {})[client["id"]] = client
+
+def roster_remove(user_id):
+    client = roster.pop(user_id, None)
+    if client is not None:
+        members = room_members[client["room"]]
+        del members[user_id]
+        if not members:
+            del room_members[client["room"]]
+
+def on_bus_message(message):
+    """Apply a roster update or routed message from the presence bus"""
+    global room_versions, version_floor, staged_snapshot
+    op = message["op"]
+
+    if op == "snapshot_begin":
+        staged_snapshot = {"version_floor": message["version_floor"], "versions": {}, "clients": []}
+
+    elif op == "snapshot_chunk":
+        staged_snapshot["versions"].update(message["versions"])
+        staged_snapshot["clients"].extend(message["clients"])
+
+    elif op == "snapshot_end":
+        roster.clear()
+        room_members.clear()
+        for client in staged_snapshot["clients"]:
+            roster_add(client)
+        room_versions = staged_snapshot["versions"]
+        version_floor = staged_snapshot["version_floor"]
+        staged_snapshot = None
+        # Our clients may have missed updates while we were disconnected
+        for websocket in connected_clients:
+            send_client_list(websocket)
+
+    elif op == "presence":
+        delta = message["delta"]
+        room = message["room"]
+        if delta["type"] == "peer_joined":
+            roster_add(dict(delta["client"], room=room, worker=message["worker"]))
+        elif delta["type"] == "peer_left":
+            roster_remove(delta["id"])
+        elif delta["type"] == "peers_left":
+            for user_id in delta["ids"]:
+                roster_remove(user_id)
+        elif delta["type"] == "peer_renamed":
+            roster_add({"id": delta["id"], "name": delta["name"], "room": room, "worker": message["worker"]})
+        if room in room_members:
+            room_versions[room] = delta["version"]
+        else:
+            room_versions.pop(room, None)
+            version_floor = max(version_floor, delta["version"])
+        broadcast(delta, room)
+
+    elif op == "evict":
+        # The user ID registered again on another worker
+        websocket = registry.socket_for(message["id"])
+        if websocket is not None:
+            registry.remove(websocket)
+            logger.warning(f"Client {message['id']} re-registered elsewhere, closing connection")
+            spawn(websocket.close(CLOSE_SESSION_REPLACED, "Session replaced"))
+
+    elif op == "deliver":
+        target_socket = registry.socket_for(message["target_id"])
+        if target_socket is not None:
+            sender = message["sender"]
+            deliver_message(target_socket, message["type"], Session(sender["id"], sender["name"]),
+                            message["raw"], time.perf_counter())
+
+async def register_client(websocket, user_id, name=None, protocol=1, room=DEFAULT_ROOM):
+    """Register a new client with their user ID and name in a room"""
+    name = name or user_id
+    previous_info = registry.get(websocket)
+    token = secrets.token_urlsafe(16) if RESUME_GRACE > 0 else None
+
+    displaced = registry.add(websocket, user_id, name, protocol, room, token)
+    logger.info(f"Client registered: {user_id} ({name or 'unnamed'}) in room {room}")
+    if token is not None:
+        send(websocket, session_frame(token, resumed=False), msg_type="session")
+    send(websocket, ice_config_frame(stun_host(websocket)), msg_type="ice_config")
+
+    if displaced is not None:
+        # Don't wait for the closing handshake, the old socket may be half-open
+        logger.warning(f"Client {user_id} re-registered, closing previous connection")
+        spawn(displaced.close(CLOSE_SESSION_REPLACED, "Session replaced"))
+
+    # The new client gets one snapshot, then the same deltas as everyone
+    # else; it ignores any the snapshot already covers
+    send_client_list(websocket)
+    if previous_info is not None and previous_info.id != user_id:
+        bus.publish({"op": "leave", "id": previous_info.id})
+    # A pending leave for this user ID must reach the hub before the join
+    announce_departures()
+    bus.publish({"op": "join", "id": user_id, "name": name, "room": room})
+
+def session_frame(token, resumed):
+    """Encode the message telling a client how to resume its session"""
+    return json.dumps({
+        "type": "session",
+        "resume_token": token,
+        "resumed": resumed,
+        "grace": RESUME_GRACE
+    })
+
+async def resume_session(websocket, user_id, name, token):
+    """Reattach a session to a reconnecting client, returning True on success
+
+    Nothing is announced to the room: to everyone else the client never left.
+    """
+    old_websocket = registry.socket_for_token(token)
+    if old_websocket is websocket:
+        return True
+    old_outbox = outboxes.get(old_websocket)
+    if old_outbox is None or old_outbox.closed or registry.get(old_websocket).id != user_id:
+        return False
+
+    timer = detached.pop(old_websocket, None)
+    if timer is not None:
+        timer.cancel()
+    else:
+        # The old connection hasn't noticed it is dead yet
+        spawn(old_websocket.close(CLOSE_SESSION_REPLACED, "Session replaced"))
+
+    # Carry over everything queued while the client was away
+    registry.rebind(old_websocket, websocket)
+    outboxes.pop(websocket).close()
+    del outboxes[old_websocket]
+    old_outbox.detach()
+    old_outbox.attach(websocket)
+    outboxes[websocket] = old_outbox
+    logger.info(f"Client resumed: {user_id} ({len(old_outbox)} frames buffered)")
+
+    send(websocket, session_frame(token, resumed=True), msg_type="session")
+    if name != registry.get(websocket).name:
+        await update_client_name(websocket, user_id, name)
+    return True
+
+def detach_session(websocket):
+    """Keep a dropped client's session for RESUME_GRACE seconds"""
+    outboxes[websocket].detach()
+    loop = asyncio.get_running_loop()
+    detached[websocket] = loop.call_later(RESUME_GRACE, expire_session, websocket)
+
+def expire_session(websocket):
+    """Give up on a detached session that was not resumed in time"""
+    drop_session(websocket)
+    unregister_client(websocket)
+
+def drop_session(websocket):
+    """Discard the outbound queue and resume timer of a websocket"""
+    timer = detached.pop(websocket, None)
+    if timer is not None:
+        timer.cancel()
+    outbox = outboxes.pop(websocket, None)
+    if outbox is not None:
+        outbox.close()
+
+def start_heartbeat():
+    """Start checking that connections are alive, unless disabled"""
+    global heartbeat
+    if HEARTBEAT_INTERVAL > 0:
+        heartbeat = Heartbeat(HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, reap_connections)
+        heartbeat.start()
+
+def reap_connections(dead):
+    """Drop connections that stopped answering heartbeats
+
+    Their handlers then treat them like any dropped connection: sessions are
+    kept for RESUME_GRACE seconds, since a phone that slept through its
+    heartbeat reconnects on waking. Sessions that expire together reach their
+    rooms in one update.
+    """
+    ids = [getattr(registry.get(websocket), "id", "unregistered") for websocket in dead]
+    for websocket in dead:
+        # Nobody is there to finish a closing handshake
+        websocket.transport.abort()
+    reaped.inc(amount=len(dead))
+    logger.warning(f"Reaped {len(dead)} unresponsive connection(s): {', '.join(ids)}")
 
 async def update_client_name(websocket, user_id, name):
     """Update a client's name"""
-    if websocket in connected_clients:
-        connected_clients[websocket]["name"] = name
+    session = registry.get(websocket)
+    if session is not None and session.name == name:
+        return
+    if registry.rename(websocket, name):
         logger.info(f"Client {user_id} updated name to: {name}")
         
-        # Notify all clients about the updated list
-        await send_client_list()
-
-async def unregister_client(websocket):
-    """Remove a client from the connected clients list"""
-    if websocket in connected_clients:
-        client_info = connected_clients[websocket]
-        del connected_clients[websocket]
-        logger.info(f"Client unregistered: {client_info['id']} ({client_info['name']})")
-        
-        # Notify all remaining clients about the updated list
-        await send_client_list()
+        # Notify the room about the new name
+        bus.publish({"op": "rename", "id": registry.get(websocket).id, "name": name})
+
+def unregister_client(websocket):
+    """Remove a client from the connected clients list
+
+    Rooms are told DEPARTURE_WINDOW seconds after the first departure, so
+    clients that go together (reaped at once, or expiring together) reach
+    each room in one peers_left update.
+    """
+    global departure_timer
+    session = registry.remove(websocket)
+    if session is not None:
+        logger.info(f"Client unregistered: {session.id} ({session.name})")
+        if departure_timer is None:
+            departure_timer = asyncio.get_running_loop().call_later(DEPARTURE_WINDOW, announce_departures)
+        departed.append(session.id)
+
+def announce_departures():
+    """Notify the rooms of the clients that left"""
+    global departure_timer
+    if departure_timer is not None:
+        departure_timer.cancel()
+        departure_timer = None
+    if not departed:
+        return
+    if len(departed) == 1:
+        bus.publish({"op": "leave", "id": departed[0]})
+    else:
+        bus.publish({"op": "leave_many", "ids": list(departed)})
+    departed.clear()
 
-async def send_client_list():
-    """Send the current list of connected clients to all clients"""
+def client_list_frame(room=DEFAULT_ROOM):
+    """Encode a snapshot of the clients in a room"""
     client_list = [
         {"id": client["id"], "name": client["name"]} 
-        for client in connected_clients.values()
+        for client in room_members.get(room, {}).values()
     ]
     
     message = {
         "type": "client_list",
+        "room": room,
+        "version": room_versions.get(room, version_floor),
         "clients": client_list
     }
-    
-    # Send to all connected clients
-    if connected_clients:
-        # Create a list of tasks to send messages concurrently
-        tasks = []
-        for client in list(connected_clients.keys()):  # Use list() to avoid "dictionary changed size during iteration"
-            try:
-                tasks.append(client.send(json.dumps(message)))
-            except:
-                # Remove disconnected clients
-                if client in connected_clients:
-                    del connected_clients[client]
-        
-        # Run all tasks concurrently
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+    return json.dumps(message)
+
+def snapshot_for(websocket):
+    """Encode a snapshot of the room a websocket is registered in"""
+    session = registry.get(websocket)
+    return client_list_frame(session.room if session is not None else DEFAULT_ROOM)
+
+def send(websocket, frame, kind=KIND_SIGNAL, msg_type=None, started=None):
+    """Queue a frame for a websocket, returning False if it was not accepted
+
+    msg_type labels the frame in the metrics; started is the time the message
+    was received, for the forwarding latency histogram.
+    """
+    outbox = outboxes.get(websocket)
+    if outbox is None:
+        return False
+    if msg_type is not None:
+        frames_out.inc(msg_type)
+    return outbox.push(frame, kind, started)
+
+def send_client_list(websocket):
+    """Send a snapshot of its room to one client"""
+    # Built when the writer gets to it, so it is never older than the
+    # deltas queued behind it
+    if not send(websocket, snapshot_for, KIND_PRESENCE, "client_list"):
+        logger.error("Failed to queue client list")
+
+def broadcast(message, room=DEFAULT_ROOM):
+    """Send a message to all clients registered in a room
+
+    The message is serialized once and the same frame is queued for every
+    socket without awaiting any send.
+    """
+    members = registry.sockets_in(room)
+    if members:
+        started = time.perf_counter()
+        frame = json.dumps(message)
+        for client in members:
+            send(client, frame, KIND_PRESENCE)
+        frames_out.inc(message["type"], len(members))
+        broadcast_duration.observe(time.perf_counter() - started)
+
+def outbox_stats():
+    """Outbound queue depth per connection, deepest first"""
+    stats = [
+        {
+            "id": getattr(registry.get(websocket), "id", "unregistered"),
+            "depth": len(outbox),
+            "high_water": outbox.high_water,
+            "dropped": outbox.dropped,
+            "detached": websocket in detached,
+        }
+        for websocket, outbox in outboxes.items()
+    ]
+    stats.sort(key=lambda entry: entry["depth"], reverse=True)
+    return stats
+
+async def report_lagging_outboxes():
+    """Periodically log connections whose outbound queue is backing up"""
+    while True:
+        await asyncio.sleep(OUTBOX_REPORT_INTERVAL)
+        for entry in outbox_stats():
+            if entry["depth"] < OUTBOX_LIMIT // 2:
+                break
+            logger.warning(
+                f"Client {entry['id']} is lagging: {entry['depth']} frames queued, "
+                f"{entry['dropped']} dropped"
+            )
+
+# Signaling messages relayed verbatim to their target, with a label for logging
+FORWARDED_TYPES = {
+    "offer": "offer",
+    "answer": "answer",
+    "ice_candidate": "ICE candidate",
+    "ice_candidates": "ICE candidate batch",
+    "hangup": "hangup",
+}
+
+ICE_TYPES = ("ice_candidate", "ice_candidates")
+
+# ICE candidates from one sender to one target that arrive within this many
+# seconds of each other are delivered as a single ice_candidates frame. 0
+# forwards every frame on its own.
+ICE_BATCH_WINDOW = float(os.environ.get("SIGNALING_ICE_BATCH_WINDOW", "0.02"))
+
+# Candidates waiting for their batch to be flushed, with when the first of
+# them was received (for the forwarding latency):
+# {(websocket, target_id): (sender_info, [raw frame], TimerHandle, started)}
+ice_batches = {}
+
+# Clients that register with this protocol version accept forwarded messages
+# wrapped in an envelope: {"v": 2, "payload": <original frame>, "type": ...,
+# "sender_id": ..., "sender_name": ...}. Older clients get the sender fields
+# merged into the message itself.
+ENVELOPE_VERSION = 2
+
+# app.js puts the routing fields first in every signaling frame, so they can be
+# read without parsing the (often multi-KB) SDP or candidate that follows
+ROUTING_HEADER = re.compile(
+    r'\{\s*"type"\s*:\s*"(?P<type>[a-z_]+)"\s*,\s*"target_id"\s*:\s*"(?P<target_id>[^"\\]*)"'
+)
+
+def wrap_frame(msg_type, sender_info, raw):
+    """Wrap an unparsed client frame in a forwarding envelope
+
+    The server's fields come after the payload: with JSON's last-key-wins rule
+    a crafted payload cannot override the sender identity.
+    """
+    return (
+        f'{{"v":{ENVELOPE_VERSION},"payload":{raw},"type":"{msg_type}",'
+        f'"sender_id":{json.dumps(sender_info.id)},'
+        f'"sender_name":{json.dumps(sender_info.name)}}}'
+    )
+
+def wrap_batch(sender_info, raws):
+    """Wrap several unparsed ICE frames in one forwarding envelope"""
+    return (
+        f'{{"v":{ENVELOPE_VERSION},"batch":[{",".join(raws)}],"type":"ice_candidates",'
+        f'"sender_id":{json.dumps(sender_info.id)},'
+        f'"sender_name":{json.dumps(sender_info.name)}}}'
+    )
+
+def split_batch(raws):
+    """Expand batched ICE frames into single ice_candidate messages, for
+    clients that predate batching"""
+    for raw in raws:
+        # One bad frame only costs its own candidates
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.warning("Dropping malformed ICE frame from a batch")
+            continue
+        if data.get("type") == "ice_candidates":
+            for candidate in data.get("candidates", []):
+                yield {"type": "ice_candidate", "target_id": data.get("target_id"), "candidate": candidate}
+        else:
+            yield data
+
+def deliver_message(target_socket, msg_type, sender_info, raw, started=None):
+    """Queue a signaling message for a client connected to this process
+
+    raw is a list of frames for a coalesced ICE batch.
+    """
+    modern = registry.get(target_socket).protocol >= ENVELOPE_VERSION
+    if isinstance(raw, list):
+        if modern:
+            return send(target_socket, wrap_batch(sender_info, raw), KIND_ICE, "ice_candidates", started)
+        delivered = True
+        for data in split_batch(raw):
+            data["sender_id"] = sender_info.id
+            data["sender_name"] = sender_info.name
+            delivered = send(target_socket, json.dumps(data), KIND_ICE, "ice_candidate", started) and delivered
+        return delivered
+
+    if modern:
+        frame = wrap_frame(msg_type, sender_info, raw)
+    elif msg_type == "ice_candidates":
+        return deliver_message(target_socket, msg_type, sender_info, [raw], started)
+    else:
+        # Add sender info to the message
+        data = json.loads(raw)
+        data["sender_id"] = sender_info.id
+        data["sender_name"] = sender_info.name
+        frame = json.dumps(data)
+    kind = KIND_ICE if msg_type in ICE_TYPES else KIND_SIGNAL
+    return send(target_socket, frame, kind, msg_type, started)
+
+def queue_ice(websocket, sender_info, target_id, raw, started=None):
+    """Hold an ICE frame until its burst is over
+
+    raw must be valid JSON: handle_message parses every frame before
+    forwarding it, and batches are spliced into envelopes unparsed.
+    """
+    key = (websocket, target_id)
+    batch = ice_batches.get(key)
+    if batch is None:
+        timer = asyncio.get_running_loop().call_later(ICE_BATCH_WINDOW, flush_ice_batch, key)
+        batch = ice_batches[key] = (sender_info, [], timer, started)
+    batch[1].append(raw)
+
+def flush_ice_batch(key):
+    """Deliver the ICE frames held for a (sender, target) pair, if any"""
+    batch = ice_batches.pop(key, None)
+    if batch is None:
+        return
+    sender_info, raws, timer, started = batch
+    timer.cancel()
+    route_message(sender_info, "ice_candidates", key[1], raws, started)
+
+def route_message(sender_info, msg_type, target_id, raw, started=None):
+    """Deliver a message locally, or through the bus to the worker holding the target"""
+    label = FORWARDED_TYPES[msg_type]
+    target_socket = registry.socket_for(target_id)
+    if target_socket:
+        if deliver_message(target_socket, msg_type, sender_info, raw, started):
+            log_frame(logger, msg_type, "%s forwarded", label, sender=sender_info.id, target=target_id)
+        else:
+            forward_failures.inc("queue_closed")
+            logger.error(f"Failed to send {label} to {target_id}: outbound queue closed",
+                         extra={"fields": {"type": msg_type, "sender": sender_info.id, "target": target_id}})
+
+    elif target_id in roster:
+        # The target is connected to another worker, let the hub route it
+        bus.publish({
+            "op": "forward",
+            "worker": roster[target_id]["worker"],
+            "target_id": target_id,
+            "type": msg_type,
+            "sender": {"id": sender_info.id, "name": sender_info.name},
+            "raw": raw
+        })
+        log_frame(logger, msg_type, "%s routed to worker %s", label, roster[target_id]["worker"],
+                  sender=sender_info.id, target=target_id)
+
+    else:
+        forward_failures.inc("unknown_target")
+        logger.warning(f"Not forwarding {label} to {target_id}: no such client",
+                       extra={"fields": {"type": msg_type, "sender": sender_info.id, "target": target_id}})
+
+async def forward_message(websocket, msg_type, target_id, raw, received=None):
+    """Forward a WebRTC signaling message to the client named in target_id"""
+    label = FORWARDED_TYPES[msg_type]
+    sender_info = registry.get(websocket, UNKNOWN_SESSION)
+    log_frame(logger, msg_type, "Forwarding %s", label, sender=sender_info.id, target=target_id)
+    if not target_id:
+        return
+
+    if SAME_ROOM_ONLY and roster.get(target_id, {}).get("room") != sender_info.room:
+        forward_failures.inc("other_room")
+        logger.warning(f"Not forwarding {label} to {target_id}: not in the sender's room")
+        return
+
+    if msg_type in ICE_TYPES and ICE_BATCH_WINDOW > 0:
+        queue_ice(websocket, sender_info, target_id, raw, received)
+        return
+
+    # Candidates sent before this message must still arrive before it
+    flush_ice_batch((websocket, target_id))
+    route_message(sender_info, msg_type, target_id, raw, received)
+
+# Call setup tracing. app.js stamps a call ID on the offer, answer, ICE and
+# hangup messages of a call and reports how long each side's setup phases
+# took. The server adds what it saw of the call: how long it took to relay
+# the offer and answer, and the wait between them. app.js sends the call ID
+# right after the routing header, where CALL_ID picks it up without scanning
+# the SDP.
+CALL_ID = re.compile(r'\s*,\s*"call_id"\s*:\s*"([^"\\]{1,64})"')
+MAX_CALL_ID_LENGTH = 64
+TRACED_TYPES = ("offer", "answer")
+
+# Phases app.js reports, in milliseconds since pressing Call or accepting
+CALL_PHASES = ("get_user_media", "create_offer", "create_answer", "first_candidate",
+               "answer_received", "ice_connected", "first_audio")
+
+# Calls whose server-side timings are kept for the clients' reports, oldest
+# dropped first
+MAX_CALL_TRACES = 1000
+
+class CallTrace:
+    """Server-side timings of one call"""
+
+    __slots__ = ("offer_received", "offer_relay", "answer_received", "answer_relay")
+
+    def __init__(self, offer_received, offer_relay):
+        self.offer_received = offer_received
+        self.offer_relay = offer_relay
+        self.answer_received = None
+        self.answer_relay = None
+
+    def timings(self):
+        """The server's timings in milliseconds"""
+        timings = {"offer_relay": self.offer_relay * 1000}
+        if self.answer_received is not None:
+            timings["offer_to_answer"] = (self.answer_received - self.offer_received) * 1000
+            timings["answer_relay"] = self.answer_relay * 1000
+        return {name: round(ms, 2) for name, ms in timings.items()}
+
+# {call ID: CallTrace}
+call_traces = collections.OrderedDict()
+
+def trace_call(msg_type, call_id, received):
+    """Note when an offer or answer was received and when it was passed on
+    (queued for its target, or handed to the bus)"""
+    if not isinstance(call_id, str) or not 0 < len(call_id) <= MAX_CALL_ID_LENGTH:
+        return
+    relay = time.perf_counter() - received
+    call_phases.observe(relay, f"server_{msg_type}_relay")
+    if msg_type == "offer":
+        call_traces[call_id] = CallTrace(received, relay)
+        call_traces.move_to_end(call_id)
+        if len(call_traces) > MAX_CALL_TRACES:
+            call_traces.popitem(last=False)
+        return
+    trace = call_traces.get(call_id)
+    if trace is not None and trace.answer_received is None:
+        trace.answer_received = received
+        trace.answer_relay = relay
+        call_phases.observe(received - trace.offer_received, "server_offer_to_answer")
+
+def record_call_metrics(websocket, data):
+    """Aggregate the setup phases a client reports for a call"""
+    role = data.get("role")
+    phases = data.get("phases")
+    if role not in ("caller", "callee") or not isinstance(phases, dict):
+        return
+    timings = {}
+    for phase in CALL_PHASES:
+        ms = phases.get(phase)
+        if isinstance(ms, (int, float)) and 0 <= ms < 600000:
+            call_phases.observe(ms / 1000, f"{role}_{phase}")
+            timings[phase] = ms
+    completed = data.get("completed") is True
+    call_setups.inc("completed" if completed else "failed")
+
+    call_id = str(data.get("call_id"))[:64]
+    trace = call_traces.get(call_id)
+    server = trace.timings() if trace is not None else {}
+    summary = ", ".join(f"{phase} {ms:.0f} ms" for phase, ms in timings.items()) or "no phases"
+    logger.info(
+        f"Call {call_id} {role} setup {'completed' if completed else 'failed'}: {summary}",
+        extra={"fields": {
+            "call_id": call_id,
+            "client": registry.get(websocket, UNKNOWN_SESSION).id,
+            "role": role,
+            "completed": completed,
+            "phases_ms": timings,
+            "server_ms": server,
+        }}
+    )
 
 async def handle_message(websocket, message):
     """Handle incoming messages from clients"""
+    received = time.perf_counter()
+    now = time.monotonic()
+    if not admit(websocket, ANY_TYPE, now):
+        return
     try:
+        if isinstance(message, bytes):
+            message = message.decode()
+
+        # Fast path: route signaling frames on their header alone
+        header = ROUTING_HEADER.match(message)
+        if header and header["type"] in FORWARDED_TYPES:
+            frames_in.inc(header["type"])
+            if admit(websocket, header["type"], now):
+                # The frame is passed on as it is, so it must be valid JSON.
+                # The C decoder is the cheapest complete check; a grammar
+                # regex over the SDP is slower. The result is not used.
+                json.loads(message)
+                await forward_message(websocket, header["type"], header["target_id"], message, received)
+                if header["type"] in TRACED_TYPES:
+                    call_id = CALL_ID.match(message, header.end())
+                    if call_id:
+                        trace_call(header["type"], call_id[1], received)
+            return
+
         data = json.loads(message)
         msg_type = data.get("type")
+        frames_in.inc(type_label(msg_type))
+        if not admit(websocket, msg_type, now):
+            return
         
-        logger.info(f"Received message type: {msg_type} from {connected_clients.get(websocket, {}).get('id', 'unknown')}")
+        log_frame(logger, msg_type, "Received %s", msg_type,
+                  client=registry.get(websocket, UNKNOWN_SESSION).id)
         
         if msg_type == "register":
             user_id = data.get("user_id", "Anonymous")
             name = data.get("name", user_id)
+            protocol = data.get("protocol", 1)
+            if not isinstance(protocol, int):
+                protocol = 1
+            room = data.get("room") or DEFAULT_ROOM
+            if not isinstance(room, str) or len(room) > MAX_ROOM_LENGTH:
+                room = DEFAULT_ROOM
+            token = data.get("resume_token")
+            if token and await resume_session(websocket, user_id, name, token):
+                return
+            # A new session costs a roster update for the whole room
+            if overload.active or not registrations.take():
+                reason = "overload" if overload.active else "register_rate"
+                refused.inc(reason)
+                logger.warning(f"Refusing registration of {user_id}: {reason}")
+                await websocket.close(CLOSE_TRY_AGAIN_LATER, "Server busy")
+                return
             logger.info(f"Registering client: {user_id} ({name})")
-            await register_client(websocket, user_id, name)
+            await register_client(websocket, user_id, name, protocol, room)
             
         elif msg_type == "update_name":
             user_id = data.get("user_id")
             name = data.get("name", user_id)
+            if overload.active:
+                shed.inc(msg_type)
+                deferred_renames[websocket] = name
+                return
             logger.info(f"Updating name for client: {user_id} to {name}")
             await update_client_name(websocket, user_id, name)
+
+        elif msg_type == "resync":
+            # The client noticed a gap in roster versions
+            if overload.active:
+                shed.inc(msg_type)
+                deferred_resyncs.add(websocket)
+            elif websocket in registry:
+                send_client_list(websocket)
             
-        elif msg_type == "offer":
-            target_id = data.get("target_id")
-            sender_info = connected_clients.get(websocket, {"id": "unknown", "name": "unknown"})
-            logger.info(f"Forwarding offer from {sender_info['id']} ({sender_info['name']}) to {target_id}")
-            # Forward WebRTC signaling messages to the target client
-            if target_id:
-                # Find the target websocket
-                target_socket = None
-                for ws, client_info in connected_clients.items():
-                    if client_info["id"] == target_id:
-                        target_socket = ws
-                        break
-                        
-                if target_socket:
-                    # Add sender info to the message
-                    data["sender_id"] = sender_info["id"]
-                    data["sender_name"] = sender_info["name"]
-                    try:
-                        await target_socket.send(json.dumps(data))
-                        logger.info(f"Offer forwarded successfully")
-                    except Exception as e:
-                        logger.error(f"Failed to send offer to {target_id}: {e}")
-                    
-        elif msg_type == "answer":
-            target_id = data.get("target_id")
-            sender_info = connected_clients.get(websocket, {"id": "unknown", "name": "unknown"})
-            logger.info(f"Forwarding answer from {sender_info['id']} ({sender_info['name']}) to {target_id}")
-            # Forward WebRTC signaling messages to the target client
-            if target_id:
-                # Find the target websocket
-                target_socket = None
-                for ws, client_info in connected_clients.items():
-                    if client_info["id"] == target_id:
-                        target_socket = ws
-                        break
-                        
-                if target_socket:
-                    # Add sender info to the message
-                    data["sender_id"] = sender_info["id"]
-                    data["sender_name"] = sender_info["name"]
-                    try:
-                        await target_socket.send(json.dumps(data))
-                        logger.info(f"Answer forwarded successfully")
-                    except Exception as e:
-                        logger.error(f"Failed to send answer to {target_id}: {e}")
-                    
-        elif msg_type == "ice_candidate":
-            target_id = data.get("target_id")
-            sender_info = connected_clients.get(websocket, {"id": "unknown", "name": "unknown"})
-            logger.info(f"Forwarding ICE candidate from {sender_info['id']} ({sender_info['name']}) to {target_id}")
-            # Forward WebRTC signaling messages to the target client
-            if target_id:
-                # Find the target websocket
-                target_socket = None
-                for ws, client_info in connected_clients.items():
-                    if client_info["id"] == target_id:
-                        target_socket = ws
-                        break
-                        
-                if target_socket:
-                    # Add sender info to the message
-                    data["sender_id"] = sender_info["id"]
-                    data["sender_name"] = sender_info["name"]
-                    try:
-                        await target_socket.send(json.dumps(data))
-                        logger.info(f"ICE candidate forwarded successfully")
-                    except Exception as e:
-                        logger.error(f"Failed to send ICE candidate to {target_id}: {e}")
-                    
-        elif msg_type == "hangup":
-            # Forward hangup message to the target client
-            target_id = data.get("target_id")
-            sender_info = connected_clients.get(websocket, {"id": "unknown", "name": "unknown"})
-            logger.info(f"Forwarding hangup from {sender_info['id']} ({sender_info['name']}) to {target_id}")
-            if target_id:
-                target_socket = None
-                for ws, client_info in connected_clients.items():
-                    if client_info["id"] == target_id:
-                        target_socket = ws
-                        break
-                        
-                if target_socket:
-                    data["sender_id"] = sender_info["id"]
-                    data["sender_name"] = sender_info["name"]
-                    try:
-                        await target_socket.send(json.dumps(data))
-                        logger.info(f"Hangup forwarded successfully")
-                    except Exception as e:
-                        logger.error(f"Failed to send hangup to {target_id}: {e}")
+        elif msg_type == "call_metrics":
+            record_call_metrics(websocket, data)
+
+        elif msg_type in FORWARDED_TYPES:
+            # Frames from clients that don't lead with the routing header
+            await forward_message(websocket, msg_type, data.get("target_id"), message, received)
+            if msg_type in TRACED_TYPES:
+                trace_call(msg_type, data.get("call_id"), received)
                     
     except json.JSONDecodeError:
         logger.error("Invalid JSON message received")
@@ -210,43 +1161,105 @@ async def handle_message(websocket, message):
 async def handler(websocket):
     """Handle a new WebSocket connection"""
     logger.info(f"New WebSocket connection from {websocket.remote_address}")
+    outbox = Outbox(websocket, OUTBOX_LIMIT, OUTBOX_POLICY, snapshot=snapshot_for, on_sent=observe_forward)
+    outboxes[websocket] = outbox
+    outbox.start()
+    rate_limits[websocket] = ConnectionLimits(RATE_LIMITS)
+    if heartbeat is not None:
+        heartbeat.add(websocket)
+    connection = recorder.opened() if recorder else None
     try:
         async for message in websocket:
+            if heartbeat is not None:
+                heartbeat.touch(websocket)
+            if recorder:
+                recorder.frame(connection, message)
             await handle_message(websocket, message)
     except websockets.exceptions.ConnectionClosed:
         logger.info("Client disconnected")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
     finally:
-        await unregister_client(websocket)
+        if heartbeat is not None:
+            heartbeat.remove(websocket)
+        del rate_limits[websocket]
+        deferred_resyncs.discard(websocket)
+        deferred_renames.pop(websocket, None)
+        if recorder:
+            recorder.closed(connection)
+        # The outbox may belong to a resumed session by now, so look it up
+        outbox = outboxes.get(websocket)
+        if RESUME_GRACE > 0 and websocket in registry and outbox is not None and not outbox.closed:
+            detach_session(websocket)
+        else:
+            drop_session(websocket)
+            unregister_client(websocket)
 
 # Main function
 async def main():
     """Main function to start the server"""
+    if OUTBOX_POLICY not in POLICIES:
+        raise SystemExit(f"SIGNALING_OUTBOX_POLICY must be one of: {', '.join(POLICIES)}")
+
     # Check if we should use SSL
     use_ssl = os.path.exists("server.crt") and os.path.exists("server.key")
+
+    await start_bus()
+
+    # Worker mode: several processes accept on the same port
+    serve_options = {"reuse_port": True} if BUS_PATH else {}
+    serve_options["process_request"] = process_request
+    if SERVE_APP:
+        serve_options["create_connection"] = functools.partial(UnifiedConnection, respond_to=app_response)
+    serve_options.update(connection_limits())
+    port = APP_PORT if SERVE_APP else SIGNALING_PORT
     
     if use_ssl:
-        # Set up SSL context
-        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        ssl_context.load_cert_chain("server.crt", "server.key")
-        
         # For websockets v15, we pass the handler directly with SSL
-        server = await websockets.serve(handler, "0.0.0.0", 8765, ssl=ssl_context)
-        logger.info(f"Secure signaling server started on wss://{lan_ip}:8765")
-        logger.info(f"Accessible locally at wss://localhost:8765")
-        print(f"Secure signaling server started on wss://{lan_ip}:8765")
-        print(f"Accessible locally at wss://localhost:8765")
+        server = await websockets.serve(handler, "0.0.0.0", port, ssl=server_context(), **serve_options)
+        scheme = "wss"
     else:
         # For websockets v15, we pass the handler directly
-        server = await websockets.serve(handler, "0.0.0.0", 8765)
-        logger.info(f"Signaling server started on ws://{lan_ip}:8765")
-        logger.info(f"Accessible locally at ws://localhost:8765")
-        print(f"Signaling server started on ws://{lan_ip}:8765")
-        print(f"Accessible locally at ws://localhost:8765")
+        server = await websockets.serve(handler, "0.0.0.0", port, **serve_options)
+        scheme = "ws"
+
+    if SERVE_APP:
+        web_scheme = "https" if use_ssl else "http"
+        started = [
+            f"Voice call app and signaling started on {web_scheme}://{lan_ip}:{port} (WebSocket at {WS_PATH})",
+            f"Accessible locally at {web_scheme}://localhost:{port}",
+        ]
+    else:
+        secure = "Secure signaling" if use_ssl else "Signaling"
+        started = [
+            f"{secure} server started on {scheme}://{lan_ip}:{port}",
+            f"Accessible locally at {scheme}://localhost:{port}",
+        ]
+    if STUN_PORT:
+        await start_stun_server("0.0.0.0", STUN_PORT, reuse_port=bool(BUS_PATH))
+        started.append(f"STUN responder started on udp://{lan_ip}:{STUN_PORT}")
+    if METRICS_PORT:
+        await start_http_server(status_response, "0.0.0.0", METRICS_PORT)
+        started.append(f"Metrics served on http://{lan_ip}:{METRICS_PORT}/metrics")
+    for line in started:
+        logger.info(line)
+        print(line)
+    notify_ready()
     
+    spawn(report_lagging_outboxes())
+    spawn(monitor_event_loop())
+    start_heartbeat()
+    start_recording()
+
+    # A worker cut off from the bus can't see the rest of the roster, so stop
+    # and let the supervisor restart it
+    bus_lost = spawn(bus.wait_closed())
+    bus_lost.add_done_callback(lambda _: server.close())
+
     try:
         await server.wait_closed()
+        if bus_lost.done():
+            raise SystemExit("Lost connection to the presence bus")
     except KeyboardInterrupt:
         logger.info("Server shutting down...")
         server.close()
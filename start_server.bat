@@ -33,7 +33,7 @@ echo.
 
 REM Install required packages
 echo Installing required packages...
-python -m pip install pyOpenSSL websockets
+python -m pip install cryptography websockets
 if %errorlevel% neq 0 (
     echo Error: Failed to install required packages
     pause
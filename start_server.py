@@ -2,44 +2,105 @@
 """
 Start script for the LAN Voice Call HTTPS server
 This script will:
-1. Check if required libraries are installed
-2. Install missing libraries if needed
-3. Generate SSL certificates if they don't exist
-4. Start both the HTTPS server and signaling server
+1. Check if required libraries are installed, installing missing ones, and
+   generate SSL certificates if they don't exist (in parallel)
+2. Start the HTTPS server and signaling server (and the SFU for group
+   calls, if asked) and wait until they are listening
+3. Restart a server that crashes, waiting longer each time it keeps crashing
 """
 
 import sys
 import os
+import argparse
+import concurrent.futures
+import json
+import queue
+import shutil
 import subprocess
 import importlib.util
+import tempfile
 import threading
 import time
-import signal
 
-def check_and_install_packages():
+from lan_utils import get_local_ip, READY_FILE_ENV
+
+# Remembers which Python installs already have the required packages, so
+# later starts skip the check
+CACHE_FILE = ".startup_cache.json"
+
+# Waits between restarts of a crashing server (seconds), doubling each time
+RESTART_DELAY_MIN = 0.5
+RESTART_DELAY_MAX = 30
+
+# A server that stayed up this long restarts without delay (seconds)
+STABLE_UPTIME = 60
+
+# How long a server may take to start listening (seconds)
+READY_TIMEOUT = 15
+
+class PhaseTimer:
+    """Records how long each startup phase took; phases may overlap"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = []  # [(name, seconds)]
+
+    def record(self, name, started):
+        self.phases.append((name, time.perf_counter() - started))
+
+    def timed(self, name, fn, *args):
+        """Call fn and record how long it took"""
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.record(name, started)
+
+    def report(self):
+        total = time.perf_counter() - self.start
+        breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+        print(f"Started in {total:.2f}s ({breakdown})")
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache):
+    try:
+        with open(CACHE_FILE, "w") as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
+def interpreter_key():
+    """Identifies the Python install packages were checked for"""
+    return f"{sys.executable} {sys.version.split()[0]}"
+
+def check_and_install_packages(cache):
     """Check if required packages are installed and install them if missing"""
+    if cache.get("packages") == interpreter_key():
+        print("✅ Required packages found (cached)")
+        return True
+
     required_packages = [
-        ("OpenSSL", "pyOpenSSL"),
+        ("cryptography", "cryptography"),
         ("websockets", "websockets"),
-        ("http.server", None),  # Built-in module
-        ("ssl", None),  # Built-in module
-        ("socket", None)  # Built-in module
     ]
-    
+
     missing_packages = []
-    
+
     print("Checking required packages...")
-    
+
     for package_name, install_name in required_packages:
         if importlib.util.find_spec(package_name) is None:
-            if install_name:  # Only add to missing if it needs to be installed
-                missing_packages.append((package_name, install_name))
-                print(f"  ❌ {package_name} - Missing")
-            else:
-                print(f"  ❓ {package_name} - Built-in module (not found, but should be available)")
+            missing_packages.append((package_name, install_name))
+            print(f"  ❌ {package_name} - Missing")
         else:
             print(f"  ✅ {package_name} - Available")
-    
+
     if missing_packages:
         print(f"\nInstalling {len(missing_packages)} missing package(s)...")
         for package_name, install_name in missing_packages:
@@ -53,30 +114,37 @@ def check_and_install_packages():
         print("All packages installed successfully!\n")
     else:
         print("All required packages are already installed!\n")
-    
+
+    cache["packages"] = interpreter_key()
     return True
 
-def check_ssl_certificates():
-    """Check if SSL certificates exist, generate them if they don't"""
+def check_ssl_certificates(packages_ready):
+    """Check if SSL certificates exist, generate them if they don't
+
+    packages_ready is the future of the package check; it is only waited for
+    if cryptography has to be installed before generating certificates.
+    """
     cert_file = "server.crt"
     key_file = "server.key"
-    
+
     if os.path.exists(cert_file) and os.path.exists(key_file):
         print("✅ SSL certificates found")
         return True
     else:
         print("❌ SSL certificates not found")
+        if importlib.util.find_spec("cryptography") is None and not packages_ready.result():
+            return False
         print("Generating new SSL certificates...")
-        
+
         try:
             # Import and run the certificate generation script
             spec = importlib.util.spec_from_file_location("generate_cert", "generate_cert.py")
             generate_cert = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(generate_cert)
-            
+
             # Call the certificate generation function
             generate_cert.generate_self_signed_cert()
-            
+
             if os.path.exists(cert_file) and os.path.exists(key_file):
                 print("✅ SSL certificates generated successfully")
                 return True
@@ -87,23 +155,129 @@ def check_ssl_certificates():
             print(f"❌ Error generating SSL certificates: {e}")
             return False
 
-def get_local_ip():
-    """Get the local IP address"""
-    try:
-        import socket
-        # Connect to a remote address to determine local IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return "127.0.0.1"
-
-def run_both_servers():
-    """Run both servers as separate processes"""
+def run_checks(timer):
+    """Check packages and certificates and look up the LAN IP, in parallel"""
+    cache = load_cache()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+        packages = pool.submit(timer.timed, "packages", check_and_install_packages, cache)
+        certificates = pool.submit(timer.timed, "certificates", check_ssl_certificates, packages)
+        # Cached by lan_utils for the banners
+        pool.submit(timer.timed, "LAN IP", get_local_ip)
+        if not packages.result():
+            print("Failed to install required packages. Exiting.")
+            return False
+        if not certificates.result():
+            print("Failed to generate SSL certificates. Exiting.")
+            return False
+    save_cache(cache)
+    return True
+
+def stop_processes(processes):
+    """Terminate child processes, killing any that don't exit in time"""
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def wait_for_path(path, process, timeout=5):
+    """Wait until a child process creates a file (such as a listening socket)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            return True
+        if process.poll() is not None:
+            return False
+        time.sleep(0.01)
+    return False
+
+class Child:
+    """A server process run by the Supervisor"""
+
+    def __init__(self, name, args, env=None):
+        self.name = name
+        self.args = args
+        # Extra environment, or a callable returning it on every (re)start
+        self.env = env
+        self.process = None
+        self.launched = 0.0
+        self.ready_file = None
+        self.delay = RESTART_DELAY_MIN
+
+class Supervisor:
+    """Starts server processes, waits until they are listening and restarts
+    any that exits
+
+    Each server creates the file named in LANCALL_READY_FILE once it is
+    listening (lan_utils.notify_ready), so readiness is known without sleeps
+    or port probes.
+    """
+
+    def __init__(self, timer):
+        self.timer = timer
+        self.children = {}  # {name: Child}
+        self.exits = queue.Queue()  # (Child, Popen) of processes that exited
+        self.ready_dir = tempfile.mkdtemp(prefix="lancall-ready-")
+
+    def start(self, name, args, env=None):
+        """Start a server process, or restart one by name"""
+        child = self.children.get(name) or Child(name, args, env)
+        self.children[name] = child
+        child.ready_file = os.path.join(self.ready_dir, name)
+        if os.path.exists(child.ready_file):
+            os.unlink(child.ready_file)
+
+        extra_env = child.env() if callable(child.env) else (child.env or {})
+        process_env = dict(os.environ, **extra_env)
+        process_env[READY_FILE_ENV] = child.ready_file
+        child.launched = time.perf_counter()
+        child.process = subprocess.Popen([sys.executable] + child.args, env=process_env)
+        threading.Thread(target=self.watch, args=(child, child.process), daemon=True).start()
+        return child
+
+    def watch(self, child, process):
+        process.wait()
+        self.exits.put((child, process))
+
+    def wait_ready(self, names):
+        """Wait until the named servers are listening, returning False if one
+        failed to start"""
+        for name in names:
+            child = self.children[name]
+            if not wait_for_path(child.ready_file, child.process, READY_TIMEOUT):
+                print(f"❌ {name} failed to start")
+                return False
+            self.timer.record(f"{name} ready", child.launched)
+        return True
+
+    def supervise(self):
+        """Restart servers as they exit, until interrupted"""
+        while True:
+            try:
+                # The timeout lets Ctrl+C through on Windows
+                child, process = self.exits.get(timeout=1)
+            except queue.Empty:
+                continue
+            if process is not child.process:
+                continue
+            if time.perf_counter() - child.launched >= STABLE_UPTIME:
+                child.delay = RESTART_DELAY_MIN
+            print(f"{child.name} exited with code {process.returncode}, restarting in {child.delay:.1f}s...")
+            time.sleep(child.delay)
+            child.delay = min(child.delay * 2, RESTART_DELAY_MAX)
+            self.start(child.name, child.args)
+
+    def stop(self):
+        stop_processes([child.process for child in self.children.values()])
+        shutil.rmtree(self.ready_dir, ignore_errors=True)
+
+def run_both_servers(timer, sfu=False):
+    """Run both servers as separate processes, and the SFU with sfu"""
     local_ip = get_local_ip()
-    
+
     print("=" * 50)
     print("LAN Voice Call Servers")
     print("=" * 50)
@@ -111,6 +285,8 @@ def run_both_servers():
     print(f"Signaling Server: ws://{local_ip}:8765")
     print(f"Local HTTPS access: https://localhost:8443")
     print(f"Local Signaling access: ws://localhost:8765")
+    if sfu:
+        print(f"Group call SFU: wss://{local_ip}:8766")
     print("")
     print("IMPORTANT:")
     print("- Your browser will show a security warning because this is a self-signed certificate")
@@ -120,78 +296,176 @@ def run_both_servers():
     print("")
     print("Press Ctrl+C to stop both servers")
     print("=" * 50)
-    
-    # Start both servers as separate processes
-    https_process = subprocess.Popen([sys.executable, "https_server.py"])
-    # Add a small delay to ensure the first process starts
-    time.sleep(1)
-    signaling_process = subprocess.Popen([sys.executable, "signaling_server.py"])
-    
-    def signal_handler(sig, frame):
-        print("\nStopping both servers...")
-        https_process.terminate()
-        signaling_process.terminate()
-        try:
-            https_process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            https_process.kill()
-        try:
-            signaling_process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            signaling_process.kill()
-        print("Both servers stopped.")
-        sys.exit(0)
-    
-    # Register signal handler for graceful shutdown
-    signal.signal(signal.SIGINT, signal_handler)
-    
+
+    # Start both servers at once; neither depends on the other
+    supervisor = Supervisor(timer)
+    names = ["https", "signaling"]
+    supervisor.start("https", ["https_server.py"])
+    supervisor.start("signaling", ["signaling_server.py"])
+    if sfu:
+        supervisor.start("sfu", ["sfu_server.py"])
+        names.append("sfu")
     try:
-        # Wait for both processes
-        while True:
-            if https_process.poll() is not None:
-                print("HTTPS server has stopped.")
-                signaling_process.terminate()
-                break
-            if signaling_process.poll() is not None:
-                print("Signaling server has stopped.")
-                https_process.terminate()
-                break
-            time.sleep(0.1)
+        if supervisor.wait_ready(names):
+            timer.report()
+            supervisor.supervise()
     except KeyboardInterrupt:
         pass
-    
-    # If we get here, terminate both processes
-    https_process.terminate()
-    signaling_process.terminate()
+    finally:
+        supervisor.stop()
+    print("All servers stopped." if sfu else "Both servers stopped.")
+
+def run_unified_server(timer, sfu=False):
+    """Serve the app and signaling from this process, on port 8443
+
+    With sfu, the SFU runs in a child process on port 8766.
+    """
+    local_ip = get_local_ip()
+
+    print("=" * 50)
+    print("LAN Voice Call Server (unified)")
+    print("=" * 50)
+    print(f"App and signaling: https://{local_ip}:8443 (WebSocket at /ws)")
+    print(f"Local access: https://localhost:8443")
+    if sfu:
+        print(f"Group call SFU: wss://{local_ip}:8766")
+    print("")
+    print("IMPORTANT:")
+    print("- Your browser will show a security warning because this is a self-signed certificate")
+    print("- This is normal for development. Click 'Advanced' and 'Proceed to ...' to continue")
+    print("- All devices on the same network can access this URL")
+    print("")
+    print("Press Ctrl+C to stop the server")
+    print("=" * 50)
+
+    # Read by signaling_server when it is imported
+    os.environ["SIGNALING_SERVE_APP"] = "1"
+    import asyncio
+    supervisor = Supervisor(timer)
+    if sfu:
+        supervisor.start("sfu", ["sfu_server.py"])
+    signaling_server = timer.timed("import", importlib.import_module, "signaling_server")
     try:
-        https_process.wait(timeout=5)
-    except subprocess.TimeoutExpired:
-        https_process.kill()
+        if sfu and not supervisor.wait_ready(["sfu"]):
+            return
+        timer.report()
+        asyncio.run(signaling_server.main())
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+    finally:
+        supervisor.stop()
+
+def run_worker_pool(workers, timer, unified=False, sfu=False):
+    """Run the HTTPS server and a pool of signaling workers sharing port 8765
+
+    The workers accept connections on the same port with SO_REUSEPORT and
+    share the roster through a presence bus hub (presence_bus.py) listening
+    on a Unix-domain socket. Any process that exits is restarted.
+
+    With unified, the workers also serve the app and share port 8443
+    instead, and no separate HTTPS server is started. With sfu, the SFU
+    runs alongside them.
+    """
+    if sys.platform == "win32":
+        print("Worker mode needs SO_REUSEPORT and Unix-domain sockets, which Windows lacks.")
+        print("Starting a single signaling server instead.")
+        if unified:
+            run_unified_server(timer, sfu)
+        else:
+            run_both_servers(timer, sfu)
+        return
+
+    local_ip = get_local_ip()
+    bus_path = os.path.join(tempfile.gettempdir(), f"lancall-bus-{os.getpid()}.sock")
+    # Worker N serves its metrics on this port + N
+    metrics_port = int(os.environ.get("SIGNALING_METRICS_PORT", "8780"))
+
+    print("=" * 50)
+    print("LAN Voice Call Servers")
+    print("=" * 50)
+    if unified:
+        print(f"App and signaling: https://{local_ip}:8443 ({workers} workers)")
+    else:
+        print(f"HTTPS Server: https://{local_ip}:8443")
+        print(f"Signaling Server: ws://{local_ip}:8765 ({workers} workers)")
+    print(f"Worker metrics: http://{local_ip}:{metrics_port}-{metrics_port + workers - 1}/metrics")
+    if sfu:
+        print(f"Group call SFU: wss://{local_ip}:8766")
+    print("")
+    print("Press Ctrl+C to stop all servers")
+    print("=" * 50)
+
+    def worker_env(index):
+        # A restarted worker gets a fresh ID, so the hub drops the old one's
+        # clients, but keeps its index and metrics port
+        env = {
+            "SIGNALING_BUS": bus_path,
+            "SIGNALING_WORKER_ID": f"{index}-{time.monotonic_ns()}",
+            "SIGNALING_WORKER_INDEX": str(index),
+            "SIGNALING_METRICS_PORT": str(metrics_port + index),
+        }
+        if unified:
+            env["SIGNALING_SERVE_APP"] = "1"
+        return env
+
+    supervisor = Supervisor(timer)
+    names = [f"worker {index}" for index in range(workers)]
     try:
-        signaling_process.wait(timeout=5)
-    except subprocess.TimeoutExpired:
-        signaling_process.kill()
-    print("Both servers stopped.")
+        # The HTTPS server can start alongside the hub, the workers need it
+        if not unified:
+            supervisor.start("https", ["https_server.py"])
+            names.append("https")
+        if sfu:
+            supervisor.start("sfu", ["sfu_server.py"])
+            names.append("sfu")
+        supervisor.start("presence bus", ["presence_bus.py", bus_path])
+        if supervisor.wait_ready(["presence bus"]):
+            for index in range(workers):
+                supervisor.start(f"worker {index}", ["signaling_server.py"],
+                                 lambda index=index: worker_env(index))
+            if supervisor.wait_ready(names):
+                timer.report()
+                supervisor.supervise()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+        if os.path.exists(bus_path):
+            os.unlink(bus_path)
+    print("All servers stopped.")
 
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description="Start the LAN Voice Call servers")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of signaling server processes sharing port 8765 (default: 1)")
+    parser.add_argument("--unified", action="store_true",
+                        help="serve the app and signaling from one process on port 8443 (WebSocket at /ws)")
+    parser.add_argument("--sfu", action="store_true",
+                        help="also run the SFU for group calls on port 8766 (needs aiortc)")
+    args = parser.parse_args()
+
     print("LAN Voice Call Server Starter")
     print("=" * 30)
-    
-    # Step 1: Check and install packages
-    if not check_and_install_packages():
-        print("Failed to install required packages. Exiting.")
+    timer = PhaseTimer()
+
+    # Step 1: Check packages and certificates
+    if not run_checks(timer):
         return 1
-    
-    # Step 2: Check SSL certificates
-    if not check_ssl_certificates():
-        print("Failed to generate SSL certificates. Exiting.")
+    # Not installed automatically: it pulls in FFmpeg bindings
+    if args.sfu and importlib.util.find_spec("aiortc") is None:
+        print("❌ The SFU needs aiortc. Install it with: pip install aiortc")
         return 1
-    
-    # Step 3: Run both servers
-    run_both_servers()
-    
+
+    # Step 2: Run the servers
+    if args.workers > 1:
+        run_worker_pool(args.workers, timer, args.unified, args.sfu)
+    elif args.unified:
+        run_unified_server(timer, args.sfu)
+    else:
+        run_both_servers(timer, args.sfu)
+
     return 0
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Cached static asset serving for the web app
+Only the files in ASSETS are served. Each is held in memory along with
+gzip (and brotli, when the brotli package is installed) variants, and
+reloaded when its modification time changes
+"""
+
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# URL path -> (file name, content type). Nothing else is served.
+ASSETS = {
+    "/": ("index.html", "text/html; charset=utf-8"),
+    "/index.html": ("index.html", "text/html; charset=utf-8"),
+    "/app.js": ("app.js", "text/javascript; charset=utf-8"),
+    "/style.css": ("style.css", "text/css; charset=utf-8"),
+}
+
+# The file names aren't versioned, so browsers must revalidate; with the
+# ETag that costs a 304 and no body
+CACHE_CONTROL = os.environ.get("STATIC_CACHE_CONTROL", "no-cache")
+
+# How often a cached asset's modification time is checked (seconds)
+STAT_INTERVAL = 1.0
+
+# Requests on a keep-alive connection wait this long for the next one (seconds)
+KEEPALIVE_TIMEOUT = 15
+
+# Largest request head accepted (request line and headers)
+MAX_REQUEST_HEAD = 16 * 1024
+
+class Asset:
+    """One file held in memory with its compressed variants"""
+
+    def __init__(self, path, content_type):
+        self.path = path
+        self.content_type = content_type
+        self.mtime = None
+        self.checked = 0.0
+        self.body = b""
+        self.etag = ""
+        self.variants = {}  # {content coding: compressed body}
+
+    def refresh(self):
+        """Reload the file if it changed since it was last read"""
+        now = time.monotonic()
+        if self.mtime is not None and now - self.checked < STAT_INTERVAL:
+            return
+        self.checked = now
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return
+
+        with open(self.path, "rb") as f:
+            body = f.read()
+        self.mtime = mtime
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.variants = {}
+        compressed = {"gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body)
+        for coding, data in compressed.items():
+            # Tiny files can grow when compressed
+            if len(data) < len(body):
+                self.variants[coding] = data
+        logger.info(f"Loaded {self.path} ({len(body)} bytes, {', '.join(self.variants) or 'uncompressed'})")
+
+class AssetCache:
+    """The allowlisted assets of the app, loaded on first use"""
+
+    def __init__(self, root, assets=ASSETS):
+        self.assets = {}
+        files = {}
+        for url_path, (name, content_type) in assets.items():
+            # Aliases of one file ("/" and "/index.html") share an Asset
+            if name not in files:
+                files[name] = Asset(os.path.join(root, name), content_type)
+            self.assets[url_path] = files[name]
+
+    def get(self, url_path):
+        """Return the current Asset for a URL path, or None if not served"""
+        asset = self.assets.get(url_path.split("?", 1)[0])
+        if asset is None:
+            return None
+        try:
+            asset.refresh()
+        except OSError as e:
+            logger.error(f"Can't read {asset.path}: {e}")
+            return None
+        return asset
+
+def choose_encoding(accept_encoding, variants):
+    """Pick the best available content coding the client accepts"""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    for coding in ("br", "gzip"):
+        if coding in variants and (coding in accepted or "*" in accepted):
+            return coding
+    return None
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def respond(cache, method, url_path, headers):
+    """Work out the response to a request for a static asset
+
+    headers is a mapping with lower-case names. Returns (status, reason,
+    [(name, value)], body); the body is empty for HEAD and 304 responses.
+    """
+    if method not in ("GET", "HEAD"):
+        return 405, "Method Not Allowed", [("Allow", "GET, HEAD"), ("Content-Length", "0")], b""
+    asset = cache.get(url_path)
+    if asset is None:
+        body = b"Not found\n"
+        return 404, "Not Found", [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))], body
+
+    response_headers = [
+        ("ETag", asset.etag),
+        ("Cache-Control", CACHE_CONTROL),
+        ("Vary", "Accept-Encoding"),
+    ]
+    if etag_matches(headers.get("if-none-match", ""), asset.etag):
+        return 304, "Not Modified", response_headers, b""
+
+    coding = choose_encoding(headers.get("accept-encoding", ""), asset.variants)
+    body = asset.variants[coding] if coding else asset.body
+    response_headers.append(("Content-Type", asset.content_type))
+    if coding:
+        response_headers.append(("Content-Encoding", coding))
+    response_headers.append(("Content-Length", str(len(body))))
+    return 200, "OK", response_headers, b"" if method == "HEAD" else body
+
+def parse_request_head(head):
+    """Split a request head into (method, target, version, {lower-case name: value})"""
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, version = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+def format_response(status, reason, headers, body):
+    """Encode a response as sent on the wire"""
+    lines = [f"HTTP/1.1 {status} {reason}"]
+    lines.extend(f"{name}: {value}" for name, value in headers)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+def keeps_alive(version, headers):
+    """Whether a request leaves its connection open for the next one"""
+    connection = headers.get("connection", "").lower()
+    return connection != "close" and (version == "HTTP/1.1" or connection == "keep-alive")
+
+async def serve_connection(respond_to, reader, writer):
+    """Answer HTTP/1.1 requests on one connection, keeping it alive between them
+
+    respond_to(method, target, headers) works out each response, like
+    respond() does for static assets.
+    """
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            try:
+                method, target, version, headers = parse_request_head(head[:-4])
+                length = int(headers.get("content-length", "0") or 0)
+            except ValueError:
+                length = -1
+            # Requests for static files carry no body; skip a small one if
+            # sent anyway
+            if not 0 <= length <= MAX_REQUEST_HEAD:
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            if length:
+                await reader.readexactly(length)
+
+            status, reason, response_headers, body = respond_to(method, target, headers)
+            keep_alive = keeps_alive(version, headers)
+            response_headers.append(("Connection", "keep-alive" if keep_alive else "close"))
+            writer.write(format_response(status, reason, response_headers, body))
+            await writer.drain()
+            if not keep_alive:
+                return
+    except (ConnectionError, OSError, asyncio.IncompleteReadError):
+        pass
+    except Exception as e:
+        logger.error(f"Error serving HTTP request: {e}")
+    finally:
+        writer.close()
+
+async def start_http_server(respond_to, host, port, ssl_context=None):
+    """Serve HTTP/1.1 on host:port, with responses from respond_to(method, target, headers)"""
+    return await asyncio.start_server(
+        lambda reader, writer: serve_connection(respond_to, reader, writer),
+        host, port, ssl=ssl_context, limit=MAX_REQUEST_HEAD
+    )
+
+async def start_static_server(root, host, port, ssl_context=None):
+    """Serve the app's assets from root on host:port"""
+    cache = AssetCache(root)
+    return await start_http_server(
+        lambda method, target, headers: respond(cache, method, target, headers), host, port, ssl_context
+    )
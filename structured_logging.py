@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Structured, non-blocking logging for the signaling servers
+Records are put on a queue by the event loop thread; a background thread
+formats them as JSON lines and writes them out
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+# json (one object per line) or text (the classic LEVEL:logger:message)
+LOG_FORMAT = os.environ.get("SIGNALING_LOG_FORMAT", "json")
+LOG_LEVEL = os.environ.get("SIGNALING_LOG_LEVEL", "INFO").upper()
+
+def parse_type_map(spec, convert):
+    """Parse "type=value,type=value" into {type: convert(value)}"""
+    result = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        msg_type, _, value = item.partition("=")
+        result[msg_type.strip()] = convert(value.strip())
+    return result
+
+def level_number(name):
+    return logging.getLevelName(name.upper())
+
+# Level for routine per-message logs of each message type. ICE candidates
+# come in bursts and are only worth seeing when debugging.
+TYPE_LEVELS = {"ice_candidate": logging.DEBUG, "ice_candidates": logging.DEBUG}
+TYPE_LEVELS.update(parse_type_map(os.environ.get("SIGNALING_LOG_TYPE_LEVELS", ""), level_number))
+
+# Fraction of routine per-message logs kept for each message type (default 1)
+TYPE_SAMPLE_RATES = parse_type_map(os.environ.get("SIGNALING_LOG_SAMPLE", ""), float)
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object, including its structured fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread"""
+
+    def prepare(self, record):
+        return record
+
+def setup_logging():
+    """Send all logging through a queue to a background writer thread
+
+    Like logging.basicConfig, this does nothing if the root logger already
+    has handlers.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    # Flush what's queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+def log_frame(logger, msg_type, msg, *args, **fields):
+    """Log a routine event for one message, at its type's level and sampling
+    rate; fields become keys of the JSON record
+
+    Failures should be logged with the logger directly so they are never
+    sampled away.
+    """
+    level = TYPE_LEVELS.get(msg_type, logging.INFO)
+    if not logger.isEnabledFor(level):
+        return
+    rate = TYPE_SAMPLE_RATES.get(msg_type)
+    if rate is not None and random.random() >= rate:
+        return
+    fields["type"] = msg_type
+    logger.log(level, msg, *args, extra={"fields": fields})
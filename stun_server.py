@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+A minimal STUN responder for calls on the LAN
+
+Answers STUN Binding requests (RFC 5389) with the address they came from,
+and ignores everything else: no authentication, no TURN relaying. Browsers
+hide their LAN address behind an mDNS name in host candidates; a STUN
+server on the LAN gives them a candidate with the real address, for peers
+that can't resolve mDNS names (many Android devices, some Wi-Fi networks).
+"""
+
+import asyncio
+import ipaddress
+import logging
+import struct
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC_COOKIE = 0x2112A442
+BINDING_REQUEST = 0x0001
+BINDING_SUCCESS = 0x0101
+XOR_MAPPED_ADDRESS = 0x0020
+FINGERPRINT = 0x8028
+FINGERPRINT_XOR = 0x5354554E
+
+HEADER = struct.Struct("!HHI12s")
+
+def xor_mapped_address(addr, transaction_id):
+    """Encode the XOR-MAPPED-ADDRESS attribute for a (host, port, ...) address"""
+    ip = ipaddress.ip_address(addr[0])
+    port = addr[1] ^ (MAGIC_COOKIE >> 16)
+    mask = struct.pack("!I", MAGIC_COOKIE) + transaction_id
+    packed = bytes(a ^ b for a, b in zip(ip.packed, mask))
+    family = 0x01 if ip.version == 4 else 0x02
+    value = struct.pack("!xBH", family, port) + packed
+    return struct.pack("!HH", XOR_MAPPED_ADDRESS, len(value)) + value
+
+def binding_response(data, addr):
+    """Answer a datagram, returning None unless it is a Binding request"""
+    if len(data) < HEADER.size:
+        return None
+    msg_type, length, cookie, transaction_id = HEADER.unpack_from(data)
+    if msg_type != BINDING_REQUEST or cookie != MAGIC_COOKIE or length != len(data) - HEADER.size:
+        return None
+
+    attributes = xor_mapped_address(addr, transaction_id)
+    # The fingerprint covers the header, with a length that includes it
+    message = HEADER.pack(BINDING_SUCCESS, len(attributes) + 8, MAGIC_COOKIE, transaction_id) + attributes
+    crc = (zlib.crc32(message) ^ FINGERPRINT_XOR) & 0xFFFFFFFF
+    return message + struct.pack("!HHI", FINGERPRINT, 4, crc)
+
+class StunProtocol(asyncio.DatagramProtocol):
+    """Answers Binding requests on one UDP socket"""
+
+    def __init__(self):
+        self.transport = None
+        self.requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        response = binding_response(data, addr)
+        if response is not None:
+            self.requests += 1
+            self.transport.sendto(response, addr)
+
+    def error_received(self, exc):
+        # ICMP errors from clients that went away; nothing to do
+        logger.debug(f"STUN socket error: {exc}")
+
+async def start_stun_server(host, port, reuse_port=False):
+    """Start answering STUN requests on a UDP port, returning the protocol"""
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_datagram_endpoint(
+        StunProtocol, local_addr=(host, port), reuse_port=reuse_port or None
+    )
+    return protocol
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a standalone STUN responder")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=3478, help="UDP port to listen on")
+    args = parser.parse_args()
+
+    async def serve():
+        await start_stun_server(args.host, args.port)
+        print(f"STUN responder listening on udp://{args.host}:{args.port}")
+        await asyncio.Future()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,93 @@
+import asyncio
+
+from websockets.protocol import State
+
+from heartbeat import Heartbeat
+
+class FakeWebSocket:
+    """Answers pings at once, unless it stopped reading: then its writing is
+    paused and ping() blocks, as it does on a real connection"""
+
+    def __init__(self, reading=True):
+        self.state = State.OPEN
+        self.paused = not reading
+        self.pings = 0
+
+    async def ping(self):
+        self.pings += 1
+        if self.paused:
+            await asyncio.Future()
+        pong_received = asyncio.get_running_loop().create_future()
+        pong_received.set_result(0.0)
+        return pong_received
+
+def run(test):
+    """Run a coroutine test function to completion"""
+    asyncio.run(test())
+
+def stop_clock():
+    """Freeze the loop's clock, for turns() to move forward a tick at a time"""
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    loop.time = lambda: now
+
+async def turns(heartbeat, count):
+    loop = asyncio.get_running_loop()
+    for _ in range(count):
+        now = loop.time() + heartbeat.tick
+        loop.time = lambda: now
+        heartbeat.turn()
+        # Let ping tasks run
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+def test_answering_connections_stay_alive():
+    async def test():
+        dead = []
+        stop_clock()
+        heartbeat = Heartbeat(interval=2, timeout=2, on_dead=dead.extend, tick=1)
+        websocket = FakeWebSocket()
+        heartbeat.add(websocket)
+        await turns(heartbeat, 10)
+        assert websocket.pings > 0
+        assert dead == []
+        heartbeat.stop()
+    run(test)
+
+def test_connection_that_stopped_reading_is_reaped():
+    async def test():
+        batches = []
+        stop_clock()
+        heartbeat = Heartbeat(interval=2, timeout=2, on_dead=batches.append, tick=1)
+        alive = FakeWebSocket()
+        stalled = [FakeWebSocket(reading=False) for _ in range(3)]
+        for websocket in [alive, *stalled]:
+            heartbeat.add(websocket)
+        await turns(heartbeat, 6)
+        # Never pinged, so nothing is left waiting on a full write buffer
+        assert all(websocket.pings == 0 for websocket in stalled)
+        # Found on the same tick, so reported together
+        assert len(batches) == 1
+        assert set(batches[0]) == set(stalled)
+        assert len(heartbeat) == 1
+        heartbeat.stop()
+    run(test)
+
+def test_blocked_ping_does_not_hold_up_the_wheel():
+    async def test():
+        dead = []
+        stop_clock()
+        heartbeat = Heartbeat(interval=2, timeout=2, on_dead=dead.extend, tick=1)
+        # Writing pauses only after the check, so the ping itself blocks
+        stuck = FakeWebSocket()
+        async def blocked_ping():
+            await asyncio.Future()
+        stuck.ping = blocked_ping
+        alive = FakeWebSocket()
+        heartbeat.add(stuck)
+        heartbeat.add(alive)
+        await turns(heartbeat, 6)
+        assert dead == [stuck]
+        assert alive.pings > 0
+        heartbeat.stop()
+    run(test)
@@ -0,0 +1,167 @@
+import asyncio
+
+import pytest
+from websockets.exceptions import ConnectionClosedError
+
+from outbox import (
+    CLOSE_SLOW_CONSUMER, KIND_ICE, KIND_PRESENCE, KIND_SIGNAL, POLICY_COALESCE,
+    POLICY_DISCONNECT, POLICY_DROP_OLDEST_ICE, Outbox,
+)
+
+class FakeWebSocket:
+    """Records what is written to it; send() fails while cut_off is set"""
+
+    def __init__(self, cut_off=False):
+        self.sent = []
+        self.closed_with = None
+        self.cut_off = cut_off
+
+    async def send(self, frame):
+        await asyncio.sleep(0)
+        if self.cut_off:
+            raise ConnectionClosedError(None, None)
+        self.sent.append(frame)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+def run(test):
+    """Run a coroutine test function to completion"""
+    asyncio.run(test())
+
+async def settle():
+    # Let writer and close tasks run
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+def queued(outbox):
+    return [frame for _, frame, _ in outbox.frames]
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        Outbox(FakeWebSocket(), policy="drop_everything")
+
+def test_drop_oldest_ice_discards_the_oldest_candidate():
+    async def test():
+        outbox = Outbox(FakeWebSocket(), limit=3, policy=POLICY_DROP_OLDEST_ICE)
+        assert outbox.push("offer")
+        assert outbox.push("ice-1", KIND_ICE)
+        assert outbox.push("ice-2", KIND_ICE)
+        assert outbox.push("answer")
+        assert queued(outbox) == ["offer", "ice-2", "answer"]
+        assert outbox.dropped == 1
+        assert not outbox.closed
+    run(test)
+
+def test_drop_oldest_ice_disconnects_without_a_candidate_to_drop():
+    async def test():
+        websocket = FakeWebSocket()
+        outbox = Outbox(websocket, limit=2, policy=POLICY_DROP_OLDEST_ICE)
+        outbox.push("offer")
+        outbox.push("roster", KIND_PRESENCE)
+        assert not outbox.push("answer")
+        await settle()
+        assert outbox.closed
+        assert len(outbox) == 0
+        assert outbox.dropped == 2
+        assert websocket.closed_with == CLOSE_SLOW_CONSUMER
+        assert not outbox.push("late")
+    run(test)
+
+def test_coalesce_collapses_roster_updates_into_one_snapshot():
+    async def test():
+        websocket = FakeWebSocket()
+        outbox = Outbox(websocket, limit=3, policy=POLICY_COALESCE, snapshot=lambda ws: "snapshot")
+        outbox.push("joined", KIND_PRESENCE)
+        outbox.push("offer")
+        outbox.push("left", KIND_PRESENCE)
+        assert outbox.push("renamed", KIND_PRESENCE)
+        assert outbox.dropped == 2
+        assert [kind for kind, _, _ in outbox.frames] == [KIND_SIGNAL, KIND_PRESENCE, KIND_PRESENCE]
+
+        # The snapshot is built when it is written
+        outbox.start()
+        await settle()
+        assert websocket.sent == ["offer", "snapshot", "renamed"]
+    run(test)
+
+def test_coalesce_disconnects_without_roster_updates():
+    async def test():
+        websocket = FakeWebSocket()
+        outbox = Outbox(websocket, limit=2, policy=POLICY_COALESCE, snapshot=lambda ws: "snapshot")
+        outbox.push("offer")
+        outbox.push("ice", KIND_ICE)
+        assert not outbox.push("answer")
+        await settle()
+        assert outbox.closed
+        assert websocket.closed_with == CLOSE_SLOW_CONSUMER
+    run(test)
+
+def test_disconnect_policy_closes_on_overflow():
+    async def test():
+        websocket = FakeWebSocket()
+        outbox = Outbox(websocket, limit=2, policy=POLICY_DISCONNECT)
+        outbox.push("ice-1", KIND_ICE)
+        outbox.push("ice-2", KIND_ICE)
+        assert not outbox.push("ice-3", KIND_ICE)
+        await settle()
+        assert outbox.closed
+        assert outbox.dropped == 2
+        assert websocket.closed_with == CLOSE_SLOW_CONSUMER
+    run(test)
+
+def test_writes_in_order_and_reports_send_latency():
+    async def test():
+        websocket = FakeWebSocket()
+        latencies = []
+        outbox = Outbox(websocket, on_sent=latencies.append)
+        outbox.start()
+        outbox.push("offer", started=1.5)
+        outbox.push("ice", KIND_ICE)
+        await settle()
+        assert websocket.sent == ["offer", "ice"]
+        assert latencies == [1.5]
+        assert outbox.high_water == 2
+        outbox.close()
+    run(test)
+
+def test_detached_outbox_queues_until_attached():
+    async def test():
+        first = FakeWebSocket()
+        outbox = Outbox(first)
+        outbox.start()
+        outbox.push("offer")
+        await settle()
+        outbox.detach()
+        outbox.push("ice-1", KIND_ICE)
+        outbox.push("ice-2", KIND_ICE)
+        await settle()
+        assert first.sent == ["offer"]
+        assert len(outbox) == 2
+
+        second = FakeWebSocket()
+        outbox.attach(second)
+        await settle()
+        assert second.sent == ["ice-1", "ice-2"]
+        assert len(outbox) == 0
+        outbox.close()
+    run(test)
+
+def test_frame_cut_off_mid_send_is_requeued():
+    async def test():
+        first = FakeWebSocket(cut_off=True)
+        outbox = Outbox(first)
+        outbox.start()
+        outbox.push("offer")
+        outbox.push("ice", KIND_ICE)
+        await settle()
+        # The writer stopped on the closed connection, keeping both frames
+        assert outbox.task.done()
+        assert queued(outbox) == ["offer", "ice"]
+
+        second = FakeWebSocket()
+        outbox.attach(second)
+        await settle()
+        assert second.sent == ["offer", "ice"]
+        outbox.close()
+    run(test)
@@ -0,0 +1,181 @@
+import asyncio
+
+import presence_bus
+from presence_bus import LocalBus
+
+class Worker:
+    """A simulated signaling worker attached to a LocalBus"""
+
+    def __init__(self, bus, worker_id):
+        self.bus = bus
+        self.worker_id = worker_id
+        self.received = []
+        self.handle = None
+
+    async def start(self):
+        self.handle = await self.bus.start(self.worker_id, self.received.append)
+        return self
+
+    def publish(self, **message):
+        self.handle.publish(message)
+
+    def take(self):
+        """The messages received since the last call"""
+        received = list(self.received)
+        self.received.clear()
+        return received
+
+def run(test):
+    """Run a coroutine test function with a fresh bus and two workers"""
+    async def main():
+        bus = LocalBus()
+        first = await Worker(bus, "w1").start()
+        second = await Worker(bus, "w2").start()
+        first.take()
+        second.take()
+        await test(bus, first, second)
+    asyncio.run(main())
+
+def deltas(messages):
+    return [(message["room"], message["delta"]) for message in messages if message["op"] == "presence"]
+
+def test_join_is_broadcast_to_every_worker_with_a_version():
+    async def test(bus, first, second):
+        first.publish(op="join", id="alice", name="Alice", room="lobby")
+        expected = [("lobby", {"type": "peer_joined", "client": {"id": "alice", "name": "Alice"}, "version": 1})]
+        assert deltas(first.take()) == expected
+        assert deltas(second.take()) == expected
+        assert bus.hub.clients["alice"] == {"id": "alice", "name": "Alice", "room": "lobby", "worker": "w1"}
+    run(test)
+
+def test_versions_are_stamped_per_room():
+    async def test(bus, first, second):
+        first.publish(op="join", id="alice", name="Alice", room="lobby")
+        first.publish(op="join", id="bob", name="Bob", room="lobby")
+        first.publish(op="join", id="carol", name="Carol", room="kitchen")
+        first.publish(op="rename", id="alice", name="Alicia")
+        versions = [(room, delta["version"]) for room, delta in deltas(second.take())]
+        assert versions == [("lobby", 1), ("lobby", 2), ("kitchen", 1), ("lobby", 3)]
+        assert bus.hub.versions == {"lobby": 3, "kitchen": 1}
+    run(test)
+
+def test_an_emptied_room_is_forgotten_and_its_versions_never_go_back():
+    async def test(bus, first, second):
+        first.publish(op="join", id="alice", name="Alice", room="kitchen")
+        first.publish(op="join", id="bob", name="Bob", room="kitchen")
+        first.publish(op="leave", id="alice")
+        second.take()
+        first.publish(op="leave_many", ids=["bob"])
+        assert deltas(second.take()) == [("kitchen", {"type": "peers_left", "ids": ["bob"], "version": 4})]
+        assert bus.hub.versions == {}
+        assert bus.hub.room_sizes == {}
+
+        first.publish(op="join", id="carol", name="Carol", room="kitchen")
+        assert [delta["version"] for _, delta in deltas(second.take())] == [5]
+        third = await Worker(bus, "w3").start()
+        assert third.take()[0] == {"op": "snapshot_begin", "version_floor": 4}
+    run(test)
+
+def test_registering_on_another_worker_evicts_the_old_connection():
+    async def test(bus, first, second):
+        first.publish(op="join", id="alice", name="Alice", room="lobby")
+        first.take()
+        second.take()
+        second.publish(op="join", id="alice", name="Alice", room="lobby")
+        received = first.take()
+        assert {"op": "evict", "id": "alice"} in received
+        assert deltas(received) == [("lobby", {"type": "peer_renamed", "id": "alice", "name": "Alice", "version": 2})]
+        assert not any(message["op"] == "evict" for message in second.take())
+        assert bus.hub.clients["alice"]["worker"] == "w2"
+    run(test)
+
+def test_moving_rooms_leaves_the_old_room():
+    async def test(bus, first, second):
+        first.publish(op="join", id="alice", name="Alice", room="lobby")
+        second.take()
+        first.publish(op="join", id="alice", name="Alice", room="kitchen")
+        assert deltas(second.take()) == [
+            ("lobby", {"type": "peer_left", "id": "alice", "version": 2}),
+            ("kitchen", {"type": "peer_joined", "client": {"id": "alice", "name": "Alice"}, "version": 3}),
+        ]
+        assert bus.hub.clients["alice"]["room"] == "kitchen"
+        assert bus.hub.versions == {"kitchen": 3}
+    run(test)
+
+def test_stale_leave_and_rename_from_the_old_worker_are_ignored():
+    async def test(bus, first, second):
+        first.publish(op="join", id="alice", name="Alice", room="lobby")
+        second.publish(op="join", id="alice", name="Alice", room="lobby")
+        first.take()
+        second.take()
+        # The old connection closing after the eviction
+        first.publish(op="rename", id="alice", name="Old Alice")
+        first.publish(op="leave", id="alice")
+        first.publish(op="leave_many", ids=["alice"])
+        assert first.take() == []
+        assert second.take() == []
+        assert bus.hub.clients["alice"] == {"id": "alice", "name": "Alice", "room": "lobby", "worker": "w2"}
+    run(test)
+
+def test_leave_many_sends_one_delta_per_room():
+    async def test(bus, first, second):
+        first.publish(op="join", id="alice", name="Alice", room="lobby")
+        first.publish(op="join", id="bob", name="Bob", room="lobby")
+        first.publish(op="join", id="carol", name="Carol", room="kitchen")
+        second.publish(op="join", id="dave", name="Dave", room="lobby")
+        second.take()
+        first.publish(op="leave_many", ids=["alice", "bob", "carol", "dave", "nobody"])
+        assert deltas(second.take()) == [
+            ("lobby", {"type": "peers_left", "ids": ["alice", "bob"], "version": 4}),
+            ("kitchen", {"type": "peers_left", "ids": ["carol"], "version": 2}),
+        ]
+        assert list(bus.hub.clients) == ["dave"]
+    run(test)
+
+def test_closing_a_worker_drops_its_clients():
+    async def test(bus, first, second):
+        first.publish(op="join", id="alice", name="Alice", room="lobby")
+        second.publish(op="join", id="bob", name="Bob", room="lobby")
+        first.take()
+        second.take()
+        await first.handle.close()
+        assert deltas(second.take()) == [("lobby", {"type": "peers_left", "ids": ["alice"], "version": 3})]
+        assert list(bus.hub.clients) == ["bob"]
+        # A closed worker no longer receives anything
+        second.publish(op="rename", id="bob", name="Robert")
+        assert first.take() == []
+    run(test)
+
+def test_forward_is_delivered_to_the_target_worker_only():
+    async def test(bus, first, second):
+        first.publish(op="forward", worker="w2", target_id="bob", type="offer", raw="{}")
+        assert first.take() == []
+        assert second.take() == [{"op": "deliver", "worker": "w2", "target_id": "bob", "type": "offer", "raw": "{}"}]
+    run(test)
+
+def test_a_new_worker_receives_the_roster_in_chunks(monkeypatch):
+    monkeypatch.setattr(presence_bus, "SNAPSHOT_CHUNK_BYTES", 200)
+
+    async def test(bus, first, second):
+        for index in range(20):
+            first.publish(op="join", id=f"user-{index}", name=f"User {index}", room=f"room-{index % 3}")
+        third = await Worker(bus, "w3").start()
+        received = third.take()
+        assert received[0] == {"op": "snapshot_begin", "version_floor": 0}
+        assert received[-1] == {"op": "snapshot_end"}
+        chunks = received[1:-1]
+        assert len(chunks) > 1
+        assert all(chunk["op"] == "snapshot_chunk" for chunk in chunks)
+        clients = [client for chunk in chunks for client in chunk["clients"]]
+        assert clients == list(bus.hub.clients.values())
+        versions = {}
+        for chunk in chunks:
+            versions.update(chunk["versions"])
+        assert versions == bus.hub.versions
+    run(test)
+
+def test_an_empty_roster_snapshot_has_no_chunks():
+    async def test(bus, first, second):
+        third = await Worker(bus, "w3").start()
+        assert third.take() == [{"op": "snapshot_begin", "version_floor": 0}, {"op": "snapshot_end"}]
+    run(test)
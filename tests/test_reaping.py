@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import websockets
+
+import signaling_server
+
+def run(test):
+    """Run a coroutine test function to completion"""
+    asyncio.run(test())
+
+async def register(url, user_id, room):
+    websocket = await websockets.connect(url, close_timeout=0.1)
+    await websocket.send(json.dumps({"type": "register", "user_id": user_id, "room": room, "protocol": 2}))
+    return websocket
+
+async def collect(websocket, seconds):
+    """Messages a client receives over the next few seconds"""
+    messages = []
+    try:
+        async with asyncio.timeout(seconds):
+            async for frame in websocket:
+                messages.append(json.loads(frame))
+    except TimeoutError:
+        pass
+    return messages
+
+def test_reaped_sessions_leave_each_room_in_one_update(monkeypatch):
+    async def test():
+        monkeypatch.setattr(signaling_server, "RESUME_GRACE", 0.3)
+        await signaling_server.start_bus()
+        server = await websockets.serve(signaling_server.handler, "127.0.0.1", 0,
+                                        process_request=signaling_server.process_request)
+        url = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        try:
+            observers = {room: await register(url, f"observer-{room}", room) for room in ("kitchen", "office")}
+            clients = [await register(url, f"ghost-{room}-{n}", room)
+                       for room in ("kitchen", "office") for n in range(15)]
+            await asyncio.sleep(0.2)
+            for observer in observers.values():
+                await collect(observer, 0.1)
+
+            signaling_server.reap_connections([
+                signaling_server.registry.socket_for(f"ghost-{room}-{n}")
+                for room in ("kitchen", "office") for n in range(15)
+            ])
+            # The sessions are kept for the grace period, then leave
+            received = await asyncio.gather(*(collect(observer, 1.0) for observer in observers.values()))
+            for room, messages in zip(observers, received):
+                departures = [m for m in messages if m["type"] in ("peer_left", "peers_left")]
+                assert [m["type"] for m in departures] == ["peers_left"]
+                assert sorted(departures[0]["ids"]) == sorted(f"ghost-{room}-{n}" for n in range(15))
+
+            for websocket in [*observers.values(), *clients]:
+                await websocket.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+    run(test)
@@ -0,0 +1,83 @@
+import asyncio
+import functools
+
+import websockets
+
+from unified_connection import UnifiedConnection
+
+UPGRADE = (
+    b"GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+    b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n"
+)
+
+def respond_to(method, target, headers):
+    body = f"{method} {target}".encode()
+    return 200, "OK", [("Content-Length", str(len(body)))], body
+
+async def handler(websocket):
+    async for message in websocket:
+        await websocket.send(message)
+
+async def read_response(reader):
+    """Read one response, returning (status line, {lower-case header: value}, body)"""
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = {}
+    for line in head[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", "0")))
+    return head[0], headers, body
+
+def run(test):
+    """Run a coroutine test function against a server using UnifiedConnection"""
+    async def main():
+        create_connection = functools.partial(UnifiedConnection, respond_to=respond_to)
+        async with websockets.serve(handler, "127.0.0.1", 0, create_connection=create_connection) as server:
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            try:
+                await test(reader, writer)
+            finally:
+                writer.close()
+    asyncio.run(main())
+
+def test_plain_requests_share_one_connection():
+    async def test(reader, writer):
+        # Pipelined, then one more after the answers
+        writer.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\nGET /app.js HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        status, headers, body = await read_response(reader)
+        assert (status, headers["connection"], body) == ("HTTP/1.1 200 OK", "keep-alive", b"GET /")
+        assert (await read_response(reader))[2] == b"GET /app.js"
+        writer.write(b"HEAD /style.css HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        assert (await read_response(reader))[2] == b"HEAD /style.css"
+    run(test)
+
+def test_http_1_0_closes_after_the_response():
+    async def test(reader, writer):
+        writer.write(b"GET / HTTP/1.0\r\n\r\n")
+        status, headers, body = await read_response(reader)
+        assert headers["connection"] == "close"
+        assert await reader.read() == b""
+    run(test)
+
+def test_upgrade_after_plain_requests_hands_over_to_websockets():
+    async def test(reader, writer):
+        writer.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await read_response(reader)
+        writer.write(UPGRADE)
+        status, headers, _ = await read_response(reader)
+        assert status == "HTTP/1.1 101 Switching Protocols"
+        assert headers["upgrade"] == "websocket"
+        # A masked text frame, "hi", comes back from the echo handler
+        writer.write(bytes([0x81, 0x82, 1, 2, 3, 4, ord("h") ^ 1, ord("i") ^ 2]))
+        assert await reader.readexactly(4) == bytes([0x81, 0x02]) + b"hi"
+    run(test)
+
+def test_malformed_request_is_rejected():
+    async def test(reader, writer):
+        writer.write(b"GET / HTTP/1.1\r\nContent-Length: lots\r\n\r\n")
+        status, headers, _ = await read_response(reader)
+        assert status == "HTTP/1.1 400 Bad Request"
+        assert await reader.read() == b""
+    run(test)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+The TLS settings shared by the HTTPS and signaling servers
+Every server in a process uses one context, so its session cache and
+ticket keys let reconnecting clients resume instead of doing a full
+handshake
+"""
+
+import functools
+import ssl
+
+CERT_FILE = "server.crt"
+KEY_FILE = "server.key"
+
+# Forward-secret AEAD suites only; applies to TLS 1.2, TLS 1.3 suites are
+# all fine. Matches either an ECDSA or an RSA certificate.
+CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20"
+
+# TLS 1.3 tickets issued per handshake; a page load opens several
+# connections, each of which can resume with its own ticket
+SESSION_TICKETS = 4
+
+@functools.lru_cache(maxsize=None)
+def server_context(cert_file=CERT_FILE, key_file=KEY_FILE):
+    """Return the process's server SSLContext for a certificate, loading it once"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(CIPHERS)
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = SESSION_TICKETS
+    context.load_cert_chain(cert_file, key_file)
+    return context
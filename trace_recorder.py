@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Append-only recording of the signaling traffic a server receives
+Traces are replayed against a server with benchmarks/replay_trace.py
+
+A trace is a text file of JSON lines. The first line is a header,
+{"trace": 1, "start": <unix time>}, and every line after it is one event:
+[seconds since start, connection number, kind, frame]
+where kind is "o" (connection opened), "m" (frame received) or "c"
+(connection closed), and frame is only present for "m".
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+TRACE_VERSION = 1
+
+# How often buffered events are flushed to disk (seconds)
+FLUSH_INTERVAL = 1.0
+
+# SDP bodies and ICE candidate strings carry addresses and fingerprints;
+# redaction keeps their length so replays still move the same bytes
+REDACTED_FIELDS = re.compile(r'("(?:sdp|candidate)"\s*:\s*")((?:[^"\\]|\\.)*)"')
+
+def redact(frame):
+    """Blank out SDP bodies and candidates in a frame, keeping its size"""
+    return REDACTED_FIELDS.sub(lambda m: m.group(1) + "x" * len(m.group(2)) + '"', frame)
+
+class TraceRecorder:
+    """Writes inbound connections and frames to a trace file
+
+    Events are buffered and flushed every FLUSH_INTERVAL seconds, so
+    recording costs one list append per frame on the event loop.
+    """
+
+    def __init__(self, path, redact_sdp=False):
+        self.path = path
+        self.redact_sdp = redact_sdp
+        self.file = open(path, "a", encoding="utf-8")
+        self.start = time.time()
+        self.clock_start = time.perf_counter()
+        self.next_connection = 0
+        self.buffer = []
+        self.file.write(json.dumps({"trace": TRACE_VERSION, "start": self.start}) + "\n")
+
+    def record(self, connection, kind, frame=None):
+        event = [round(time.perf_counter() - self.clock_start, 6), connection, kind]
+        if frame is not None:
+            if isinstance(frame, bytes):
+                frame = frame.decode(errors="replace")
+            event.append(redact(frame) if self.redact_sdp else frame)
+        self.buffer.append(event)
+
+    def opened(self):
+        """Record a new connection, returning its number in the trace"""
+        self.next_connection += 1
+        self.record(self.next_connection, "o")
+        return self.next_connection
+
+    def frame(self, connection, frame):
+        self.record(connection, "m", frame)
+
+    def closed(self, connection):
+        self.record(connection, "c")
+
+    def flush(self):
+        if self.buffer:
+            lines = [json.dumps(event, separators=(",", ":")) for event in self.buffer]
+            self.buffer.clear()
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+
+    async def run(self):
+        """Flush buffered events periodically"""
+        try:
+            while True:
+                await asyncio.sleep(FLUSH_INTERVAL)
+                self.flush()
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+            logger.info(f"Trace written to {self.path}")
+
+def read_trace(path):
+    """Load a trace file, returning (header, events)
+
+    A file appended to by several server runs holds one segment per run;
+    their events are merged onto the first segment's clock, with connection
+    numbers kept apart.
+    """
+    header = None
+    events = []
+    offset = 0.0
+    connection_base = 0
+    last_connection = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, dict):
+                if entry.get("trace") != TRACE_VERSION:
+                    raise ValueError(f"Unsupported trace version: {entry.get('trace')}")
+                if header is None:
+                    header = entry
+                offset = entry["start"] - header["start"]
+                connection_base = last_connection
+                continue
+            entry[0] += offset
+            entry[1] += connection_base
+            last_connection = max(last_connection, entry[1])
+            events.append(entry)
+    if header is None:
+        raise ValueError(f"{path} is not a signaling trace")
+    events.sort(key=lambda event: event[0])
+    return header, events
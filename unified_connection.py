@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Connections for unified mode, where the web app and the WebSocket share a port
+websockets closes a connection after any response that isn't an upgrade, so
+each asset of a page load would cost its own TLS handshake. A
+UnifiedConnection answers plain HTTP requests itself, keeping the connection
+alive between them, and hands it to websockets when a request asks for an
+upgrade
+"""
+
+import asyncio
+import logging
+
+from websockets.asyncio.server import ServerConnection
+
+from static_files import KEEPALIVE_TIMEOUT, MAX_REQUEST_HEAD, format_response, keeps_alive, parse_request_head
+
+logger = logging.getLogger(__name__)
+
+BAD_REQUEST = b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+class UnifiedConnection(ServerConnection):
+    """A websockets connection that serves plain HTTP until a request asks
+    for a WebSocket upgrade
+
+    respond_to(method, target, headers) answers the plain requests, like
+    static_files.respond() does. Pass functools.partial(UnifiedConnection,
+    respond_to=...) to websockets.serve() as create_connection.
+    """
+
+    def __init__(self, protocol, server, *, respond_to, **kwargs):
+        super().__init__(protocol, server, **kwargs)
+        self.respond_to = respond_to
+        self.upgraded = False
+        self.http_transport = None
+        self.buffer = b""
+        self.idle_timer = None
+        self.reading_paused = False
+
+    def connection_made(self, transport):
+        # websockets only learns about the connection when it is upgraded
+        self.http_transport = transport
+        self.reset_idle_timer()
+
+    def reset_idle_timer(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+        self.idle_timer = asyncio.get_running_loop().call_later(KEEPALIVE_TIMEOUT, self.http_transport.close)
+
+    def data_received(self, data):
+        if self.upgraded:
+            super().data_received(data)
+            return
+        self.buffer += data
+        try:
+            self.serve_requests()
+        except Exception as e:
+            logger.error(f"Error serving HTTP request: {e}")
+            self.http_transport.close()
+
+    def serve_requests(self):
+        """Answer every complete request in the buffer"""
+        while not self.upgraded and not self.http_transport.is_closing():
+            end = self.buffer.find(b"\r\n\r\n")
+            if end < 0:
+                if len(self.buffer) > MAX_REQUEST_HEAD:
+                    self.reject()
+                return
+            try:
+                method, target, version, headers = parse_request_head(self.buffer[:end])
+                length = int(headers.get("content-length", "0") or 0)
+            except ValueError:
+                length = -1
+            if not 0 <= length <= MAX_REQUEST_HEAD:
+                self.reject()
+                return
+
+            if headers.get("upgrade", "").lower() == "websocket":
+                self.upgrade()
+                return
+
+            # Requests for static files carry no body; skip a small one if
+            # sent anyway
+            if len(self.buffer) < end + 4 + length:
+                return
+            self.buffer = self.buffer[end + 4 + length:]
+
+            status, reason, response_headers, body = self.respond_to(method, target, headers)
+            keep_alive = keeps_alive(version, headers)
+            response_headers.append(("Connection", "keep-alive" if keep_alive else "close"))
+            self.http_transport.write(format_response(status, reason, response_headers, body))
+            if not keep_alive:
+                self.http_transport.close()
+                return
+            self.reset_idle_timer()
+
+    def reject(self):
+        self.http_transport.write(BAD_REQUEST)
+        self.http_transport.close()
+
+    def upgrade(self):
+        """Hand the connection, starting with the upgrade request, to websockets"""
+        self.upgraded = True
+        self.idle_timer.cancel()
+        buffered, self.buffer = self.buffer, b""
+        super().connection_made(self.http_transport)
+        super().data_received(buffered)
+
+    # Until the upgrade, writing too far ahead of a client (pipelined
+    # requests it doesn't read the answers to) stops reading its requests
+
+    def pause_writing(self):
+        if self.upgraded:
+            super().pause_writing()
+        else:
+            self.reading_paused = True
+            self.http_transport.pause_reading()
+
+    def resume_writing(self):
+        if self.reading_paused:
+            self.reading_paused = False
+            self.http_transport.resume_reading()
+        if self.paused:
+            super().resume_writing()
+
+    def eof_received(self):
+        if self.upgraded:
+            return super().eof_received()
+        return None
+
+    def connection_lost(self, exc):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+        if self.upgraded:
+            super().connection_lost(exc)